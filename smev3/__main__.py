@@ -0,0 +1,5 @@
+import sys
+
+from smev3.cli import main
+
+sys.exit(main())
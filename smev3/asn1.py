@@ -0,0 +1,119 @@
+import base64
+import re
+
+from smev3.exceptions import CertificateError
+
+INTEGER = 0x02
+BIT_STRING = 0x03
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+SET = 0x31
+
+PEM_PATTERN = re.compile(rb'-----BEGIN (?P<label>[A-Z0-9 ]+)-----(?P<data>[a-zA-Z0-9+/=\s]+)-----END (?P=label)-----')
+
+
+def pem_to_der(data, label=None):
+    """Извлечение DER из PEM.
+    :param data :type bytes - содержимое PEM файла
+    :param label :type str - ожидаемая метка блока (CERTIFICATE, PRIVATE KEY...), по умолчанию первый блок
+    :return tuple (метка, DER bytes)"""
+    for match in PEM_PATTERN.finditer(data):
+        found = match.group('label').decode()
+        if label is None or found == label:
+            return found, base64.b64decode(b''.join(match.group('data').split()))
+    raise CertificateError('Unable to find PEM block %s' % (label or ''))
+
+
+def read_tlv(data, offset=0):
+    """Чтение одного элемента DER.
+    :param data :type bytes
+    :param offset :type int
+    :return tuple (тег, начало значения, конец значения)"""
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            count = length & 0x7f
+            length = int.from_bytes(data[offset:offset + count], 'big')
+            offset += count
+    except IndexError:
+        raise CertificateError('Malformed DER data')
+    end = offset + length
+    if end > len(data):
+        raise CertificateError('Malformed DER data')
+    return tag, offset, end
+
+
+def children(data, start=0, end=None):
+    """Список элементов (тег, bytes значения, bytes элемента целиком) внутри конструкции"""
+    end = len(data) if end is None else end
+    result = []
+    offset = start
+    while offset < end:
+        tag, value_start, value_end = read_tlv(data, offset)
+        result.append((tag, data[value_start:value_end], data[offset:value_end]))
+        offset = value_end
+    return result
+
+
+def expect(item, tag):
+    """Проверка тега элемента, возвращает значение"""
+    if item[0] != tag:
+        raise CertificateError('Unexpected DER tag 0x%02x, expected 0x%02x' % (item[0], tag))
+    return item[1]
+
+
+def decode_oid(value):
+    """OBJECT IDENTIFIER в точечную нотацию"""
+    numbers = []
+    current = 0
+    for byte in value:
+        current = (current << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            numbers.append(current)
+            current = 0
+    first = min(numbers[0] // 40, 2)
+    return '.'.join(str(n) for n in [first, numbers[0] - 40 * first] + numbers[1:])
+
+
+def decode_integer(value):
+    return int.from_bytes(value, 'big', signed=True)
+
+
+def encode_tlv(tag, value):
+    """Элемент DER из тега и значения"""
+    length = len(value)
+    if length < 0x80:
+        return bytes((tag, length)) + value
+    size = (length.bit_length() + 7) // 8
+    return bytes((tag, 0x80 | size)) + length.to_bytes(size, 'big') + value
+
+
+def encode_oid(oid):
+    """OBJECT IDENTIFIER из точечной нотации"""
+    numbers = [int(n) for n in oid.split('.')]
+    result = bytearray()
+    for number in [40 * numbers[0] + numbers[1]] + numbers[2:]:
+        chunk = [number & 0x7f]
+        number >>= 7
+        while number:
+            chunk.append(0x80 | (number & 0x7f))
+            number >>= 7
+        result.extend(reversed(chunk))
+    return encode_tlv(OBJECT_IDENTIFIER, bytes(result))
+
+
+def encode_integer(number):
+    return encode_tlv(INTEGER, number.to_bytes(number.bit_length() // 8 + 1, 'big', signed=True))
+
+
+def encode_sequence(*items):
+    return encode_tlv(SEQUENCE, b''.join(items))
+
+
+def encode_set(*items):
+    """SET OF: элементы упорядочиваются по правилам DER"""
+    return encode_tlv(SET, b''.join(sorted(items)))
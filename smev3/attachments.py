@@ -0,0 +1,167 @@
+import base64
+import mmap
+import os
+import uuid
+
+from smev3 import asn1
+from smev3.digest import new_digest
+from smev3.exceptions import PluginError
+
+# размер куска чтения файла, кратен 3: куски base64 склеиваются без выравнивания
+CHUNK_SIZE = 3 << 16
+
+SIGNED_DATA = '1.2.840.113549.1.7.2'
+DATA = '1.2.840.113549.1.7.1'
+GOST_R3411_94 = '1.2.643.2.2.9'
+GOST_R3410_2001 = '1.2.643.2.2.19'
+
+PLACEHOLDER = '{ATTACHMENT:%s}'
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    """Чтение файла кусками, файл целиком в память не загружается"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def file_digest(path, chunk_size=CHUNK_SIZE, use_mmap=True, backend=None):
+    """Хэш ГОСТ Р 34.11-94 файла.
+    Файл отображается в память (mmap) и передается в хэш кусками без копирования,
+    при недоступности mmap читается кусками.
+    :param path :type str
+    :param backend - бэкенд хэширования, по умолчанию из smev3.digest
+    :return bytes"""
+    digest = new_digest(backend=backend)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if use_mmap and size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(0, size, chunk_size):
+                    digest.update(view[offset:offset + chunk_size])
+        else:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.digest()
+
+
+def certificate_issuer_serial(certificate):
+    """Издатель (Name в DER) и серийный номер сертификата
+    :param certificate :type bytes - DER
+    :return tuple (bytes, int)"""
+    cert = asn1.children(asn1.expect(asn1.children(certificate)[0], asn1.SEQUENCE))
+    tbs = asn1.children(asn1.expect(cert[0], asn1.SEQUENCE))
+    # [0] version необязателен
+    if tbs[0][0] == 0xa0:
+        tbs = tbs[1:]
+    return tbs[2][2], asn1.decode_integer(asn1.expect(tbs[0], asn1.INTEGER))
+
+
+def build_pkcs7(signature, certificate):
+    """Открепленная подпись CMS (PKCS#7 SignedData) без подписываемых атрибутов:
+    подпись вычисляется непосредственно над хэшем файла.
+    :param signature :type bytes - подпись ГОСТ Р 34.10-2001 хэша файла, s || r
+    :param certificate :type bytes - сертификат подписанта DER
+    :return bytes DER"""
+    issuer, serial = certificate_issuer_serial(certificate)
+    digest_algorithm = asn1.encode_sequence(asn1.encode_oid(GOST_R3411_94), asn1.encode_tlv(asn1.NULL, b''))
+    signer_info = asn1.encode_sequence(
+        asn1.encode_integer(1),
+        asn1.encode_sequence(issuer, asn1.encode_integer(serial)),
+        digest_algorithm,
+        asn1.encode_sequence(asn1.encode_oid(GOST_R3410_2001), asn1.encode_tlv(asn1.NULL, b'')),
+        asn1.encode_tlv(asn1.OCTET_STRING, signature))
+    signed_data = asn1.encode_sequence(
+        asn1.encode_integer(1),
+        asn1.encode_set(digest_algorithm),
+        # открепленная подпись: содержимое в encapContentInfo не передается
+        asn1.encode_sequence(asn1.encode_oid(DATA)),
+        asn1.encode_tlv(0xa0, certificate),
+        asn1.encode_set(signer_info))
+    return asn1.encode_sequence(asn1.encode_oid(SIGNED_DATA), asn1.encode_tlv(0xa0, signed_data))
+
+
+class Attachment:
+    """Вложение, передаваемое в теле сообщения.
+
+    В SenderProvidedRequestData добавляется AttachmentHeader, в SendRequestRequest -
+    AttachmentContent с содержимым файла в base64. Содержимое подставляется только
+    при отправке и читается с диска кусками, конверт с файлом целиком в памяти не строится."""
+
+    def __init__(self, path, mime_type='application/octet-stream', content_id=None, signature=None):
+        """:param path :type str - путь до файла
+        :param mime_type :type str
+        :param content_id :type str - идентификатор вложения, по умолчанию генерируется
+        :param signature :type bytes - открепленная подпись PKCS#7 DER, по умолчанию вычисляется плагином"""
+        self.path = path
+        self.mime_type = mime_type
+        self.content_id = content_id or str(uuid.uuid4())
+        self.signature = signature
+        self._digest = None
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def digest(self):
+        """Хэш ГОСТ Р 34.11-94 файла, считается один раз"""
+        if self._digest is None:
+            self._digest = file_digest(self.path)
+        return self._digest
+
+    def base64_length(self):
+        return (self.size + 2) // 3 * 4
+
+    def base64_chunks(self, chunk_size=CHUNK_SIZE):
+        """Содержимое файла в base64 кусками"""
+        for chunk in file_chunks(self.path, chunk_size):
+            yield base64.b64encode(chunk)
+
+
+class RefAttachment(Attachment):
+    """Вложение, передаваемое через файловое хранилище СМЭВ (обмен большими файлами).
+
+    В SenderProvidedRequestData добавляется RefAttachmentHeader с хэшем файла;
+    сам файл загружается в хранилище под идентификатором uuid отдельно от сообщения."""
+
+    def __init__(self, path, mime_type='application/octet-stream', uuid=None, signature=None):
+        super().__init__(path, mime_type, content_id=uuid, signature=signature)
+
+    @property
+    def uuid(self):
+        return self.content_id
+
+
+class StreamingEnvelope:
+    """Подписанный конверт, в котором вместо содержимого вложений стоят заполнители.
+
+    Итерация выдает конверт кусками с подставленным base64 содержимым файлов,
+    len() - итоговый размер тела запроса. Итерировать можно повторно (повтор запроса)."""
+
+    def __init__(self, envelope, attachments):
+        """:param envelope :type bytes
+        :param attachments - вложения Attachment в порядке номеров заполнителей"""
+        self.envelope = envelope
+        self.parts = [envelope]
+        for number, attachment in enumerate(attachments):
+            head, found, tail = self.parts.pop().partition((PLACEHOLDER % number).encode())
+            if not found:
+                raise PluginError('Attachment %s placeholder not found' % attachment.content_id)
+            self.parts.extend((head, attachment, tail))
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, Attachment):
+                yield from part.base64_chunks()
+            else:
+                yield part
+
+    def __len__(self):
+        return sum(part.base64_length() if isinstance(part, Attachment) else len(part) for part in self.parts)
+
+    def decode(self, *args):
+        """Конверт без содержимого вложений (для журналирования suds)"""
+        return self.envelope.decode(*args)
@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from smev3.cache import DigestCache
+from smev3.exceptions import PluginError, SmevClientError
+from smev3.keystore import KeyStore
+
+_worker_plugin = None
+
+
+def plugin_config(sign_plugin):
+    """Параметры SignPlugin для воссоздания в рабочем процессе: ключи, дополнительные подписи
+    SignatureReference и Id подписи запроса. Кэш хэшей передается размерами - у каждого процесса свой.
+    :return dict аргументов _init_worker"""
+    cache = sign_plugin.digest_cache
+    return dict(pkey_path=sign_plugin.pkey_path, cert_path=sign_plugin.cert_path,
+                pkey_password=sign_plugin.pkey_password,
+                # явно заданный подписант передается рабочим процессам, если его можно сериализовать
+                signer=sign_plugin._signer,
+                uri_id=sign_plugin.URI_ID, signatures=sign_plugin.signatures,
+                digest_cache=(cache.max_entries, cache.max_bytes) if cache is not None else None)
+
+
+def _init_worker(plugin_class, config):
+    """Инициализация рабочего процесса: ключи загружаются один раз на процесс"""
+    global _worker_plugin
+    config = dict(config)
+    if config['digest_cache'] is not None:
+        config['digest_cache'] = DigestCache(*config['digest_cache'])
+    _worker_plugin = plugin_class(key_store=KeyStore(), **config)
+    # рабочий процесс уже часть пула: вложенный пул хэшей не создается
+    _worker_plugin.SIGN_PROCESSES = 0
+    _worker_plugin.signer
+
+
+def _sign_one(envelope):
+    try:
+        return _worker_plugin.sign_envelope(envelope), None
+    except SmevClientError as e:
+        return None, e
+    except Exception as e:
+        # исключения lxml и прочие не всегда сериализуются для передачи из процесса
+        return None, PluginError('%s: %s' % (type(e).__name__, e))
+
+
+class SignResult:
+    """Результат подписи одного конверта пакета"""
+
+    def __init__(self, envelope=None, error=None):
+        """:param envelope :type bytes - подписанный конверт
+        :param error :type Exception - ошибка подписи этого конверта"""
+        self.envelope = envelope
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<SignResult %s>' % ('ok' if self.ok else repr(self.error))
+
+
+class BatchSigner:
+    """Пакетная подпись конвертов SendRequest в пуле процессов.
+
+    Преобразование, хэш и подпись каждого конверта выполняются в рабочих процессах.
+    Ключ передается в рабочий процесс один раз при его запуске, результаты
+    возвращаются в порядке входных конвертов, ошибка одного конверта не прерывает пакет."""
+
+    def __init__(self, sign_plugin, processes=None, chunksize=8):
+        """:param sign_plugin :type smev3.plugins.SignPlugin - параметры ключей, сертификатов и подписей
+        :param processes :type int - число рабочих процессов, по умолчанию число процессоров
+        :param chunksize :type int - число конвертов, передаваемых в процесс за раз"""
+        self.chunksize = chunksize
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(type(sign_plugin), plugin_config(sign_plugin)))
+
+    def sign_batch(self, envelopes):
+        """Подпись пакета конвертов
+        :param envelopes - итерируемый набор конвертов bytes с заполнителями DigestValue и SignatureValue
+        :return list SignResult в порядке входных конвертов"""
+        return [SignResult(envelope, error)
+                for envelope, error in self.executor.map(_sign_one, envelopes, chunksize=self.chunksize)]
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def sign_batch(sign_plugin, envelopes, processes=None):
+    """Подпись пакета конвертов во временном пуле процессов
+    :return list SignResult"""
+    with BatchSigner(sign_plugin, processes=processes) as signer:
+        return signer.sign_batch(envelopes)
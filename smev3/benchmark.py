@@ -0,0 +1,256 @@
+"""Замеры производительности преобразования, хэша, подписи и построения конверта.
+
+Запуск: python -m smev3.benchmark --key КЛЮЧ --cert СЕРТИФИКАТ [--sizes 1K,64K,1M,10M,50M]
+    [--shapes wide,deep] [--save-baseline FILE] [--baseline FILE] [--tolerance 0.2]
+
+Для каждого случая выводится лучшее время из нескольких повторов и пиковый объем
+памяти Python (tracemalloc; память, выделенная внутри libxml2, не учитывается).
+Результаты сравниваются с базовыми (по умолчанию BASELINE_FILE, сохраненный
+с параметрами по умолчанию): случаи, ставшие медленнее более чем на tolerance,
+выводятся как регрессии, код возврата при этом 1. Базовые времена зависят от машины,
+на новой машине их сначала сохраняют с --save-baseline."""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from suds.cache import NoCache
+from suds.sax.parser import Parser
+
+from smev3.client import BaseSmev3Client
+from smev3.digest import get_backend
+from smev3.exceptions import SmevClientError
+from smev3.plugins import ContentPlugin, SignatureReference, SignPlugin
+from smev3.service import WSDL_DIR, ServiceModelRegistry
+from smev3.transform import Smev3Transform
+from smev3.utils import get_gost_r_3410_digest, get_gost_r_34102001_signature
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+BENCHMARK_URL = 'http://smev3.benchmark/smev/v1.2/ws?wsdl'
+
+DEFAULT_SIZES = '1K,64K,1M'
+DEFAULT_SHAPES = 'wide,deep'
+NAMESPACES = 8
+DEPTH = 40
+
+ENVELOPE = """<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body>
+<ns0:SendRequestRequest xmlns:ns0="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2">
+<ns0:SenderProvidedRequestData Id="SIGNED_BY_CONSUMER">
+<ns0:MessageID>db0486d0-3c08-11e5-95e2-d4c9eff07b77</ns0:MessageID>
+<ns1:MessagePrimaryContent xmlns:ns1="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.2">
+{content}
+</ns1:MessagePrimaryContent>
+</ns0:SenderProvidedRequestData>
+<ns0:CallerInformationSystemSignature>
+<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#">
+<ds:SignedInfo>
+<ds:CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/>
+<ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#gostr34102001-gostr3411"/>
+<ds:Reference URI="#SIGNED_BY_CONSUMER">
+<ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#gostr3411"/>
+<ds:DigestValue>{{DIGESTVALUE}}</ds:DigestValue>
+</ds:Reference>
+</ds:SignedInfo>
+<ds:SignatureValue>{{SIGNATUREVALUE}}</ds:SignatureValue>
+</ds:Signature>
+</ns0:CallerInformationSystemSignature>
+</ns0:SendRequestRequest>
+</S:Body>
+</S:Envelope>"""
+
+
+def parse_size(value):
+    """'64K' -> 65536"""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def generate_payload(size, shape='wide'):
+    """Содержимое MessagePrimaryContent размером около size байт.
+
+    wide - широкое дерево: много соседних записей с элементами и атрибутами из NAMESPACES
+    пространств имен, объявленных на каждой записи;
+    deep - записи из цепочек вложенных элементов глубиной DEPTH, пространство имен меняется на каждом уровне.
+    :param size :type int
+    :param shape :type str
+    :return bytes"""
+    declarations = ' '.join('xmlns:p%s="urn://benchmark/ns/%s"' % (i, i) for i in range(NAMESPACES))
+    records = []
+    length = 0
+    number = 0
+    while length < size:
+        if shape == 'deep':
+            opening = ''.join('<p{0}:level{1} p{2}:depth="{1}">'.format(i % NAMESPACES, i, (i + 1) % NAMESPACES)
+                              for i in range(DEPTH))
+            closing = ''.join('</p%s:level%s>' % (i % NAMESPACES, i) for i in reversed(range(DEPTH)))
+            record = '<p0:record %s>%s value %s &amp; "text"%s</p0:record>' % (declarations, opening, number, closing)
+        elif shape == 'wide':
+            fields = ''.join('<p{0}:field{0} p{1}:code="c{2}">value {2} &lt;{0}&gt;</p{0}:field{0}>'.format(
+                i, (i + 3) % NAMESPACES, number) for i in range(NAMESPACES))
+            record = '<p0:record %s id="%s">%s</p0:record>' % (declarations, number, fields)
+        else:
+            raise SmevClientError('Unknown payload shape %s' % shape)
+        records.append(record)
+        length += len(record)
+        number += 1
+    return ('<p0:payload xmlns:p0="urn://benchmark/ns/0">%s</p0:payload>' % ''.join(records)).encode()
+
+
+class PayloadPlugin(ContentPlugin):
+    """Контент из готового XML"""
+
+    def make_content(self, payload):
+        return Parser().parse(string=payload).root()
+
+
+class PersonalPayloadPlugin(PayloadPlugin):
+    """Контент с Id для PersonalSignature"""
+
+    def make_content(self, payload):
+        content = super().make_content(payload)
+        content.set('Id', 'PERSONAL_SIGNATURE')
+        return content
+
+
+class BenchmarkClient(BaseSmev3Client):
+    SMEV_EXEC_URL = BENCHMARK_URL
+
+
+def measure(func, repeat):
+    """Лучшее время из repeat запусков и пиковая память Python
+    :return dict (seconds, peak_bytes)"""
+    func()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return dict(seconds=best, peak_bytes=peak)
+
+
+def cases(payload, key_file, cert_file, executor=None):
+    """Замеряемые операции для одного payload
+    :param key_file, cert_file :type str - ключ и сертификат подписи
+    :param executor: пул процессов для случая multisign_pool
+    :return list (имя, функция)"""
+    envelope = ENVELOPE.format(content=payload.decode()).encode()
+    canonical = Smev3Transform(payload).run_bytes()
+    plugin = SignPlugin(pkey_path=key_file, cert_path=cert_file)
+    plugin.signer
+
+    registry = ServiceModelRegistry(cache=NoCache())
+    registry.register_local(BENCHMARK_URL, WSDL_DIR)
+    client_class = type('Client', (BenchmarkClient,), dict(SERVICE_REGISTRY=registry, PRIVATE_KEY_FILE=key_file,
+                                                           CERTIFICATE_FILE=cert_file))
+    template_class = type('TemplateClient', (client_class,), dict(ENVELOPE_TEMPLATE=True))
+    content = dict(payload=payload)
+    client = client_class(PayloadPlugin(), nosend=True)
+    template_client = template_class(PayloadPlugin(), nosend=True)
+    # PersonalSignature контента и подпись запроса: последовательно и с хэшами в пуле процессов
+    multisign_class = type('MultisignClient', (template_class,), dict(SIGNATURES=(SignatureReference(),)))
+    multisign_client = multisign_class(PersonalPayloadPlugin(), nosend=True)
+    pool_client = type('PoolClient', (multisign_class,), dict(SIGN_EXECUTOR=executor))(PersonalPayloadPlugin(),
+                                                                                          nosend=True)
+
+    def openssl_sign():
+        get_gost_r_34102001_signature(canonical, key_file)
+
+    result = [
+        ('transform', lambda: Smev3Transform(payload).run()),
+        ('digest', lambda: get_gost_r_3410_digest(canonical)),
+        ('digest_python', lambda: get_backend('python').digest(canonical)),
+        ('digest_openssl', lambda: get_backend('openssl').digest(canonical)),
+        ('sign', lambda: plugin.signer.sign(canonical)),
+        ('openssl_sign', openssl_sign),
+        ('sending', lambda: plugin.sending(SimpleNamespace(envelope=envelope))),
+        ('envelope', lambda: client.send_request(content=content)),
+        ('envelope_template', lambda: template_client.send_request(content=content)),
+        ('multisign', lambda: multisign_client.send_request(content=content)),
+        ('multisign_pool', lambda: pool_client.send_request(content=content)),
+    ]
+    return result
+
+
+def run(sizes, shapes, key_file, cert_file, repeat=3, only=None, out=sys.stdout):
+    """Выполнение замеров
+    :param key_file, cert_file :type str - ключ и сертификат подписи
+    :return dict {'<операция>/<форма>/<размер>': {'seconds', 'peak_bytes'}}"""
+    results = dict()
+    with ProcessPoolExecutor(2) as executor:
+        for shape in shapes:
+            for size in sizes:
+                payload = generate_payload(parse_size(size), shape)
+                for name, func in cases(payload, key_file, cert_file, executor):
+                    if only and name not in only:
+                        continue
+                    key = '%s/%s/%s' % (name, shape, size)
+                    try:
+                        results[key] = measure(func, repeat)
+                    except (subprocess.CalledProcessError, OSError) as e:
+                        # нет openssl с поддержкой ГОСТ
+                        print('%-36s skipped: %s' % (key, type(e).__name__), file=out)
+                        continue
+                    print('%-36s %10.4f s %10.1f MB' % (key, results[key]['seconds'],
+                                                        results[key]['peak_bytes'] / (1 << 20)), file=out)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Случаи, ставшие медленнее базовых более чем на tolerance
+    :return list (ключ, базовое время, текущее время)"""
+    regressions = []
+    for key, value in results.items():
+        base = baseline.get(key)
+        if base and value['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append((key, base['seconds'], value['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smev3.benchmark', description=__doc__.splitlines()[0])
+    parser.add_argument('--key', required=True, help='файл закрытого ключа')
+    parser.add_argument('--cert', required=True, help='файл сертификата')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='размеры payload, например 1K,64K,1M,10M,50M')
+    parser.add_argument('--shapes', default=DEFAULT_SHAPES, help='формы дерева: wide, deep')
+    parser.add_argument('--only', default='', help='операции через запятую, по умолчанию все')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save-baseline', metavar='FILE', help='сохранить результаты как базовые')
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE_FILE,
+                        help="сравнить с базовыми результатами, '' - без сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое замедление, доля')
+    args = parser.parse_args(argv)
+
+    only = [name for name in args.only.split(',') if name]
+    results = run(args.sizes.split(','), args.shapes.split(','), args.key, args.cert, args.repeat, only)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for key, base, current in regressions:
+            print('REGRESSION %-36s %.4f s -> %.4f s (%+.0f%%)' % (key, base, current, (current / base - 1) * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
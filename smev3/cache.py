@@ -0,0 +1,90 @@
+import collections
+import hashlib
+import threading
+
+from smev3.digest import new_digest
+
+# служебные расходы на запись кэша сверх длины значения: ключ, кортеж и узел словаря
+ENTRY_OVERHEAD = 200
+
+
+def content_key(data):
+    """Ключ содержимого: BLAKE2b, на порядки быстрее преобразования и хэша ГОСТ
+    :param data :type bytes
+    :return bytes"""
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+class DigestCache:
+    """Ограниченный LRU кэш канонических форм и хэшей ГОСТ Р 34.11-94 по содержимому.
+
+    Ключ записи - BLAKE2b уже полученной канонической формы, поэтому для повторного содержимого
+    не выполняется только хэш ГОСТ, самая долгая часть подписи. Повторяются SignedInfo и
+    элементы контента дополнительных подписей (PersonalSignature); SenderProvidedRequestData
+    содержит уникальный MessageID и не кэшируется. Вытесняются давно не использованные записи
+    при превышении max_entries записей или max_bytes байт значений."""
+
+    def __init__(self, max_entries=1024, max_bytes=64 << 20):
+        """:param max_entries :type int - максимальное число записей
+        :param max_bytes :type int - максимальный суммарный размер записей, байты"""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = dict(hits=0, misses=0, evictions=0)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Значение по ключу или None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        size = len(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous) + ENTRY_OVERHEAD
+            self._entries[key] = value
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted) + ENTRY_OVERHEAD
+                self.stats['evictions'] += 1
+
+    @staticmethod
+    def key(kind, data):
+        """Ключ записи
+        :param kind :type bytes - вид значения, разделяет записи для одного содержимого"""
+        return kind + content_key(data)
+
+    def cached(self, kind, data, compute):
+        """Значение compute(data) из кэша или с вычислением и сохранением"""
+        key = self.key(kind, data)
+        value = self.get(key)
+        if value is None:
+            value = compute(data)
+            self.put(key, value)
+        return value
+
+    def digest(self, data):
+        """Хэш ГОСТ Р 34.11-94 данных
+        :param data :type bytes
+        :return bytes"""
+        return self.cached(b'd', data, lambda value: new_digest(value).digest())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
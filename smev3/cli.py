@@ -0,0 +1,308 @@
+"""Пакетная обработка XML сообщений СМЭВ: преобразование, хэш, подпись и проверка подписей.
+
+Запуск: python -m smev3 {transform,digest,sign,verify} [ПУТЬ ...] [--output КАТАЛОГ] [--processes N]
+
+Пути - файлы или каталоги (обрабатываются все *.xml, рекурсивно), '-' или отсутствие
+путей - стандартный ввод. Файлы распределяются по пулу процессов; ключ, сертификаты
+и прочее состояние загружаются в каждом процессе один раз. По окончании в stderr
+выводится статистика пропускной способности, код возврата 1 при ошибках.
+
+Пароль закрытого ключа sign читается из файла --password-file или переменной
+окружения SMEV3_KEY_PASSWORD, чтобы он не попадал в список процессов."""
+import argparse
+import base64
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+from smev3.digest import new_digest
+from smev3.exceptions import SmevClientError
+from smev3.keystore import KeyStore
+from smev3.plugins import SignPlugin
+from smev3.transform import Smev3StreamTransform, Smev3Transform
+from smev3.verify import CertificateCache, SignatureVerifier
+
+STDIN = '-'
+PASSWORD_ENV = 'SMEV3_KEY_PASSWORD'
+
+_worker = None
+
+
+def iter_inputs(paths):
+    """Входные файлы и их имена относительно указанного каталога
+    :return генератор (путь, относительное имя)"""
+    for path in paths or [STDIN]:
+        if path != STDIN and os.path.isdir(path):
+            for directory, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith('.xml'):
+                        full = os.path.join(directory, name)
+                        yield full, os.path.relpath(full, path)
+        else:
+            yield path, os.path.basename(path)
+
+
+def read_password(path=None):
+    """Пароль закрытого ключа: первая строка файла или переменная окружения PASSWORD_ENV
+    :return str или None"""
+    if path is None:
+        return os.environ.get(PASSWORD_ENV)
+    with open(path) as f:
+        return f.readline().rstrip('\r\n')
+
+
+def output_collisions(inputs):
+    """Имена результатов, под которыми в каталог --output попало бы несколько входных файлов
+    :return list"""
+    names = [os.path.normcase(name) for path, name in inputs if path != STDIN]
+    return sorted({name for name in names if names.count(name) > 1})
+
+
+def select_element(document, element_id):
+    """Элемент с атрибутом Id или корень документа"""
+    if element_id is None:
+        return document
+    found = document.xpath('//*[@Id=$id]', id=element_id)
+    if not found:
+        raise SmevClientError('Element with Id %s not found' % element_id)
+    return found[0]
+
+
+class Command:
+    """Операция над одним документом; экземпляр создается в каждом рабочем процессе"""
+
+    # результат - документ (пишется в файл или stdout), а не строка отчета
+    produces_document = False
+
+    def __init__(self, options):
+        self.options = options
+
+    def __call__(self, data):
+        """:param data :type bytes - содержимое файла
+        :return tuple (результат bytes, признак успеха)"""
+        raise NotImplementedError()
+
+
+class TransformCommand(Command):
+    produces_document = True
+
+    def __call__(self, data):
+        element = select_element(etree.fromstring(data, etree.XMLParser(huge_tree=True)), self.options.id)
+        return Smev3Transform(element).run_bytes(), True
+
+
+class DigestCommand(Command):
+
+    def __call__(self, data):
+        element = select_element(etree.fromstring(data, etree.XMLParser(huge_tree=True)), self.options.id)
+        digest = new_digest()
+        Smev3Transform(element).write_to(digest.update)
+        return base64.b64encode(digest.digest()), True
+
+
+class SignCommand(Command):
+    """Подпись конвертов: DigestValue и SignatureValue пересчитываются, сертификат заменяется"""
+    produces_document = True
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.plugin = SignPlugin(pkey_path=options.key, cert_path=options.cert, pkey_password=options.password,
+                                 key_store=KeyStore())
+        self.certificate = self.plugin.key_store.certificate(options.cert) if options.cert else None
+
+    def __call__(self, data):
+        xml_doc = etree.fromstring(data, etree.XMLParser(huge_tree=True))
+        if self.certificate is not None:
+            for element in xml_doc.iterfind('.//ds:X509Certificate', SignPlugin.NS_MAP):
+                element.text = self.certificate
+        return self.plugin.sign_document(xml_doc), True
+
+
+class VerifyCommand(Command):
+
+    def __init__(self, options):
+        super().__init__(options)
+        trusted = [self.read_file(item) if os.path.isfile(item) else item for item in options.trusted]
+        self.verifier = SignatureVerifier(CertificateCache(trusted=trusted),
+                                          sign_plugin_signed_info=options.sign_plugin)
+
+    @staticmethod
+    def read_file(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def __call__(self, data):
+        results = self.verifier.verify(etree.fromstring(data, etree.XMLParser(huge_tree=True)))
+        report = ' '.join('%s:%s' % (result.name, 'ok' if result.valid else result.error or 'invalid')
+                          for result in results)
+        return (report or 'not signed').encode(), bool(results) and all(result.valid for result in results)
+
+
+COMMANDS = {'transform': TransformCommand, 'digest': DigestCommand, 'sign': SignCommand, 'verify': VerifyCommand}
+
+
+def _init_worker(command, options):
+    global _worker
+    _worker = COMMANDS[command](options)
+
+
+def _run_one(path):
+    """Обработка одного файла в рабочем процессе
+    :return tuple (размер входа, результат bytes или None, признак успеха, ошибка str или None)"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        result, ok = _worker(data)
+        return len(data), result, ok, None
+    except Exception as e:
+        # ошибка одного файла не останавливает пакет
+        return 0, None, False, '%s: %s' % (type(e).__name__, e)
+
+
+class Stats:
+    """Статистика пропускной способности"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, size, ok):
+        self.files += 1
+        self.bytes += size
+        self.errors += not ok
+
+    def report(self):
+        seconds = max(time.perf_counter() - self.started, 1e-9)
+        return '%s files, %.2f MB in %.2f s: %.1f files/s, %.2f MB/s, %s errors' % (
+            self.files, self.bytes / (1 << 20), seconds, self.files / seconds, self.bytes / (1 << 20) / seconds,
+            self.errors)
+
+
+def run_stdin(command, options, stdin, stdout, stderr, stats):
+    """Обработка стандартного ввода в текущем процессе, ошибка выводится в stderr.
+    Преобразование и хэш документа целиком выполняются потоково, без построения дерева.
+    :return bool - признак успеха"""
+    try:
+        return _run_stdin(command, options, stdin, stdout, stats)
+    except Exception as e:
+        print('%s: %s: %s' % (STDIN, type(e).__name__, e), file=stderr)
+        stats.add(0, False)
+        return False
+
+
+def _run_stdin(command, options, stdin, stdout, stats):
+    if command in ('transform', 'digest') and options.id is None:
+        counter = CountingReader(stdin)
+        if command == 'transform':
+            Smev3StreamTransform(counter).write_to(stdout.write)
+        else:
+            digest = new_digest()
+            Smev3StreamTransform(counter).write_to(digest.update)
+            stdout.write(base64.b64encode(digest.digest()) + b'\n')
+        stats.add(counter.size, True)
+        return True
+    data = stdin.read()
+    result, ok = COMMANDS[command](options)(data)
+    stdout.write(result if COMMANDS[command].produces_document else result + b'\n')
+    stats.add(len(data), ok)
+    return ok
+
+
+class CountingReader:
+    """Чтение file-like объекта с подсчетом прочитанных байт"""
+
+    def __init__(self, source):
+        self.source = source
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.size += len(data)
+        return data
+
+
+def write_output(directory, name, data):
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    """:param stdin, stdout :type бинарные file-like объекты, по умолчанию стандартные потоки
+    :param stderr :type текстовый file-like объект
+    :return int - код возврата"""
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    stderr = stderr or sys.stderr
+
+    parser = argparse.ArgumentParser(prog='python -m smev3', description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('paths', nargs='*', metavar='PATH', help="файлы, каталоги или '-' для stdin")
+    common.add_argument('--output', metavar='DIR', help='каталог результатов transform и sign')
+    common.add_argument('--processes', type=int, default=None, help='число процессов, по умолчанию число CPU')
+    common.add_argument('--chunksize', type=int, default=16, help='число файлов, передаваемых в процесс за раз')
+    common.add_argument('--quiet', action='store_true', help='не выводить статистику')
+
+    for name in ('transform', 'digest'):
+        sub = subparsers.add_parser(name, parents=[common], help='каноническая форма СМЭВ 3' if name == 'transform'
+                                    else 'хэш ГОСТ Р 34.11-94 канонической формы в base64')
+        sub.add_argument('--id', help='преобразовать элемент с атрибутом Id вместо документа')
+    sign = subparsers.add_parser('sign', parents=[common], help='подпись конвертов с ds:Signature')
+    sign.add_argument('--key', required=True, help='файл закрытого ключа')
+    sign.add_argument('--cert', help='файл сертификата для X509Certificate')
+    sign.add_argument('--password-file', metavar='FILE',
+                      help='файл с паролем закрытого ключа, по умолчанию переменная окружения %s' % PASSWORD_ENV)
+    verify = subparsers.add_parser('verify', parents=[common], help='проверка подписей XMLDSig')
+    verify.add_argument('--trusted', action='append', required=True,
+                        help='отпечаток SHA-256 или файл доверенного сертификата, можно несколько')
+    verify.add_argument('--sign-plugin', action='store_true',
+                        help='SignedInfo подписан как в команде sign и SignPlugin, а не по XMLDSig')
+
+    options = parser.parse_args(argv)
+    command = options.command
+    produces_document = COMMANDS[command].produces_document
+    inputs = list(iter_inputs(options.paths))
+    if produces_document and not options.output and len(inputs) > 1:
+        parser.error('--output is required for several inputs')
+    if produces_document and options.output:
+        collisions = output_collisions(inputs)
+        if collisions:
+            parser.error('several inputs would be written to the same --output files: %s' % ', '.join(collisions))
+    if command == 'sign':
+        try:
+            options.password = read_password(options.password_file)
+        except OSError as e:
+            parser.error('cannot read --password-file: %s' % e)
+
+    stats = Stats()
+    ok = True
+    files = [item for item in inputs if item[0] != STDIN]
+    if len(files) < len(inputs):
+        ok = run_stdin(command, options, stdin, stdout, stderr, stats) and ok
+
+    if files:
+        with ProcessPoolExecutor(options.processes, initializer=_init_worker, initargs=(command, options)) as pool:
+            results = pool.map(_run_one, [path for path, name in files], chunksize=options.chunksize)
+            for (path, name), (size, result, success, error) in zip(files, results):
+                stats.add(size, success)
+                ok = ok and success
+                if error is not None:
+                    print('%s: %s' % (path, error), file=stderr)
+                elif produces_document and options.output:
+                    write_output(options.output, name, result)
+                elif produces_document:
+                    stdout.write(result)
+                else:
+                    stdout.write(path.encode() + b'\t' + result + b'\n')
+
+    if not options.quiet:
+        print(stats.report(), file=stderr)
+    return 0 if ok else 1
@@ -1,8 +1,18 @@
+import asyncio
+import datetime
+import functools
 import uuid
+
 from suds.client import Client
+from suds.sudsobject import Property
 
+from smev3.context import call_scope
+from smev3.envelope import EnvelopeTemplate, PreparedSoapClient
+from smev3 import metrics
 from smev3.exceptions import SmevClientError
-from smev3.plugins import ContentPlugin, SignPlugin
+from smev3.plugins import AttachmentPlugin, ContentPlugin, SignPlugin
+from smev3.service import service_registry
+from smev3.transport import AsyncHttpTransport, PooledHttpTransport
 
 
 class BaseSmev3Client(Client):
@@ -11,8 +21,29 @@ class BaseSmev3Client(Client):
     PRIVATE_KEY_FILE = ''
     PASSWORD = None
     CERTIFICATE_FILE = ''
+    # реестр разобранных описаний сервиса, общий для всех экземпляров клиента
+    SERVICE_REGISTRY = service_registry
+    # SendRequest из заранее собранного шаблона конверта вместо построения через suds
+    ENVELOPE_TEMPLATE = False
+    # открепленная подпись PKCS#7 вложений ключом клиента
+    SIGN_ATTACHMENTS = True
+    # smev3.cache.DigestCache для повторяющегося содержимого, общий для экземпляров клиента
+    DIGEST_CACHE = None
+    # дополнительные подписи smev3.plugins.SignatureReference, например PersonalSignature
+    SIGNATURES = ()
+    # concurrent.futures.Executor для одновременного вычисления хэшей нескольких подписей;
+    # принадлежит вызывающему, по умолчанию хэши считаются последовательно
+    SIGN_EXECUTOR = None
+
+    def __init__(self, content_plugin, signer=None, **options):
+        """
+        :param content_plugin: экземпляр ContentPlugin
+        :param signer: экземпляр smev3.signer.Signer, по умолчанию smev3.signer.load_signer по файлу ключа
+        :param options: опции suds клиента (transport, location...)
 
-    def __init__(self, content_plugin):
+        Экземпляр можно использовать из нескольких потоков: контент и MessageID
+        передаются в send_request и не хранятся в плагинах.
+        """
         plugins = []
 
         if content_plugin:
@@ -20,17 +51,197 @@ class BaseSmev3Client(Client):
                 raise SmevClientError('Content plugin is not instance of ContentPlugin')
             plugins.append(content_plugin)
 
-        plugins.append(SignPlugin(cert_path=self.CERTIFICATE_FILE,
-                                  pkey_path=self.PRIVATE_KEY_FILE,
-                                  pkey_password=self.PASSWORD))
+        self.content_plugin = content_plugin
+        self.sign_plugin = SignPlugin(cert_path=self.CERTIFICATE_FILE,
+                                      pkey_path=self.PRIVATE_KEY_FILE,
+                                      pkey_password=self.PASSWORD,
+                                      signer=signer,
+                                      digest_cache=self.DIGEST_CACHE,
+                                      signatures=self.SIGNATURES,
+                                      executor=self.SIGN_EXECUTOR)
+        plugins.append(self.sign_plugin)
+        self.attachment_plugin = AttachmentPlugin(self.sign_plugin, sign_attachments=self.SIGN_ATTACHMENTS)
+        plugins.append(self.attachment_plugin)
+        self._envelope_template = None
+
+        options.setdefault('transport', PooledHttpTransport())
+        # описание сервиса не разбирается заново, клиент строится поверх общей модели
+        self.SERVICE_REGISTRY.get(self.SMEV_EXEC_URL).bind(self, plugins=plugins, **options)
+
+    def send_request(self, content=None, message_id=None, attachments=None):
+        """Отправка SendRequest.
+        :param content :type dict - аргументы make_content плагина контента для этого сообщения,
+            по умолчанию заданные в конструкторе плагина
+        :param message_id :type str - MessageID, по умолчанию генерируется
+        :param attachments - вложения smev3.attachments.Attachment / RefAttachment"""
+        with call_scope(content=content, message_id=message_id or str(uuid.uuid1()),
+                        plugin=self.plugin_name, attachments=attachments) as call:
+            started = metrics.start()
+            error = None
+            try:
+                # шаблон конверта не содержит вложений, конверт с вложениями строится через suds
+                if self.ENVELOPE_TEMPLATE and not attachments:
+                    method = self.service.SendRequest.method
+                    return PreparedSoapClient(self, method).send_envelope(self.build_envelope(call.message_id))
+                request_data = self.sender_provided_request_data(call.message_id)
+                return self.service.SendRequest(request_data)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                # с опцией nosend конверт только строится и подписывается
+                metrics.finish('prepare' if self.options.nosend else 'send_request', started, error=error)
+
+    def prepare_envelope(self, content=None, message_id=None):
+        """Подписанный конверт SendRequest без отправки; отправляется позже через send_envelope.
+        :param content :type dict - аргументы make_content плагина контента
+        :param message_id :type str - MessageID, по умолчанию генерируется
+        :return bytes"""
+        with call_scope(content=content, message_id=message_id or str(uuid.uuid1()),
+                        plugin=self.plugin_name) as call:
+            started = metrics.start()
+            error = None
+            try:
+                if self.ENVELOPE_TEMPLATE:
+                    return self.build_envelope(call.message_id)
+                method = self.service.SendRequest.method
+                return PreparedSoapClient(self, method).build_envelope(
+                    self.sender_provided_request_data(call.message_id))
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                metrics.finish('prepare', started, error=error)
 
-        super().__init__(self.SMEV_EXEC_URL, plugins=plugins)
+    def send_envelope(self, envelope, message_id=None):
+        """Отправка готового подписанного конверта SendRequest, без повторной подписи
+        :param envelope :type bytes
+        :param message_id :type str - MessageID конверта для метрик"""
+        with call_scope(message_id=message_id, plugin=self.plugin_name):
+            started = metrics.start()
+            error = None
+            try:
+                return PreparedSoapClient(self, self.service.SendRequest.method).send_envelope(envelope)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                metrics.finish('send_request', started, error=error)
 
-    def send_request(self):
-        request_data = self.sender_provided_request_data()
-        return self.service.SendRequest(request_data)
+    @property
+    def plugin_name(self):
+        """Тип плагина контента для метрик, None без плагина"""
+        return type(self.content_plugin).__name__ if self.content_plugin is not None else None
 
-    def sender_provided_request_data(self):
+    @property
+    def envelope_template(self):
+        if self._envelope_template is None:
+            self._envelope_template = EnvelopeTemplate(self.sign_plugin)
+        return self._envelope_template
+
+    def build_envelope(self, message_id):
+        """Подписанный конверт SendRequest из шаблона
+        :param message_id :type str
+        :return bytes"""
+        content = self.content_plugin.build_content() if self.content_plugin else None
+        return self.sign_plugin.sign_document(self.envelope_template.render(message_id, content))
+
+    def sender_provided_request_data(self, message_id=None):
         request_data = self.factory.create('ns0:SenderProvidedRequestData')
-        request_data.MessageID = str(uuid.uuid1())
+        request_data.MessageID = message_id or str(uuid.uuid1())
         return request_data
+
+    def get_response(self, namespace_uri=None, root_element_local_name=None, node_id=None):
+        """Получение очередного ответа из очереди СМЭВ (GetResponse).
+        :param namespace_uri :type str - пространство имен корневого элемента ожидаемых ответов
+        :param root_element_local_name :type str - имя корневого элемента ожидаемых ответов
+        :param node_id :type str - идентификатор узла
+        :return ResponseMessage или None при пустой очереди"""
+        with call_scope(plugin=self.plugin_name):
+            selector = self.factory.create('ns0:GetResponseRequest').MessageTypeSelector
+            selector.NamespaceURI = namespace_uri
+            selector.RootElementLocalName = root_element_local_name
+            selector.Timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            selector.NodeID = node_id
+            return self.service.GetResponse(selector)
+
+    def ack(self, message_id, accepted=True):
+        """Подтверждение получения сообщения (Ack).
+        :param message_id :type str - MessageID полученного сообщения
+        :param accepted :type bool"""
+        with call_scope(message_id=message_id, plugin=self.plugin_name):
+            # AckTargetMessage - simpleContent с атрибутами: текст и атрибуты передаются через Property
+            target = Property(message_id)
+            target._accepted = 'true' if accepted else 'false'
+            return self.service.Ack(target)
+
+
+class AsyncSmev3Client(BaseSmev3Client):
+    """Асинхронный клиент СМЭВ3.
+
+    Конверт строится и подписывается теми же плагинами, что и в BaseSmev3Client,
+    но в пуле потоков (executor), чтобы не блокировать цикл событий. Отправка
+    выполняется через AsyncHttpTransport с пулом keep-alive соединений и
+    ограничением числа одновременных запросов."""
+
+    def __init__(self, content_plugin, signer=None, http_transport=None, executor=None, **options):
+        """
+        :param content_plugin: экземпляр ContentPlugin
+        :param signer: экземпляр smev3.signer.Signer
+        :param http_transport: экземпляр AsyncHttpTransport, по умолчанию AsyncHttpTransport()
+        :param executor: concurrent.futures.Executor для подписи, по умолчанию executor цикла событий
+        :param options: опции suds клиента (location...)
+        """
+        options['nosend'] = True
+        super().__init__(content_plugin, signer=signer, **options)
+        self.http_transport = http_transport or AsyncHttpTransport()
+        self.executor = executor
+
+    def prepare_request(self, content=None, message_id=None, attachments=None):
+        """Построение и подпись конверта SendRequest без отправки
+        :return suds.client.RequestContext"""
+        # с опцией nosend send_request базового клиента возвращает конверт, не отправляя его
+        return super().send_request(content, message_id, attachments)
+
+    def request_headers(self, method):
+        action = method.soap.action
+        headers = {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': action}
+        headers.update(self.options.headers)
+        return headers
+
+    def location(self, method):
+        return self.options.location or method.location
+
+    async def send_request(self, content=None, message_id=None, attachments=None):
+        """Отправка SendRequest.
+        :param content :type dict - аргументы make_content плагина контента для этого сообщения
+        :param message_id :type str - MessageID, по умолчанию генерируется
+        :param attachments - вложения smev3.attachments.Attachment / RefAttachment"""
+        loop = asyncio.get_running_loop()
+        message_id = message_id or str(uuid.uuid1())
+        with call_scope(content=content, message_id=message_id, plugin=self.plugin_name):
+            started = metrics.start()
+            status = error = None
+            try:
+                request = await loop.run_in_executor(
+                    self.executor, functools.partial(self.prepare_request, content, message_id, attachments))
+                method = self.service.SendRequest.method
+                status, reason, headers, message = await self.http_transport.post(
+                    self.location(method), request.envelope, self.request_headers(method))
+                if status >= 300:
+                    return request.process_reply(message, status, reason)
+                return request.process_reply(message)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                metrics.finish('send_request', started, status=status, error=error)
+
+    async def close(self):
+        self.http_transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,133 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ResponseConsumer:
+    """Получение ответов из очереди СМЭВ: GetResponse, обработка и Ack.
+
+    Опрос выполняют pollers потоков; при пустой очереди интервал опроса растет
+    от min_interval до max_interval в backoff раз и сбрасывается при получении сообщения.
+    Полученные сообщения обрабатываются пулом из workers потоков, подтверждения (Ack)
+    ставятся в очередь и отправляются отдельными ack_workers потоками, не задерживая
+    опрос и обработку. Число полученных, но не обработанных сообщений ограничено max_pending.
+    Запросы GetResponse и Ack подписываются SignPlugin клиента так же, как SendRequest."""
+
+    def __init__(self, client, handler, workers=4, pollers=1, ack_workers=2, min_interval=0.1, max_interval=30.0,
+                 backoff=2.0, max_pending=None, **selector):
+        """
+        :param client: экземпляр BaseSmev3Client, общий для всех потоков
+        :param handler: функция handler(response_message) -> bool, результат передается в Ack как accepted
+            (None считается True); при исключении Ack не отправляется и СМЭВ доставит сообщение повторно
+        :param workers :type int - число потоков обработки
+        :param pollers :type int - число потоков опроса
+        :param ack_workers :type int - число потоков отправки Ack
+        :param min_interval, max_interval :type float - границы интервала опроса пустой очереди, секунды
+        :param backoff :type float - множитель интервала при пустой очереди
+        :param max_pending :type int - максимум сообщений в обработке, по умолчанию workers * 2
+        :param selector: аргументы client.get_response (namespace_uri, root_element_local_name, node_id)
+        """
+        self.client = client
+        self.handler = handler
+        self.workers = workers
+        self.pollers = pollers
+        self.ack_workers = ack_workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.selector = selector
+        self.stats = dict(received=0, handled=0, failed=0, acked=0, ack_failed=0, empty=0, errors=0)
+        self._pending = threading.BoundedSemaphore(max_pending or workers * 2)
+        self._stopped = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._acks = queue.Queue()
+        self._threads = []
+        self._ack_threads = []
+        self._executor = None
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def start(self):
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='smev3-handler')
+        self._threads = [threading.Thread(target=self.poll, name='smev3-poller-%s' % i, daemon=True)
+                         for i in range(self.pollers)]
+        self._ack_threads = [threading.Thread(target=self.send_acks, name='smev3-ack-%s' % i, daemon=True)
+                             for i in range(self.ack_workers)]
+        for thread in self._threads + self._ack_threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Остановка опроса; полученные сообщения обрабатываются и подтверждаются до конца.
+        Потоки опроса дожидаются завершения начатого GetResponse без ограничения по времени
+        (его ограничивает таймаут транспорта), иначе полученное сообщение некуда было бы передать
+        после остановки пула обработки.
+        :param timeout :type float - ожидание потоков отправки Ack, секунды"""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        for _ in self._ack_threads:
+            self._acks.put(_STOP)
+        for thread in self._ack_threads:
+            thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def poll(self):
+        interval = self.min_interval
+        while not self._stopped.is_set():
+            if not self._pending.acquire(timeout=self.min_interval):
+                continue
+            try:
+                message = self.client.get_response(**self.selector)
+                self.count('empty' if message is None else 'received')
+            except Exception:
+                logger.exception('GetResponse failed')
+                self.count('errors')
+                message = None
+            if message is None:
+                self._pending.release()
+                self._stopped.wait(interval)
+                interval = min(interval * self.backoff, self.max_interval)
+                continue
+            interval = self.min_interval
+            self._executor.submit(self.handle, message)
+
+    def handle(self, message):
+        try:
+            message_id = message.Response.SenderProvidedResponseData.MessageID
+            accepted = self.handler(message)
+            self._acks.put((message_id, accepted is None or bool(accepted)))
+            self.count('handled')
+        except Exception:
+            logger.exception('Response handler failed')
+            self.count('failed')
+        finally:
+            self._pending.release()
+
+    def send_acks(self):
+        while True:
+            item = self._acks.get()
+            if item is _STOP:
+                return
+            message_id, accepted = item
+            try:
+                self.client.ack(message_id, accepted)
+                self.count('acked')
+            except Exception:
+                logger.exception('Ack %s failed', message_id)
+                self.count('ack_failed')
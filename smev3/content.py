@@ -0,0 +1,257 @@
+import copy
+import threading
+
+from lxml import etree
+from suds.sax.attribute import Attribute
+from suds.sax.element import Element
+
+from smev3.exceptions import SmevClientError
+
+XSD = 'http://www.w3.org/2001/XMLSchema'
+XML = 'http://www.w3.org/XML/1998/namespace'
+
+
+class Field:
+    """Поле контента: дочерний элемент с текстовым значением"""
+
+    def __init__(self, name, required=True, key=None):
+        """:param name :type str - локальное имя элемента
+        :param required :type bool - обязательный элемент выводится и без значения, необязательный опускается
+        :param key :type str - имя аргумента build и ключа parse, по умолчанию name"""
+        self.name = name
+        self.required = required
+        self.key = key or name
+
+    def __repr__(self):
+        return '<Field %s%s>' % (self.name, '' if self.required else '?')
+
+
+class ContentType:
+    """Тип контента СМЭВ, объявленный namespace, корневым элементом и упорядоченным списком полей.
+
+    Объявление компилируется один раз в шаблон lxml: корневой элемент с объявлениями
+    namespaces и всеми полями. Построение контента копирует шаблон и заполняет текст,
+    необязательные поля без значения удаляются из копии. Для конверта suds тот же контент
+    строится сразу элементами suds sax (build_sax), без lxml."""
+
+    def __init__(self, namespace, root, fields, prefix=None, nsmap=None, qualified=True):
+        """:param namespace :type str - namespace корневого элемента
+        :param root :type str - локальное имя корневого элемента
+        :param fields - поля в порядке схемы: Field или имена обязательных полей
+        :param prefix :type str - префикс namespace, по умолчанию выбирает lxml
+        :param nsmap :type dict - дополнительные объявления namespaces корневого элемента
+        :param qualified :type bool - поля в namespace корневого элемента (elementFormDefault="qualified")"""
+        self.namespace = namespace
+        self.root = root
+        self.fields = tuple(field if isinstance(field, Field) else Field(field) for field in fields)
+        self.prefix = prefix
+        self.nsmap = dict(nsmap or {})
+        self.qualified = qualified
+        self.tag = '{%s}%s' % (namespace, root) if namespace else root
+        self.template = self.compile()
+        field_namespace = namespace if qualified and namespace else None
+        self._keys = {etree.QName(field_namespace, field.name).text: field.key for field in self.fields}
+
+    @classmethod
+    def from_xsd(cls, xsd, element, prefix=None, nsmap=None):
+        """Тип контента из объявления глобального элемента схемы.
+        Поля - элементы xs:sequence его complexType (вложенного или именованного)
+        в порядке схемы; minOccurs="0" делает поле необязательным.
+        :param xsd - путь до файла, bytes или разобранная схема lxml
+        :param element :type str - имя глобального элемента
+        :return ContentType"""
+        if isinstance(xsd, bytes):
+            schema = etree.fromstring(xsd)
+        elif isinstance(xsd, etree._Element):
+            schema = xsd
+        else:
+            schema = etree.parse(xsd).getroot()
+        ns = {'xs': XSD}
+        namespace = schema.get('targetNamespace')
+        declaration = schema.find('xs:element[@name="%s"]' % element, ns)
+        if declaration is None:
+            raise SmevClientError('Element %s not found in schema' % element)
+        complex_type = declaration.find('xs:complexType', ns)
+        if complex_type is None and declaration.get('type'):
+            type_name = etree.QName(declaration.get('type').split(':')[-1]).localname
+            complex_type = schema.find('xs:complexType[@name="%s"]' % type_name, ns)
+        if complex_type is None:
+            raise SmevClientError('Element %s has no complex type' % element)
+
+        fields = []
+        for child in complex_type.iterfind('xs:sequence/xs:element', ns):
+            name = child.get('name') or child.get('ref').split(':')[-1]
+            fields.append(Field(name, required=child.get('minOccurs', '1') != '0'))
+        return cls(namespace, element, fields, prefix=prefix, nsmap=nsmap,
+                   qualified=schema.get('elementFormDefault') == 'qualified')
+
+    def compile(self):
+        nsmap = dict(self.nsmap)
+        if self.namespace:
+            # поля без namespace не могут находиться в области namespace по умолчанию
+            prefix = self.prefix if self.prefix or self.qualified else 'ns0'
+            nsmap[prefix] = self.namespace
+        template = etree.Element(self.tag, nsmap=nsmap)
+        field_namespace = self.namespace if self.qualified else None
+        for field in self.fields:
+            etree.SubElement(template, etree.QName(field_namespace, field.name).text)
+        return template
+
+    def build(self, **values):
+        """Контент с заданными значениями полей
+        :param values - значения по Field.key; None - поле без значения
+        :return lxml.etree._Element"""
+        self.check(values)
+        root = copy.deepcopy(self.template)
+        missing = []
+        for element, field in zip(root, self.fields):
+            value = values.get(field.key)
+            if value is not None:
+                element.text = str(value)
+            elif not field.required:
+                missing.append(element)
+        for element in missing:
+            root.remove(element)
+        return root
+
+    def build_sax(self, **values):
+        """Контент с заданными значениями полей элементами suds sax, с префиксами и объявлениями шаблона
+        :param values - значения по Field.key; None - поле без значения
+        :return suds.sax.element.Element"""
+        self.check(values)
+        template = self.template
+        prefix = template.prefix
+        root = Element('%s:%s' % (prefix, self.root) if prefix else self.root)
+        for ns_prefix, uri in template.nsmap.items():
+            if ns_prefix is None:
+                root.expns = uri
+            else:
+                root.nsprefixes[ns_prefix] = uri
+        field_prefix = prefix if self.qualified else None
+        for field in self.fields:
+            value = values.get(field.key)
+            if value is None and not field.required:
+                continue
+            child = Element('%s:%s' % (field_prefix, field.name) if field_prefix else field.name)
+            if value is not None:
+                child.setText(str(value))
+            root.append(child)
+        return root
+
+    def check(self, values):
+        unknown = set(values) - {field.key for field in self.fields}
+        if unknown:
+            raise SmevClientError('Unknown fields for %s: %s' % (self.root, ', '.join(sorted(unknown))))
+
+    def parse(self, element):
+        """Значения полей элемента контента (например, из ответа)
+        :param element :type lxml.etree._Element
+        :return dict {Field.key: текст}"""
+        keys = self._keys
+        return {keys[child.tag]: child.text for child in element if child.tag in keys}
+
+    def __repr__(self):
+        return '<ContentType %s>' % self.tag
+
+
+def to_sax(element, parent_nsmap=None):
+    """lxml элемент как элемент suds sax, без сериализации и повторного разбора.
+    Объявления namespaces, префиксы, атрибуты и текст (включая хвосты дочерних элементов) сохраняются,
+    как при разборе suds.sax.parser.Parser.
+    :param element :type lxml.etree._Element
+    :param parent_nsmap :type dict - namespaces, объявленные выше по дереву
+    :return suds.sax.element.Element"""
+    nsmap = element.nsmap
+    localname = element.tag.rpartition('}')[2]
+    node = Element('%s:%s' % (element.prefix, localname) if element.prefix else localname)
+    if nsmap != parent_nsmap:
+        parent_nsmap = parent_nsmap or {}
+        for prefix, uri in nsmap.items():
+            if parent_nsmap.get(prefix) != uri:
+                if prefix is None:
+                    node.expns = uri
+                else:
+                    node.nsprefixes[prefix] = uri
+    if element.attrib:
+        # атрибуты в namespace всегда с префиксом: xml, объявленный для элемента или новый
+        prefixes = {uri: prefix for prefix, uri in nsmap.items() if prefix is not None}
+        prefixes[XML] = 'xml'
+        for name, value in element.attrib.items():
+            name = etree.QName(name)
+            if name.namespace:
+                prefix = prefixes.get(name.namespace)
+                if prefix is None:
+                    number = 0
+                    while 'ns%s' % number in nsmap or 'ns%s' % number in node.nsprefixes:
+                        number += 1
+                    prefix = prefixes[name.namespace] = 'ns%s' % number
+                    node.nsprefixes[prefix] = name.namespace
+                node.append(Attribute('%s:%s' % (prefix, name.localname), value))
+            else:
+                node.append(Attribute(name.localname, value))
+    text = element.text
+    for child in element:
+        if isinstance(child.tag, str):
+            node.append(to_sax(child, nsmap))
+        if child.tail:
+            text = (text or '') + child.tail
+    if text and node.children:
+        # Parser обрезает пробелы текста элементов с дочерними элементами
+        text = text.strip()
+    if text:
+        node.setText(text)
+    return node
+
+
+class ContentRegistry:
+    """Реестр типов контента по корневому элементу.
+
+    Типы регистрируются один раз на процесс; поиск по имени в нотации Кларка
+    или по локальному имени позволяет тем же реестром разбирать контент ответов."""
+
+    def __init__(self):
+        self._types = dict()
+        self._lock = threading.Lock()
+
+    def register(self, content_type):
+        """:param content_type :type ContentType
+        :return content_type"""
+        with self._lock:
+            self._types[content_type.tag] = content_type
+        return content_type
+
+    def get(self, root, namespace=None):
+        """Тип контента по корневому элементу
+        :param root :type str - локальное имя или имя в нотации Кларка
+        :param namespace :type str
+        :return ContentType"""
+        tag = etree.QName(namespace, root).text if namespace else root
+        content_type = self._types.get(tag)
+        if content_type is None and not namespace and not tag.startswith('{'):
+            found = [t for t in self._types.values() if t.root == root]
+            if len(found) == 1:
+                content_type = found[0]
+        if content_type is None:
+            raise SmevClientError('Content type %s is not registered' % tag)
+        return content_type
+
+    def lookup(self, element):
+        """Тип контента элемента или None
+        :param element :type lxml.etree._Element"""
+        return self._types.get(element.tag)
+
+    def parse(self, element):
+        """Разбор контента по зарегистрированному типу
+        :param element :type lxml.etree._Element - корневой элемент контента
+        :return tuple (ContentType, dict)"""
+        content_type = self.lookup(element)
+        if content_type is None:
+            raise SmevClientError('Content type %s is not registered' % element.tag)
+        return content_type, content_type.parse(element)
+
+    def __contains__(self, tag):
+        return tag in self._types
+
+
+# реестр по умолчанию, общий на процесс
+content_registry = ContentRegistry()
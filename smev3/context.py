@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current_call = ContextVar('smev3_call', default=None)
+
+
+class CallContext:
+    """Состояние одного вызова сервиса.
+
+    Все, что относится к конкретному сообщению (контент, MessageID), хранится здесь,
+    а не в атрибутах плагинов, поэтому один клиент можно использовать из нескольких
+    потоков и задач asyncio одновременно."""
+
+    def __init__(self, content=None, message_id=None, **extra):
+        """:param content - аргументы ContentPlugin.make_content для этого сообщения
+        :param message_id :type str"""
+        self.content = content
+        self.message_id = message_id
+        self.extra = extra
+
+
+def current_call():
+    """Контекст текущего вызова или None вне вызова
+    :return CallContext"""
+    return _current_call.get()
+
+
+@contextmanager
+def call_scope(**kwargs):
+    """Установка контекста вызова на время выполнения блока"""
+    call = CallContext(**kwargs)
+    token = _current_call.set(call)
+    try:
+        yield call
+    finally:
+        _current_call.reset(token)
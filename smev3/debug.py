@@ -0,0 +1,101 @@
+import logging
+import os
+import queue
+import random
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class DumpSink:
+    """Выборочное сохранение промежуточных данных подписи для отладки.
+
+    Решение о сохранении принимается для сообщения целиком с вероятностью sample_rate.
+    Файлы пишутся фоновым потоком из ограниченной очереди: при переполнении данные
+    отбрасываются (счетчик dropped), подпись сообщений никогда не ждет диска.
+    Имена файлов: <MessageID>.<этап>.xml"""
+
+    def __init__(self, directory, sample_rate=1.0, max_queue=1000):
+        """:param directory :type str - каталог для файлов
+        :param sample_rate :type float - доля сохраняемых сообщений от 0 до 1
+        :param max_queue :type int - максимальное число файлов, ожидающих записи"""
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def path(self, message_id, name):
+        safe_id = re.sub(r'[^A-Za-z0-9_.-]', '_', message_id or 'unknown')
+        return os.path.join(self.directory, '%s.%s.xml' % (safe_id, name))
+
+    def dump(self, message_id, name, data):
+        """Постановка данных в очередь записи
+        :param message_id :type str
+        :param name :type str - этап (digest_content, signed_content, out)
+        :param data :type bytes"""
+        self.start()
+        try:
+            self._queue.put_nowait((self.path(message_id, name), data))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name='smev3-dump', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                path, data = item
+                with open(path, 'wb') as f:
+                    f.write(data)
+            except OSError:
+                logger.exception('Unable to write debug dump')
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Ожидание записи всех поставленных в очередь файлов"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+
+_default_sink = None
+
+
+def configure(directory=None, sample_rate=1.0, max_queue=1000):
+    """Включение отладочного сохранения для всех SignPlugin процесса, directory=None - выключение
+    :return DumpSink или None"""
+    global _default_sink
+    previous = _default_sink
+    _default_sink = DumpSink(directory, sample_rate, max_queue) if directory else None
+    if previous is not None:
+        previous.close()
+    return _default_sink
+
+
+def get_sink():
+    return _default_sink
@@ -0,0 +1,103 @@
+import copy
+
+from lxml import etree
+from suds.client import RequestContext, _SoapClient
+from suds.plugin import PluginContainer
+from suds.transport import Request, TransportError
+
+SOAP_ENV = 'http://schemas.xmlsoap.org/soap/envelope/'
+TYPES = 'urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2'
+BASIC = 'urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.2'
+DS = 'http://www.w3.org/2000/09/xmldsig#'
+NS_MAP = {'SOAP-ENV': SOAP_ENV, 'ns0': TYPES, 'ns1': BASIC, 'ds': DS}
+
+
+class EnvelopeTemplate:
+    """Заранее собранный конверт SendRequest.
+
+    Скелет конверта, включая CallerInformationSystemSignature и дополнительные
+    подписи SignPlugin.signatures с SignedInfo, строится один раз. Для каждого
+    сообщения копируется готовое lxml дерево и заполняются MessageID, контент и
+    сертификаты X509Certificate (из KeyStore, поэтому ротация сертификата видна
+    сразу); DigestValue и SignatureValue вычисляет SignPlugin.sign_document без
+    повторного разбора XML."""
+
+    def __init__(self, sign_plugin):
+        """:param sign_plugin :type smev3.plugins.SignPlugin"""
+        self.sign_plugin = sign_plugin
+        # сертификаты подписей в порядке элементов ds:Signature конверта
+        self.cert_paths = [reference.cert_path for reference in sign_plugin.signatures] + [None]
+        self.root = self.build()
+
+    def build(self):
+        envelope = etree.Element('{%s}Envelope' % SOAP_ENV, nsmap={'SOAP-ENV': SOAP_ENV, 'ns0': TYPES, 'ns1': BASIC})
+        etree.SubElement(envelope, '{%s}Header' % SOAP_ENV)
+        body = etree.SubElement(envelope, '{%s}Body' % SOAP_ENV)
+        request = etree.SubElement(body, '{%s}SendRequestRequest' % TYPES)
+        provided_data = etree.SubElement(request, '{%s}SenderProvidedRequestData' % TYPES,
+                                         Id=self.sign_plugin.URI_ID)
+        etree.SubElement(provided_data, '{%s}MessageID' % TYPES)
+        etree.SubElement(provided_data, '{%s}MessagePrimaryContent' % BASIC)
+        for reference in self.sign_plugin.signatures:
+            container = self.sign_plugin.build_personal_signature(reference, 'ns0')
+            container.setPrefix('ns0', TYPES)
+            provided_data.append(etree.fromstring(container.str()))
+        callerinform = self.sign_plugin.build_callerinform('ns0')
+        callerinform.setPrefix('ns0', TYPES)
+        request.append(etree.fromstring(callerinform.str()))
+        etree.cleanup_namespaces(envelope)
+        return envelope
+
+    def render(self, message_id, content=None):
+        """Конверт сообщения без подписи
+        :param message_id :type str
+        :param content - контент MessagePrimaryContent: lxml или suds sax элемент (ContentPlugin.build_content)
+        :return lxml.etree._Element"""
+        root = copy.deepcopy(self.root)
+        provided_data = root.find('SOAP-ENV:Body/ns0:SendRequestRequest/ns0:SenderProvidedRequestData', NS_MAP)
+        provided_data.find('ns0:MessageID', NS_MAP).text = message_id
+        if content is not None:
+            if not isinstance(content, etree._Element):
+                content = etree.fromstring(content.str())
+            provided_data.find('ns1:MessagePrimaryContent', NS_MAP).append(content)
+        certificates = root.iterfind('.//ds:Signature/ds:KeyInfo/ds:X509Data/ds:X509Certificate', NS_MAP)
+        for element, cert_path in zip(certificates, self.cert_paths):
+            element.text = self.sign_plugin.certificate(cert_path)
+        return root
+
+
+class PreparedSoapClient(_SoapClient):
+    """Отправка готового конверта: suds используется только для адреса, заголовков и обработки ответа"""
+
+    def build_envelope(self, *args):
+        """Построение и подпись конверта плагинами, как в suds _SoapClient.send, без отправки
+        :return bytes"""
+        soapenv = self.method.binding.input.get_message(self.method, args, {})
+        plugins = PluginContainer(self.options.plugins)
+        plugins.message.marshalled(envelope=soapenv.root())
+        soapenv = soapenv.str() if self.options.prettyxml else soapenv.plain()
+        return plugins.message.sending(envelope=soapenv.encode('utf-8')).envelope
+
+    def headers(self):
+        """HTTP заголовки SOAP запроса, как в suds _SoapClient"""
+        action = self.method.soap.action
+        if isinstance(action, str):
+            action = action.encode('utf-8')
+        result = {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': action}
+        result.update(**self.options.headers)
+        return result
+
+    def send_envelope(self, envelope, timeout=None):
+        """Аналог suds _SoapClient.send без построения конверта и вызова плагинов
+        :param envelope :type bytes
+        :return RequestContext при опции nosend, иначе ответ сервиса"""
+        if self.options.nosend:
+            return RequestContext(self.process_reply, envelope)
+        request = Request(self.options.location or self.method.location, envelope, timeout)
+        request.headers = self.headers()
+        try:
+            reply = self.options.transport.send(request)
+        except TransportError as e:
+            content = e.fp and e.fp.read() or ''
+            return self.process_reply(content, e.httpcode, str(e))
+        return self.process_reply(reply.message, None, None)
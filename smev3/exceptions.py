@@ -9,3 +9,11 @@ class PluginError(SmevClientError):
 
 class CertificateError(Exception):
     """Исключение сертификата"""
+
+
+class SignerError(SmevClientError):
+    """Исключение подписи"""
+
+
+class SignatureVerificationError(SmevClientError):
+    """Исключение проверки подписи"""
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import threading
+import time
+
+from smev3.signer import load_signer
+from smev3.utils import load_certificate
+
+
+class KeyStore:
+    """Кэш сертификатов и закрытых ключей в пределах процесса.
+
+    Файл разбирается один раз и переиспользуется всеми экземплярами плагинов.
+    При изменении mtime, inode или размера файла материал перечитывается, так что
+    ротация сертификата не требует перезапуска. Проверка файла выполняется
+    не чаще одного раза в check_interval секунд. Пароли ключей в ключах кэша
+    не хранятся: ключ записи - хэш BLAKE2b пути и пароля с солью экземпляра."""
+
+    def __init__(self, check_interval=1.0):
+        """:param check_interval :type float - период проверки файлов на изменение, 0 - при каждом обращении"""
+        self.check_interval = check_interval
+        self._entries = dict()
+        self._lock = threading.Lock()
+        self._salt = os.urandom(16)
+
+    def _stamp(self, path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+    def _key(self, kind, path, args):
+        h = hashlib.blake2b(digest_size=32, salt=self._salt)
+        for value in (kind, path) + args:
+            h.update(repr(value).encode() + b'\0')
+        return h.digest()
+
+    def _get(self, kind, path, loader, *args):
+        path = os.path.abspath(path)
+        key = self._key(kind, path, args)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self.check_interval:
+            return entry[2]
+
+        stamp = self._stamp(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != stamp:
+                value = loader(path, *args)
+            else:
+                value = entry[2]
+            self._entries[key] = (now, stamp, value)
+        return value
+
+    def certificate(self, cert_path):
+        """Сертификат в base64 (DER без переносов строк) для подстановки в X509Certificate
+        :param cert_path :type str
+        :return str"""
+        return self._get('certificate', cert_path, load_certificate)
+
+    def signer(self, pkey_path, password=None):
+        """Подписант для файла закрытого ключа
+        :return smev3.signer.Signer"""
+        return self._get('signer', pkey_path, load_signer, password)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+key_store = KeyStore()
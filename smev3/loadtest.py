@@ -0,0 +1,244 @@
+"""Нагрузочный генератор: одновременные клиенты отправляют сообщения в СМЭВ или в локальную заглушку.
+
+Запуск: python -m smev3.loadtest --key КЛЮЧ --cert СЕРТИФИКАТ [--wsdl URL] [--concurrency 8]
+    [--messages 1000 | --duration 30] [--size 1K] [--scenario send|roundtrip] [--async] [--latency 0.05]
+    [--fault-rate 0.01] [--check-digest]
+
+Без --wsdl запускается локальная заглушка smev3.stand с заданными задержкой и долей ошибок.
+Сценарий send - SendRequest; roundtrip - SendRequest, GetResponse и Ack полученного ответа.
+По окончании выводятся число сообщений и ошибок, сообщений в секунду и перцентили задержки
+одной операции сценария."""
+import argparse
+import asyncio
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from suds.cache import NoCache
+
+from smev3.benchmark import PayloadPlugin, generate_payload, parse_size
+from smev3.client import AsyncSmev3Client, BaseSmev3Client
+from smev3.exceptions import SmevClientError
+from smev3.service import ServiceModelRegistry
+from smev3.stand import SmevStand
+from smev3.transport import AsyncHttpTransport, PooledHttpTransport
+
+SCENARIOS = ('send', 'roundtrip')
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, q):
+    """Перцентиль методом ближайшего ранга
+    :param values - отсортированные значения
+    :param q :type float - 0..100"""
+    if not values:
+        return 0.0
+    rank = max(int(-(-q * len(values) // 100)), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+class LoadStats:
+    """Задержки операций и ошибки по типам, безопасно для нескольких потоков"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = dict()
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=None):
+        with self._lock:
+            if error is None:
+                self.latencies.append(seconds)
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        """:return dict: messages, errors, seconds, rate (сообщений в секунду), p50/p90/p99/max/mean (секунды)"""
+        values = sorted(self.latencies)
+        seconds = max((self.finished or time.perf_counter()) - self.started, 1e-9)
+        result = dict(messages=len(values), errors=sum(self.errors.values()), seconds=seconds,
+                      rate=len(values) / seconds, max=values[-1] if values else 0.0,
+                      mean=sum(values) / len(values) if values else 0.0)
+        for q in PERCENTILES:
+            result['p%s' % q] = percentile(values, q)
+        return result
+
+    def report(self):
+        summary = self.summary()
+        lines = ['%(messages)s messages, %(errors)s errors in %(seconds).2f s: %(rate).1f msg/s' % summary,
+                 'latency ms: ' + ' '.join('%s=%.1f' % (key, summary[key] * 1000)
+                                           for key in ['p%s' % q for q in PERCENTILES] + ['max', 'mean'])]
+        lines.extend('  %s: %s' % item for item in sorted(self.errors.items()))
+        return '\n'.join(lines)
+
+
+class Budget:
+    """Раздача номеров сообщений, пока не исчерпано их число или время"""
+
+    def __init__(self, messages=None, duration=None):
+        self.messages = messages
+        self.deadline = time.monotonic() + duration if duration else None
+        self.issued = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        """Номер следующего сообщения или None"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return None
+        with self._lock:
+            if self.messages is not None and self.issued >= self.messages:
+                return None
+            self.issued += 1
+            return self.issued
+
+
+def client_class(base, wsdl_url, key_file, cert_file, password=None):
+    """Класс клиента для сервиса wsdl_url; описание загружается по сети без дискового кэша"""
+    registry = ServiceModelRegistry(cache=NoCache())
+    return type('LoadTestClient', (base,), dict(SMEV_EXEC_URL=wsdl_url, SERVICE_REGISTRY=registry,
+                                                PRIVATE_KEY_FILE=key_file, CERTIFICATE_FILE=cert_file,
+                                                PASSWORD=password))
+
+
+def roundtrip(client, content):
+    """SendRequest, GetResponse и Ack полученного ответа"""
+    client.send_request(content=content, message_id=str(uuid.uuid1()))
+    message = client.get_response()
+    if message is not None:
+        client.ack(message.Response.SenderProvidedResponseData.MessageID)
+
+
+def run_threads(wsdl_url, concurrency, budget, payload, scenario='send', **client_options):
+    """Нагрузка из concurrency потоков с общим клиентом и пулом соединений
+    :return LoadStats"""
+    transport = PooledHttpTransport(maxsize=concurrency)
+    client = client_class(BaseSmev3Client, wsdl_url, **client_options)(PayloadPlugin(), transport=transport)
+    content = dict(payload=payload)
+    stats = LoadStats()
+
+    def worker():
+        while budget.next() is not None:
+            started = time.perf_counter()
+            try:
+                if scenario == 'send':
+                    client.send_request(content=content, message_id=str(uuid.uuid1()))
+                else:
+                    roundtrip(client, content)
+            except Exception as e:
+                stats.record(time.perf_counter() - started, type(e).__name__)
+            else:
+                stats.record(time.perf_counter() - started)
+
+    try:
+        with ThreadPoolExecutor(concurrency, thread_name_prefix='smev3-load') as executor:
+            for future in [executor.submit(worker) for _ in range(concurrency)]:
+                future.result()
+    finally:
+        stats.stop()
+        transport.close()
+    return stats
+
+
+def run_async(wsdl_url, concurrency, budget, payload, **client_options):
+    """Нагрузка SendRequest из concurrency задач asyncio; подпись выполняется в пуле потоков
+    :return LoadStats"""
+    content = dict(payload=payload)
+    stats = LoadStats()
+
+    async def run():
+        transport = AsyncHttpTransport(maxsize=concurrency)
+        client = client_class(AsyncSmev3Client, wsdl_url, **client_options)(
+            PayloadPlugin(), http_transport=transport, executor=ThreadPoolExecutor(concurrency))
+
+        async def worker():
+            while budget.next() is not None:
+                started = time.perf_counter()
+                try:
+                    await client.send_request(content=content, message_id=str(uuid.uuid1()))
+                except Exception as e:
+                    stats.record(time.perf_counter() - started, type(e).__name__)
+                else:
+                    stats.record(time.perf_counter() - started)
+
+        async with client:
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        client.executor.shutdown()
+
+    try:
+        asyncio.run(run())
+    finally:
+        stats.stop()
+    return stats
+
+
+def run(wsdl_url, concurrency=8, messages=None, duration=None, size='1K', scenario='send', use_async=False,
+        **client_options):
+    """Нагрузочный прогон
+    :param wsdl_url :type str - описание сервиса
+    :param concurrency :type int - число одновременных клиентов
+    :param messages :type int - число сообщений
+    :param duration :type float - длительность, секунды; без messages и duration - 100 сообщений
+    :param size :type str - размер контента, например 1K
+    :param client_options: key_file, cert_file и password для client_class
+    :return LoadStats"""
+    if scenario not in SCENARIOS:
+        raise SmevClientError('Unknown scenario %s' % scenario)
+    if use_async and scenario != 'send':
+        raise SmevClientError('Async load supports only send scenario')
+    if messages is None and duration is None:
+        messages = 100
+    payload = generate_payload(parse_size(size))
+    budget = Budget(messages, duration)
+    if use_async:
+        return run_async(wsdl_url, concurrency, budget, payload, **client_options)
+    return run_threads(wsdl_url, concurrency, budget, payload, scenario, **client_options)
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(prog='python -m smev3.loadtest', description=__doc__.splitlines()[0])
+    parser.add_argument('--wsdl', help='URL описания сервиса, по умолчанию запускается smev3.stand')
+    parser.add_argument('--concurrency', type=int, default=8, help='число одновременных клиентов')
+    parser.add_argument('--messages', type=int, help='число сообщений')
+    parser.add_argument('--duration', type=float, help='длительность, секунды')
+    parser.add_argument('--size', default='1K', help='размер контента сообщения')
+    parser.add_argument('--scenario', choices=SCENARIOS, default='send')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='AsyncSmev3Client вместо потоков')
+    parser.add_argument('--key', required=True, help='файл закрытого ключа')
+    parser.add_argument('--cert', required=True, help='файл сертификата')
+    parser.add_argument('--password', help='пароль закрытого ключа')
+    stand_options = parser.add_argument_group('локальная заглушка')
+    stand_options.add_argument('--latency', type=float, default=0.0, help='задержка ответа, секунды')
+    stand_options.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, секунды')
+    stand_options.add_argument('--fault-rate', type=float, default=0.0, help='доля ответов SOAP Fault')
+    stand_options.add_argument('--error-rate', type=float, default=0.0, help='доля ответов HTTP 503')
+    stand_options.add_argument('--check-digest', action='store_true', help='проверять DigestValue подписей')
+    args = parser.parse_args(argv)
+
+    stand = None
+    wsdl_url = args.wsdl
+    if wsdl_url is None:
+        stand = SmevStand(latency=args.latency, jitter=args.jitter, fault_rate=args.fault_rate,
+                          error_rate=args.error_rate, check_digest=args.check_digest).start()
+        wsdl_url = stand.wsdl_url
+    try:
+        stats = run(wsdl_url, args.concurrency, args.messages, args.duration, args.size, args.scenario,
+                    args.use_async, key_file=args.key, cert_file=args.cert, password=args.password)
+    finally:
+        if stand is not None:
+            stand.stop()
+    print(stats.report(), file=out)
+    if stand is not None:
+        print('stand: ' + ' '.join('%s=%s' % item for item in stand.stats.items()), file=out)
+    # внесенные заглушкой ошибки ожидаемы, прогон неудачен, если не отправлено ни одного сообщения
+    return 0 if stats.latencies else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import bisect
+import logging
+import threading
+import time
+
+from smev3.context import current_call
+
+logger = logging.getLogger(__name__)
+
+# наблюдатели хранятся кортежем: чтение без блокировки, изменение заменой кортежа
+_observers = ()
+_lock = threading.Lock()
+
+
+class Observer:
+    """Получатель замеров этапов отправки сообщения.
+
+    Этапы: send_request (вызов целиком), prepare (построение конверта без отправки),
+    marshal (ContentPlugin.marshalled), sending (SignPlugin.sending), digest (преобразование
+    и хэш контента), signature (SignedInfo и подпись), attachments (заголовки, хэш и подпись
+    вложений), http (запрос к СМЭВ)."""
+
+    def observe(self, stage, seconds, tags):
+        """:param stage :type str - этап
+        :param seconds :type float - длительность
+        :param tags :type dict - message_id, plugin (тип плагина контента), error (тип исключения) и др."""
+        raise NotImplementedError()
+
+
+class CallbackObserver(Observer):
+    """Наблюдатель-функция callback(stage, seconds, tags)"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def observe(self, stage, seconds, tags):
+        self.callback(stage, seconds, tags)
+
+
+class StatsObserver(Observer):
+    """Счетчики и гистограммы длительностей этапов в формате Prometheus.
+
+    Метки: stage, plugin и error; MessageID в метки не попадает, чтобы не раздувать число рядов."""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    LABELS = ('stage', 'plugin', 'error')
+
+    def __init__(self, prefix='smev3', buckets=BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.series = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, tags):
+        key = (stage, tags.get('plugin') or '', tags.get('error') or '')
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = dict(buckets=[0] * len(self.buckets), count=0, sum=0.0)
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['count'] += 1
+            series['sum'] += seconds
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus
+        :return str"""
+        name = '%s_stage_seconds' % self.prefix
+        lines = ['# HELP %s Duration of SMEV send pipeline stages' % name, '# TYPE %s histogram' % name]
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in self.series.items())
+        for key, value in series:
+            labels = ','.join('%s="%s"' % item for item in zip(self.LABELS, key) if item[1])
+            cumulative = 0
+            for bound, count in zip(self.buckets, value['buckets']):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %s' % (name, labels, bound, cumulative))
+            lines.append('%s_bucket{%s,le="+Inf"} %s' % (name, labels, value['count']))
+            lines.append('%s_sum{%s} %s' % (name, labels, value['sum']))
+            lines.append('%s_count{%s} %s' % (name, labels, value['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def add_observer(observer):
+    global _observers
+    with _lock:
+        _observers = _observers + (observer,)
+    return observer
+
+
+def remove_observer(observer):
+    global _observers
+    with _lock:
+        _observers = tuple(o for o in _observers if o is not observer)
+
+
+def start():
+    """Отметка начала этапа; без наблюдателей - None, и замер не выполняется"""
+    if not _observers:
+        return None
+    return time.perf_counter()
+
+
+def finish(stage, started, **tags):
+    """Передача длительности этапа наблюдателям.
+    Метки message_id и plugin по умолчанию берутся из контекста текущего вызова.
+    :param stage :type str
+    :param started - результат start()"""
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    call = current_call()
+    if tags.get('error') is None:
+        tags.pop('error', None)
+    if call is not None:
+        tags.setdefault('message_id', call.message_id)
+        tags.setdefault('plugin', call.extra.get('plugin'))
+    for observer in _observers:
+        try:
+            observer.observe(stage, seconds, tags)
+        except Exception:
+            logger.exception('Metrics observer failed')
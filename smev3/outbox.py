@@ -0,0 +1,256 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from suds import WebFault
+
+logger = logging.getLogger(__name__)
+
+PREPARING = 'preparing'
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    message_id TEXT PRIMARY KEY,
+    envelope BLOB,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+"""
+
+COLUMNS = 'message_id, status, attempts, next_attempt, created, updated, error'
+
+
+class OutboxEntry:
+    """Состояние сообщения в исходящей очереди"""
+
+    def __init__(self, message_id, status, attempts=0, next_attempt=0, created=None, updated=None, error=None):
+        self.message_id = message_id
+        self.status = status
+        self.attempts = attempts
+        self.next_attempt = next_attempt
+        self.created = created
+        self.updated = updated
+        self.error = error
+
+    def __repr__(self):
+        return '<OutboxEntry %s %s attempts=%s>' % (self.message_id, self.status, self.attempts)
+
+
+class Outbox:
+    """Постоянная исходящая очередь подписанных конвертов SendRequest в SQLite.
+
+    submit подписывает сообщение и сохраняет конверт по MessageID; повторная передача
+    того же MessageID не подписывает и не отправляет сообщение заново. Отправку выполняет
+    пул из workers потоков: сообщения, срок отправки которых наступил, выбираются пачкой,
+    при ошибке транспорта или недоступности СМЭВ отправка повторяется с тем же подписанным
+    конвертом через интервал, растущий от min_delay до max_delay в backoff раз. SOAP Fault
+    СМЭВ считается окончательной ошибкой. Неотправленные сообщения переживают перезапуск процесса."""
+
+    def __init__(self, client, path, workers=4, max_attempts=10, min_delay=1.0, max_delay=300.0, backoff=2.0,
+                 poll_interval=1.0, on_sent=None, on_failed=None):
+        """
+        :param client: экземпляр BaseSmev3Client, общий для всех потоков
+        :param path :type str - файл базы SQLite
+        :param workers :type int - число потоков отправки
+        :param max_attempts :type int - число попыток, после которого сообщение получает статус failed
+        :param min_delay, max_delay :type float - границы интервала между попытками, секунды
+        :param backoff :type float - множитель интервала после каждой неудачной попытки
+        :param poll_interval :type float - период проверки очереди, секунды
+        :param on_sent: функция on_sent(message_id, reply) после успешной отправки
+        :param on_failed: функция on_failed(message_id, error) после окончательной ошибки
+        """
+        self.client = client
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.stats = dict(submitted=0, duplicates=0, sent=0, retried=0, failed=0)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._in_flight = 0
+        self._thread = None
+        self._executor = None
+
+    def execute(self, sql, *args):
+        """Выполнение изменяющего запроса
+        :return int - число измененных строк"""
+        with self._lock:
+            return self._db.execute(sql, args).rowcount
+
+    def query(self, sql, *args):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, message_id):
+        """Состояние сообщения или None
+        :return OutboxEntry"""
+        rows = self.query('SELECT %s FROM outbox WHERE message_id = ?' % COLUMNS, message_id)
+        return OutboxEntry(*rows[0]) if rows else None
+
+    def counts(self):
+        """Число сообщений по статусам
+        :return dict"""
+        return dict(self.query('SELECT status, COUNT(*) FROM outbox GROUP BY status'))
+
+    def submit(self, content=None, message_id=None):
+        """Подпись и постановка сообщения в очередь.
+        Сообщение с уже известным MessageID не подписывается заново, возвращается его состояние.
+        :param content :type dict - аргументы make_content плагина контента
+        :param message_id :type str - MessageID, по умолчанию генерируется
+        :return OutboxEntry"""
+        message_id = message_id or str(uuid.uuid1())
+        now = time.time()
+        with self._lock:
+            # MessageID резервируется до подписи: параллельная передача того же сообщения не подписывает его
+            reserved = self._db.execute(
+                'INSERT OR IGNORE INTO outbox (message_id, status, created, updated) VALUES (?, ?, ?, ?)',
+                (message_id, PREPARING, now, now)).rowcount
+        if not reserved:
+            self.count('duplicates')
+            return self.get(message_id)
+
+        try:
+            envelope = self.client.prepare_envelope(content, message_id)
+        except BaseException:
+            self.execute('DELETE FROM outbox WHERE message_id = ?', message_id)
+            raise
+        self.execute('UPDATE outbox SET envelope = ?, status = ?, next_attempt = ?, updated = ? WHERE message_id = ?',
+                     envelope, PENDING, now, time.time(), message_id)
+        self.count('submitted')
+        self._wakeup.set()
+        return self.get(message_id)
+
+    def retry(self, message_id):
+        """Повторная отправка сообщения со статусом failed
+        :return bool - сообщение возвращено в очередь"""
+        updated = self.execute('UPDATE outbox SET status = ?, attempts = 0, next_attempt = ?, updated = ? '
+                               'WHERE message_id = ? AND status = ?',
+                               PENDING, time.time(), time.time(), message_id, FAILED)
+        self._wakeup.set()
+        return bool(updated)
+
+    def purge(self, older_than):
+        """Удаление отправленных сообщений старше older_than секунд.
+        Повторная передача удаленного MessageID снова будет отправлена.
+        :return int - число удаленных сообщений"""
+        return self.execute('DELETE FROM outbox WHERE status = ? AND updated < ?',
+                            SENT, time.time() - older_than)
+
+    def start(self):
+        # сообщения, отправка которых прервалась остановкой процесса, отправляются снова;
+        # неподписанные резервы удаляются: submit для них не завершился
+        self.execute('UPDATE outbox SET status = ? WHERE status = ?', PENDING, SENDING)
+        self.execute('DELETE FROM outbox WHERE status = ?', PREPARING)
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='smev3-outbox')
+        self._thread = threading.Thread(target=self.dispatch, name='smev3-outbox-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Остановка отправки; начатые отправки завершаются"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def claim(self, limit):
+        """Пачка сообщений, срок отправки которых наступил, с переводом в статус sending
+        :return list (message_id, envelope, attempts)"""
+        with self._lock:
+            rows = self._db.execute('SELECT message_id, envelope, attempts FROM outbox '
+                                    'WHERE status = ? AND next_attempt <= ? ORDER BY next_attempt LIMIT ?',
+                                    (PENDING, time.time(), limit)).fetchall()
+            self._db.executemany('UPDATE outbox SET status = ? WHERE message_id = ?',
+                                 [(SENDING, row[0]) for row in rows])
+            self._in_flight += len(rows)
+        return rows
+
+    def dispatch(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            rows = self.claim(max(self.workers - self._in_flight, 0))
+            for row in rows:
+                self._executor.submit(self.deliver, *row)
+            if not rows:
+                self._wakeup.wait(self.poll_interval)
+
+    def delay(self, attempts):
+        return min(self.min_delay * self.backoff ** (attempts - 1), self.max_delay)
+
+    def deliver(self, message_id, envelope, attempts):
+        attempts += 1
+        try:
+            reply = self.client.send_envelope(envelope, message_id)
+        except WebFault as e:
+            self.finish(message_id, FAILED, attempts, e)
+        except Exception as e:
+            logger.warning('SendRequest %s failed, attempt %s: %s', message_id, attempts, e)
+            if attempts >= self.max_attempts:
+                self.finish(message_id, FAILED, attempts, e)
+            else:
+                self.finish(message_id, PENDING, attempts, e)
+        else:
+            self.finish(message_id, SENT, attempts)
+            if self.on_sent is not None:
+                try:
+                    self.on_sent(message_id, reply)
+                except Exception:
+                    logger.exception('Outbox on_sent callback failed')
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._wakeup.set()
+
+    def finish(self, message_id, status, attempts, error=None):
+        now = time.time()
+        next_attempt = now + self.delay(attempts) if status == PENDING else now
+        self.execute('UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, updated = ?, error = ? '
+                     'WHERE message_id = ?',
+                     status, attempts, next_attempt, now, str(error) if error is not None else None, message_id)
+        self.count({SENT: 'sent', PENDING: 'retried', FAILED: 'failed'}[status])
+        if status == FAILED:
+            logger.error('SendRequest %s failed after %s attempts: %s', message_id, attempts, error)
+            if self.on_failed is not None:
+                try:
+                    self.on_failed(message_id, error)
+                except Exception:
+                    logger.exception('Outbox on_failed callback failed')
@@ -1,14 +1,24 @@
 import base64
+import functools
+import os
 import re
+import threading
 import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 from lxml import etree
 from suds.plugin import MessagePlugin
 from suds.sax.element import Element
 
+from smev3 import debug, metrics
+from smev3.attachments import PLACEHOLDER, RefAttachment, StreamingEnvelope, build_pkcs7
+from smev3.content import ContentType, Field, content_registry, to_sax
+from smev3.context import current_call
+from smev3.digest import get_backend, new_digest
 from smev3.exceptions import PluginError
-from smev3.transform import Smev3Transform
-from smev3.utils import load_certificate, encode_c14n, get_gost_r_3410_digest, get_gost_r_34102001_signature
+from smev3.keystore import key_store as default_key_store
+from smev3.transform import CanonicalFragment, Smev3Transform
+from smev3.utils import encode_c14n, get_gost_r_3410_digest
 
 
 class BasePlugin(MessagePlugin):
@@ -42,9 +52,27 @@ class ContentPlugin(BasePlugin):
         self.content_kwargs = content_kwargs
 
     def marshalled(self, context):
+        started = metrics.start()
         content_container = self.get_content_container(context)
-        content = self.make_content(**self.content_kwargs)
-        content_container.insert(content)
+        # GetResponse, Ack - контент не передается
+        if content_container is not None:
+            content = self.make_content(**self.get_content_kwargs())
+            if isinstance(content, etree._Element):
+                # make_content, возвращающий lxml, преобразуется без сериализации
+                content = to_sax(content)
+            content_container.insert(content)
+        metrics.finish('marshal', started)
+
+    def build_content(self):
+        """Контент текущего сообщения для шаблона конверта: элемент suds sax или lxml"""
+        return self.make_content(**self.get_content_kwargs())
+
+    def get_content_kwargs(self):
+        """Аргументы make_content: из контекста текущего вызова, иначе заданные в конструкторе"""
+        call = current_call()
+        if call is not None and call.content is not None:
+            return call.content
+        return self.content_kwargs
 
     def get_content_container(self, context):
         return context.envelope.childAtPath('Body/SendRequestRequest/SenderProvidedRequestData/MessagePrimaryContent')
@@ -53,24 +81,123 @@ class ContentPlugin(BasePlugin):
         raise NotImplementedError()
 
 
-class UPRIDPlugin(ContentPlugin):
+class DeclarativeContentPlugin(ContentPlugin):
+    """Контент по объявленному типу. Конверт suds получает элементы suds sax (make_content),
+    шаблон конверта - элемент lxml (make_element): каждый путь строит контент сразу в своем виде."""
 
-    def make_content(self, routing_code, passport_series, passport_number,
-                     first_name, middle_name, last_name, snils=None):
-        ns = ('tns', "urn://mincomsvyaz/esia/uprid/1.2.0")
-        root = self.create_element('ESIADataVerifyRequest', ns=ns)
-        root.addPrefix('ns2', "urn://mincomsvyaz/esia/commons/rg_sevices_types/1.2.0")
-        prefix = root.prefix
-        root.append(self.create_element('RoutingCode', prefix=prefix, text=routing_code))
-        root.append(self.create_element('passportSeries', prefix=prefix, text=passport_series))
-        root.append(self.create_element('passportNumber', prefix=prefix, text=passport_number))
-        root.append(self.create_element('lastName', prefix=prefix, text=last_name))
-        root.append(self.create_element('firstName', prefix=prefix, text=first_name))
-        root.append(self.create_element('middleName', prefix=prefix, text=middle_name))
+    content_type = None
 
-        if snils:
-            root.append(self.create_element('snils', prefix=prefix, text=snils))
-        return root
+    def __init__(self, content_type=None, content_kwargs=None):
+        """:param content_type :type smev3.content.ContentType или корневой элемент типа из content_registry"""
+        super().__init__(content_kwargs)
+        if isinstance(content_type, str):
+            content_type = content_registry.get(content_type)
+        if content_type is not None:
+            self.content_type = content_type
+
+    def build_content(self):
+        return self.make_element(**self.get_content_kwargs())
+
+    def make_element(self, **values):
+        """:return lxml.etree._Element"""
+        return self.content_type.build(**values)
+
+    def make_content(self, **values):
+        """:return suds.sax.element.Element"""
+        return self.content_type.build_sax(**values)
+
+
+UPRID_CONTENT = content_registry.register(ContentType(
+    'urn://mincomsvyaz/esia/uprid/1.2.0', 'ESIADataVerifyRequest',
+    [Field('RoutingCode', key='routing_code'),
+     Field('passportSeries', key='passport_series'),
+     Field('passportNumber', key='passport_number'),
+     Field('lastName', key='last_name'),
+     Field('firstName', key='first_name'),
+     Field('middleName', key='middle_name'),
+     Field('snils', required=False)],
+    prefix='tns', nsmap={'ns2': 'urn://mincomsvyaz/esia/commons/rg_sevices_types/1.2.0'}))
+
+
+class UPRIDPlugin(DeclarativeContentPlugin):
+
+    content_type = UPRID_CONTENT
+
+    def __init__(self, content_kwargs=None):
+        super().__init__(content_kwargs=content_kwargs)
+
+    def make_element(self, **values):
+        return super().make_element(**self.content_values(**values))
+
+    def make_content(self, **values):
+        return super().make_content(**self.content_values(**values))
+
+    @staticmethod
+    def content_values(routing_code, passport_series, passport_number,
+                       first_name, middle_name, last_name, snils=None):
+        """Значения полей запроса; пустой СНИЛС не выводится"""
+        return dict(routing_code=routing_code, passport_series=passport_series, passport_number=passport_number,
+                    first_name=first_name, middle_name=middle_name, last_name=last_name, snils=snils or None)
+
+
+def _digest(data):
+    return new_digest(data).digest()
+
+
+def _digest_state(data):
+    """Объект хэша после обработки data, хэширование продолжается вызывающим"""
+    return new_digest(data)
+
+
+class SignatureReference:
+    """Дополнительная подпись XMLDSig элемента контента, например PersonalSignature.
+
+    ds:Signature помещается в элемент container в SenderProvidedRequestData после
+    MessagePrimaryContent и подписывает элемент контента с атрибутом Id=uri_id.
+    Ключ и сертификат по умолчанию - ключ и сертификат SignPlugin."""
+
+    def __init__(self, uri_id='PERSONAL_SIGNATURE', container='PersonalSignature', pkey_path=None, cert_path=None,
+                 pkey_password=None, signer=None):
+        """:param uri_id :type str - Id подписываемого элемента
+        :param container :type str - элемент SenderProvidedRequestData, содержащий подпись
+        :param pkey_path, cert_path, pkey_password - ключ и сертификат подписанта
+        :param signer: экземпляр smev3.signer.Signer"""
+        self.uri_id = uri_id
+        self.container = container
+        self.pkey_path = pkey_path
+        self.cert_path = cert_path
+        self.pkey_password = pkey_password
+        self._signer = signer
+
+    def get_signer(self, key_store):
+        """Подписант или None, если ключ не задан"""
+        if self._signer is not None:
+            return self._signer
+        if self.pkey_path:
+            return key_store.signer(self.pkey_path, self.pkey_password)
+        return None
+
+    def __repr__(self):
+        return '<SignatureReference %s #%s>' % (self.container, self.uri_id)
+
+
+class SignatureJob:
+    """Вычисление одной подписи документа в SignPlugin.sign_references"""
+
+    def __init__(self, signature, element, uri_id, signer):
+        self.signature = signature
+        self.element = element
+        self.uri_id = uri_id
+        self.signer = signer
+        self.ancestors = set(signature.iterancestors())
+        # подписи внутри подписываемого элемента, вычисляются раньше этой
+        self.inner = []
+        # метки DigestValue и SignatureValue на время построения форм объемлющих подписей
+        self.marks = ()
+        # каноническая форма, разделенная метками вложенных подписей: [кусок, метка, кусок, ...]
+        self.segments = None
+        self.future = None
+        self.cache_key = None
 
 
 class SignPlugin(BasePlugin):
@@ -82,73 +209,367 @@ class SignPlugin(BasePlugin):
 
     DIGEST_VALUE = '{DIGESTVALUE}'
     SIGNATURE_VALUE = '{SIGNATUREVALUE}'
-
-    def __init__(self, pkey_path, cert_path, pkey_password=None):
+    # число различных SignedInfo, канонические формы которых хранятся в плагине
+    SIGNED_INFO_CACHE_SIZE = 16
+    # число процессов собственного пула плагина для хэшей документа с несколькими подписями,
+    # если executor не задан; 0 - хэши считаются последовательно в вызывающем потоке
+    SIGN_PROCESSES = 0
+    # подписываемый элемент запроса каждой операции
+    SIGNED_ELEMENTS = {'SendRequestRequest': 'SenderProvidedRequestData',
+                       'GetResponseRequest': 'MessageTypeSelector',
+                       'AckRequest': 'AckTargetMessage'}
+
+    def __init__(self, pkey_path, cert_path, pkey_password=None, signer=None, key_store=None, dump_sink=None,
+                 digest_cache=None, uri_id='SIGNED_BY_CONSUMER', signatures=(), executor=None):
         """
         :param pkey_path: путь до файла private key
         :param cert_path: путь до файла сертификата
         :param pkey_password: ключ шифрования файла private key
+        :param signer: экземпляр smev3.signer.Signer, по умолчанию smev3.signer.load_signer по файлу ключа
+        :param key_store: экземпляр smev3.keystore.KeyStore, по умолчанию общий на процесс
+        :param dump_sink: экземпляр smev3.debug.DumpSink, по умолчанию заданный smev3.debug.configure
+        :param digest_cache: экземпляр smev3.cache.DigestCache - хэши повторяющегося содержимого не пересчитываются
+        :param uri_id: Id подписываемого элемента запроса для CallerInformationSystemSignature
+        :param signatures: дополнительные подписи SignatureReference (PersonalSignature)
+        :param executor: concurrent.futures.Executor для хэшей нескольких подписей; ProcessPoolExecutor
+            выполняет хэш python параллельно, пул потоков - хэш openssl. Executor принадлежит
+            вызывающему и плагином не закрывается; без него при SIGN_PROCESSES > 0 плагин создает свой пул,
+            закрываемый close()
         """
         self.pkey_path = pkey_path
         self.cert_path = cert_path
         self.pkey_password = pkey_password
-        self.URI_ID = 'UNIQ_' + str(uuid.uuid4())
-        self.URI_ID = 'SIGNED_BY_CONSUMER'
+        self._signer = signer
+        self.key_store = key_store or default_key_store
+        self.dump_sink = dump_sink
+        self.digest_cache = digest_cache
+        self.signatures = tuple(signatures)
+        self.executor = executor
+        self._own_executor = None
+        self._executor_lock = threading.Lock()
+        self._signed_info_cache = dict()
+        self.URI_ID = uri_id
+
+    @property
+    def signer(self):
+        if self._signer is not None:
+            return self._signer
+        return self.key_store.signer(self.pkey_path, self.pkey_password)
+
+    def certificate(self, cert_path=None):
+        """Текущий сертификат для X509Certificate, по умолчанию сертификат плагина"""
+        return self.key_store.certificate(cert_path or self.cert_path)
+
+    def signer_for(self, uri_id):
+        """Подписант подписи элемента с Id=uri_id"""
+        for reference in self.signatures:
+            if reference.uri_id == uri_id:
+                return reference.get_signer(self.key_store) or self.signer
+        return self.signer
 
     def marshalled(self, context):
-        request_container = context.envelope.childAtPath('Body/SendRequestRequest')
-        provided_data = request_container.childAtPath('SenderProvidedRequestData')
-        provided_data.set('Id', self.URI_ID)
-        request_container.append(self.build_callerinform(request_container.prefix))
+        body = context.envelope.childAtPath('Body')
+        for request_container in body.getChildren():
+            signed_name = self.SIGNED_ELEMENTS.get(request_container.name)
+            if signed_name is not None:
+                signed_element = request_container.childAtPath(signed_name)
+                signed_element.set('Id', self.URI_ID)
+                if self.signatures and request_container.name == 'SendRequestRequest':
+                    self.insert_signatures(signed_element, request_container.prefix)
+                request_container.append(self.build_callerinform(request_container.prefix))
+
+    def insert_signatures(self, provided_data, prefix):
+        """Элементы дополнительных подписей после MessagePrimaryContent"""
+        children = provided_data.getChildren()
+        index = [child.name for child in children].index('MessagePrimaryContent') + 1
+        for offset, reference in enumerate(self.signatures):
+            provided_data.insert(self.build_personal_signature(reference, prefix), index + offset)
 
     def sending(self, context):
-        xml_doc = etree.fromstring(context.envelope)
-        self.set_digest_value(xml_doc)
-        self.set_signature_value(xml_doc)
-        with open('out.xml', 'wb') as o:
-            o.write(etree.tostring(xml_doc))
-        context.envelope = etree.tostring(xml_doc)
-
-    def set_digest_value(self, xml_doc):
-        data = etree.tostring(xml_doc.find('.//ns0:SenderProvidedRequestData', self.NS_MAP))
-        transformed_data = Smev3Transform(data).run().encode()
-        with open('digest_content.xml', 'wb') as o:
-            o.write(transformed_data)
+        started = metrics.start()
+        context.envelope = self.sign_envelope(context.envelope)
+        metrics.finish('sending', started)
+
+    def sign_envelope(self, envelope):
+        """Подсчет DigestValue и SignatureValue конверта
+        :param envelope :type bytes - конверт с заполнителями DIGEST_VALUE и SIGNATURE_VALUE
+        :return bytes"""
+        return self.sign_document(etree.fromstring(envelope))
+
+    def sign_document(self, xml_doc):
+        """Подсчет DigestValue и SignatureValue разобранного конверта
+        :param xml_doc :type lxml.etree._Element
+        :return bytes"""
+        dump = self.get_dump(xml_doc)
+        signatures = xml_doc.findall('.//ds:Signature', self.NS_MAP)
+        if len(signatures) > 1:
+            self.sign_references(xml_doc, signatures, dump)
+        else:
+            self.set_digest_value(xml_doc, dump)
+            self.set_signature_value(xml_doc, dump)
+        signed = etree.tostring(xml_doc)
+        if dump:
+            dump('out', signed)
+        return signed
+
+    def get_dump(self, xml_doc):
+        """Функция сохранения отладочных данных сообщения или None, если сообщение не попало в выборку"""
+        sink = self.dump_sink or debug.get_sink()
+        if sink is None or not sink.sampled():
+            return None
+        call = current_call()
+        message_id = call.message_id if call is not None else None
+        if message_id is None:
+            message_id = xml_doc.findtext('.//ns0:SenderProvidedRequestData/ns0:MessageID', None, self.NS_MAP)
+        return functools.partial(sink.dump, message_id)
+
+    def set_digest_value(self, xml_doc, dump=None):
+        started = metrics.start()
+        signed_element = self.find_signed_element(xml_doc)
         digest_value = xml_doc.find('.//ds:DigestValue', self.NS_MAP)
-        digest_value.text = base64.b64encode(get_gost_r_3410_digest(transformed_data)).decode()
-
-    def set_signature_value(self, xml_doc):
-        signed_info = etree.tostring(xml_doc.find('.//ds:SignedInfo', self.NS_MAP))
-        transformed_data = Smev3Transform(signed_info).run().encode()
-        with open('signed_content.xml', 'wb') as o:
-            o.write(transformed_data)
-        binary_signature = get_gost_r_34102001_signature(base64.b64encode(get_gost_r_3410_digest(transformed_data)),
-                                                         pkey_filename=self.pkey_path,
-                                                         passwd=self.pkey_password)
-        signature_value = xml_doc.find('.//ds:SignatureValue', self.NS_MAP)
+        digest = new_digest()
+        if dump:
+            parts = []
+
+            def consume(chunk):
+                parts.append(chunk)
+                digest.update(chunk)
+        else:
+            consume = digest.update
+        # каноническая форма передается в хэш кусками, целиком не собирается
+        Smev3Transform(signed_element).write_to(consume)
+        if dump:
+            dump('digest_content', b''.join(parts))
+        digest_value.text = base64.b64encode(digest.digest()).decode()
+        metrics.finish('digest', started)
+
+    def find_signed_element(self, xml_doc, reference=None):
+        """Элемент, на который ссылается ds:Reference подписи, по умолчанию первой"""
+        if reference is None:
+            reference = xml_doc.find('.//ds:Reference', self.NS_MAP)
+        uri = reference.get('URI')
+        for element in xml_doc.iterfind('.//*[@Id="%s"]' % uri[1:]):
+            return element
+        raise PluginError('Signed element %s not found' % uri)
+
+    def set_signature_value(self, xml_doc, dump=None, signature=None, signer=None):
+        """:param signature :type lxml.etree._Element - ds:Signature, по умолчанию первая в документе
+        :param signer: подписант, по умолчанию ключ плагина"""
+        started = metrics.start()
+        scope = xml_doc if signature is None else signature
+        transformed_data = self.canonical_signed_info(scope.find('.//ds:SignedInfo', self.NS_MAP))
+        if dump:
+            dump('signed_content', transformed_data)
+        if self.digest_cache is not None:
+            signed_info_digest = self.digest_cache.digest(transformed_data)
+        else:
+            signed_info_digest = get_gost_r_3410_digest(transformed_data)
+        binary_signature = (signer or self.signer).sign(base64.b64encode(signed_info_digest))
+        signature_value = scope.find('.//ds:SignatureValue', self.NS_MAP)
         signature_value.text = base64.b64encode(binary_signature)
+        metrics.finish('signature', started)
+
+    def sign_references(self, xml_doc, signatures, dump=None):
+        """Подсчет нескольких подписей документа.
+
+        Подпись, подписываемый элемент которой содержит другую подпись (CallerInformationSystemSignature
+        над SenderProvidedRequestData с PersonalSignature), завершается после вложенной. Вложенный
+        подписываемый элемент обходится один раз: его форма (CanonicalFragment) вставляется в форму
+        объемлющего. Форма объемлющего строится сразу, с метками на месте DigestValue и SignatureValue
+        вложенных подписей, поэтому хэш ее части до первой метки считается одновременно с хэшем
+        вложенного элемента, а после подписи вложенного дописывается только остаток.
+        :param signatures - элементы ds:Signature документа"""
+        jobs = []
+        for signature in signatures:
+            reference = signature.find('ds:SignedInfo/ds:Reference', self.NS_MAP)
+            uri_id = reference.get('URI', '')[1:]
+            jobs.append(SignatureJob(signature, self.find_signed_element(xml_doc, reference), uri_id,
+                                     self.signer_for(uri_id)))
+        for job in jobs:
+            job.inner = [other for other in jobs if other is not job and job.element in other.ancestors]
+        ordered = []
+        while len(ordered) < len(jobs):
+            ready = [job for job in jobs if job not in ordered and all(inner in ordered for inner in job.inner)]
+            if not ready:
+                raise PluginError('Signed elements contain each other signatures')
+            ordered.extend(ready)
+
+        token = uuid.uuid4().hex
+        for number, job in enumerate(ordered):
+            if any(job in other.inner for other in jobs):
+                job.marks = ('{DIGESTVALUE:%s:%s}' % (token, number), '{SIGNATUREVALUE:%s:%s}' % (token, number))
+                job.signature.find('.//ds:DigestValue', self.NS_MAP).text = job.marks[0]
+                job.signature.find('.//ds:SignatureValue', self.NS_MAP).text = job.marks[1]
+
+        fragments = dict()
+        for job in ordered:
+            started = metrics.start()
+            # форма элемента, вложенного в подписываемый другой подписью, строится для повторного использования;
+            # подпись внутри самого элемента изменит его, такая форма не переиспользуется
+            if job.marks and job.element not in job.ancestors:
+                fragment = CanonicalFragment(job.element)
+                fragments[job.element] = fragment
+                data = fragment.run_bytes()
+            else:
+                data = Smev3Transform(job.element).run_bytes(fragments)
+            if dump:
+                self.job_dump(dump, job)('digest_content', data)
+            if job.inner:
+                marks = [mark.encode() for inner in job.inner for mark in inner.marks]
+                segments = re.split(b'(%s)' % b'|'.join(re.escape(mark) for mark in marks), data)
+                if sorted(segments[1::2]) == sorted(marks):
+                    job.segments = segments
+                    job.future = self.submit(_digest_state, segments[0])
+                # иначе метки неоднозначны: хэш считается заново после вложенных подписей
+            else:
+                job.future = self.digest_future(job, data)
+            metrics.finish('digest', started, reference=job.uri_id)
+
+        values = dict()
+        for job in ordered:
+            started = metrics.start()
+            if job.future is None:
+                digest = _digest(Smev3Transform(job.element).run_bytes())
+            elif job.segments is not None:
+                state = job.future.result()
+                for number in range(1, len(job.segments), 2):
+                    state.update(values[job.segments[number]])
+                    state.update(job.segments[number + 1])
+                digest = state.digest()
+            else:
+                digest = job.future.result()
+                if job.cache_key is not None:
+                    self.digest_cache.put(job.cache_key, digest)
+            digest_value = job.signature.find('.//ds:DigestValue', self.NS_MAP)
+            digest_value.text = base64.b64encode(digest).decode()
+            metrics.finish('digest', started, reference=job.uri_id)
+            self.set_signature_value(xml_doc, self.job_dump(dump, job) if dump else None, job.signature, job.signer)
+            if job.marks:
+                values[job.marks[0].encode()] = digest_value.text.encode()
+                values[job.marks[1].encode()] = job.signature.findtext('.//ds:SignatureValue', '', self.NS_MAP).encode()
+
+    def job_dump(self, dump, job):
+        """Сохранение отладочных данных подписи: для подписи запроса - под обычными именами"""
+        if job.uri_id == self.URI_ID:
+            return dump
+        return lambda name, data: dump('%s.%s' % (name, job.uri_id), data)
+
+    def digest_future(self, job, data):
+        """Хэш канонической формы: из кэша или задачей executor"""
+        if self.digest_cache is not None:
+            job.cache_key = self.digest_cache.key(b'd', data)
+            digest = self.digest_cache.get(job.cache_key)
+            if digest is not None:
+                job.cache_key = None
+                future = Future()
+                future.set_result(digest)
+                return future
+        return self.submit(_digest, data)
+
+    @property
+    def sign_executor(self):
+        """Executor хэшей sign_references: заданный в конструкторе, иначе пул плагина или None.
+        Пул плагина создается при первом использовании, если SIGN_PROCESSES > 0 и CPU больше одного:
+        хэш python - пул процессов (объект хэша передается обратно и продолжается в вызывающем потоке),
+        openssl - пул потоков"""
+        if self.executor is not None:
+            return self.executor
+        workers = min(self.SIGN_PROCESSES, os.cpu_count() or 1)
+        if workers < 2:
+            return None
+        with self._executor_lock:
+            if self._own_executor is None:
+                pool_class = ProcessPoolExecutor if get_backend().resumable else ThreadPoolExecutor
+                self._own_executor = pool_class(workers)
+            return self._own_executor
+
+    def close(self):
+        """Остановка пула, созданного плагином; executor вызывающего не закрывается"""
+        with self._executor_lock:
+            executor, self._own_executor = self._own_executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def submit(self, func, *args):
+        """Выполнение func в sign_executor, без него - сразу
+        :return concurrent.futures.Future"""
+        executor = self.sign_executor
+        if executor is not None:
+            return executor.submit(func, *args)
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    def canonical_signed_info(self, signed_info):
+        """Каноническая форма SignedInfo.
+
+        SignedInfo сообщений одной конфигурации отличается только текстом DigestValue,
+        поэтому преобразование выполняется один раз для SignedInfo с заполнителем,
+        а значение хэша каждого сообщения подставляется в готовые байты.
+        Ключ кэша - имена, атрибуты и непробельный текст элементов: только они определяют
+        каноническую форму, сериализация SignedInfo не требуется.
+        :param signed_info :type lxml.etree._Element
+        :return bytes"""
+        digest_value = signed_info.find('.//ds:DigestValue', self.NS_MAP)
+        digest = digest_value.text
+        digest_value.text = self.DIGEST_VALUE
+        try:
+            key = tuple((element.tag, tuple(element.attrib.items()), self.significant(element.text),
+                         self.significant(element.tail) if element is not signed_info else None)
+                        for element in signed_info.iter())
+            parts = self._signed_info_cache.get(key)
+            if parts is None:
+                parts = Smev3Transform(signed_info).run_bytes().split(self.DIGEST_VALUE.encode())
+                if len(self._signed_info_cache) >= self.SIGNED_INFO_CACHE_SIZE:
+                    self._signed_info_cache.clear()
+                self._signed_info_cache[key] = parts
+        finally:
+            digest_value.text = digest
+        if len(parts) != 2:
+            # заполнитель встречается не только в DigestValue, подстановка неоднозначна
+            return Smev3Transform(signed_info).run_bytes()
+        # base64 не содержит символов, экранируемых при канонизации
+        return parts[0] + (digest or '').encode() + parts[1]
+
+    @staticmethod
+    def significant(text):
+        """Текст, попадающий в каноническую форму: узлы из одних пробельных символов отбрасываются"""
+        return text if text and not text.isspace() else None
 
     def build_callerinform(self, prefix):
         callerinform = self.create_element('CallerInformationSystemSignature', prefix=prefix)
+        callerinform.append(self.build_signature())
+        return callerinform
+
+    def build_personal_signature(self, reference, prefix):
+        """Элемент дополнительной подписи с ds:Signature
+        :param reference :type SignatureReference"""
+        container = self.create_element(reference.container, prefix=prefix)
+        container.append(self.build_signature(reference.uri_id, reference.cert_path))
+        return container
+
+    def build_signature(self, uri_id=None, cert_path=None):
+        """ds:Signature с заполнителями DIGEST_VALUE и SIGNATURE_VALUE
+        :param uri_id - Id подписываемого элемента, по умолчанию URI_ID
+        :param cert_path - сертификат для KeyInfo, по умолчанию сертификат плагина"""
         signature = self.create_element('Signature', ns=('ds', self.NS_MAP['ds']))
-        callerinform.append(signature)
-        sign_info = self.build_sign_info(signature.prefix)
+        sign_info = self.build_sign_info(signature.prefix, uri_id)
         signature.append(sign_info)
         signature.append(self.create_element('SignatureValue', prefix=signature.prefix, text=self.SIGNATURE_VALUE))
-        signature.append(self.build_key_info(signature.prefix))
-        return callerinform
+        signature.append(self.build_key_info(signature.prefix, cert_path))
+        return signature
 
-    def build_sign_info(self, prefix):
+    def build_sign_info(self, prefix, uri_id=None):
         sign_info = self.create_element('SignedInfo', prefix=prefix)
         sign_info.append(self.create_element('CanonicalizationMethod', prefix=prefix,
                                              attrs={'Algorithm': self.C_14}))
         sign_info.append(self.create_element('SignatureMethod', prefix=prefix,
                                              attrs={'Algorithm': self.SIGNATURE_METHOD}))
-        sign_info.append(self.build_reference(prefix))
+        sign_info.append(self.build_reference(prefix, uri_id))
         return sign_info
 
-    def build_reference(self, prefix):
-        reference = self.create_element('Reference', prefix=prefix, attrs={'URI': '#' + self.URI_ID})
+    def build_reference(self, prefix, uri_id=None):
+        reference = self.create_element('Reference', prefix=prefix, attrs={'URI': '#' + (uri_id or self.URI_ID)})
         transforms = self.create_element('Transforms', prefix=prefix)
         transforms.append(self.create_element('Transform', prefix=prefix,
                                               attrs={'Algorithm': self.C_14}))
@@ -161,10 +582,10 @@ class SignPlugin(BasePlugin):
         reference.append(self.create_element('DigestValue', prefix=prefix, text=self.DIGEST_VALUE))
         return reference
 
-    def build_key_info(self, prefix):
+    def build_key_info(self, prefix, cert_path=None):
         key_info = self.create_element('KeyInfo', prefix=prefix)
         x509data = self.create_element('X509Data', prefix=prefix)
-        text = load_certificate(self.cert_path)
+        text = self.certificate(cert_path)
         x509data.append(self.create_element('X509Certificate', prefix=prefix, text=text))
         key_info.append(x509data)
         return key_info
@@ -207,4 +628,107 @@ class SignPlugin(BasePlugin):
     #     binary_signature = get_gost_r_34102001_signature(sign_hash,
     #                                                      pkey_filename=self.pkey_path,
     #                                                      passwd=self.pkey_password)
-    #     return xml.replace(self.SIGNATURE_VALUE.encode(), base64.b64encode(binary_signature))
\ No newline at end of file
+    #     return xml.replace(self.SIGNATURE_VALUE.encode(), base64.b64encode(binary_signature))
+
+
+class AttachmentPlugin(BasePlugin):
+    """Вложения SendRequest из контекста текущего вызова.
+
+    Заголовки вложений (AttachmentHeaderList, RefAttachmentHeaderList) добавляются
+    в SenderProvidedRequestData и попадают под подпись сообщения; хэш файла и
+    открепленная подпись PKCS#7 вычисляются потоково. Содержимое вложений
+    (AttachmentContentList) подписью не покрывается, поэтому при построении в конверт
+    ставятся заполнители, а файлы подставляются кусками уже при отправке (StreamingEnvelope).
+    Плагин подключается после SignPlugin."""
+
+    def __init__(self, sign_plugin, sign_attachments=True):
+        """:param sign_plugin: экземпляр SignPlugin, ключ и сертификат которого подписывают вложения
+        :param sign_attachments :type bool - вычислять SignaturePKCS7 вложений без готовой подписи"""
+        self.sign_plugin = sign_plugin
+        self.sign_attachments = sign_attachments
+
+    def get_attachments(self):
+        call = current_call()
+        return call.extra.get('attachments') if call is not None else None
+
+    def marshalled(self, context):
+        attachments = self.get_attachments()
+        if not attachments:
+            return
+        request_container = context.envelope.childAtPath('Body/SendRequestRequest')
+        if request_container is None:
+            raise PluginError('Attachments are supported only in SendRequest')
+        started = metrics.start()
+        provided_data = request_container.childAtPath('SenderProvidedRequestData')
+        inline = [a for a in attachments if not isinstance(a, RefAttachment)]
+        refs = [a for a in attachments if isinstance(a, RefAttachment)]
+
+        # заголовки следуют за MessagePrimaryContent и PersonalSignature
+        index = max((provided_data.children.index(provided_data.childAtPath(name))
+                     for name in ('MessagePrimaryContent', 'PersonalSignature')
+                     if provided_data.childAtPath(name) is not None), default=None)
+        if index is None:
+            raise PluginError('MessagePrimaryContent not found in SenderProvidedRequestData')
+        index += 1
+        if inline:
+            provided_data.insert(self.build_header_list(inline), index)
+            index += 1
+            request_container.insert(self.build_content_list(inline),
+                                     request_container.children.index(provided_data) + 1)
+        if refs:
+            provided_data.insert(self.build_ref_header_list(refs), index)
+        metrics.finish('attachments', started)
+
+    def sending(self, context):
+        attachments = self.get_attachments()
+        if attachments:
+            inline = [a for a in attachments if not isinstance(a, RefAttachment)]
+            context.envelope = StreamingEnvelope(context.envelope, inline)
+
+    def get_signature(self, attachment):
+        """Открепленная подпись вложения в base64 или None"""
+        signature = attachment.signature
+        if signature is None and self.sign_attachments:
+            sign_plugin = self.sign_plugin
+            certificate = base64.b64decode(sign_plugin.key_store.certificate(sign_plugin.cert_path))
+            signature = attachment.signature = build_pkcs7(sign_plugin.signer.sign_digest(attachment.digest()),
+                                                           certificate)
+        return base64.b64encode(signature).decode() if signature is not None else None
+
+    def build_header_list(self, attachments):
+        header_list = self.create_element('AttachmentHeaderList', ns=('ns1', self.NS_MAP['ns1']))
+        prefix = header_list.prefix
+        for attachment in attachments:
+            header = self.create_element('AttachmentHeader', prefix=prefix)
+            header.append(self.create_element('contentId', prefix=prefix, text=attachment.content_id))
+            header.append(self.create_element('MimeType', prefix=prefix, text=attachment.mime_type))
+            signature = self.get_signature(attachment)
+            if signature is not None:
+                header.append(self.create_element('SignaturePKCS7', prefix=prefix, text=signature))
+            header_list.append(header)
+        return header_list
+
+    def build_ref_header_list(self, attachments):
+        header_list = self.create_element('RefAttachmentHeaderList', ns=('ns1', self.NS_MAP['ns1']))
+        prefix = header_list.prefix
+        for attachment in attachments:
+            header = self.create_element('RefAttachmentHeader', prefix=prefix)
+            header.append(self.create_element('uuid', prefix=prefix, text=attachment.uuid))
+            header.append(self.create_element('Hash', prefix=prefix,
+                                              text=base64.b64encode(attachment.digest()).decode()))
+            header.append(self.create_element('MimeType', prefix=prefix, text=attachment.mime_type))
+            signature = self.get_signature(attachment)
+            if signature is not None:
+                header.append(self.create_element('SignaturePKCS7', prefix=prefix, text=signature))
+            header_list.append(header)
+        return header_list
+
+    def build_content_list(self, attachments):
+        content_list = self.create_element('AttachmentContentList', ns=('ns1', self.NS_MAP['ns1']))
+        prefix = content_list.prefix
+        for number, attachment in enumerate(attachments):
+            content = self.create_element('AttachmentContent', prefix=prefix)
+            content.append(self.create_element('Id', prefix=prefix, text=attachment.content_id))
+            content.append(self.create_element('Content', prefix=prefix, text=PLACEHOLDER % number))
+            content_list.append(content)
+        return content_list
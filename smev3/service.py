@@ -0,0 +1,156 @@
+import glob
+import hashlib
+import os
+import threading
+from urllib.parse import urlparse
+from urllib.request import url2pathname, pathname2url
+
+from suds.cache import NoCache, ObjectCache
+from suds.client import Factory, ServiceSelector
+from suds.options import Options
+from suds.plugin import PluginContainer
+from suds.servicedefinition import ServiceDefinition
+from suds.transport.https import HttpAuthenticated
+from suds.wsdl import Definitions
+
+from smev3.exceptions import SmevClientError
+
+# описание сервиса СМЭВ 3 версии 1.2 (WSDL и схемы), поставляемое с библиотекой
+WSDL_DIR = os.path.join(os.path.dirname(__file__), 'wsdl')
+
+
+def local_path(url):
+    """Путь в файловой системе для file:// URL или пути, иначе None"""
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return url2pathname(parsed.path)
+    if not parsed.scheme or len(parsed.scheme) == 1:
+        # относительный/абсолютный путь (в том числе windows-путь с буквой диска)
+        return url
+    return None
+
+
+def find_wsdl(directory):
+    """Единственный *.wsdl файл в каталоге"""
+    found = sorted(glob.glob(os.path.join(directory, '*.wsdl')))
+    if len(found) != 1:
+        raise SmevClientError('Expected exactly one .wsdl file in %s, found %s' % (directory, len(found)))
+    return found[0]
+
+
+def content_hash(path):
+    """Хэш содержимого локального описания сервиса: wsdl и все wsdl/xsd из его каталога"""
+    directory = os.path.dirname(path)
+    h = hashlib.sha256()
+    for name in sorted(glob.glob(os.path.join(directory, '*.wsdl')) + glob.glob(os.path.join(directory, '*.xsd'))):
+        h.update(os.path.basename(name).encode() + b'\0')
+        with open(name, 'rb') as f:
+            h.update(f.read())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ServiceModel:
+    """Разобранное описание сервиса (WSDL, схемы, фабрика типов), общее для клиентов.
+
+    Модель не изменяется после построения, поэтому ее разделяют все экземпляры
+    клиентов в процессе, а после fork - и рабочие процессы."""
+
+    def __init__(self, url, wsdl):
+        self.url = url
+        self.wsdl = wsdl
+        self.factory = Factory(wsdl)
+        self.sd = [ServiceDefinition(wsdl, s) for s in wsdl.services]
+
+    def bind(self, client, **kwargs):
+        """Инициализация suds клиента поверх модели вместо suds.client.Client.__init__
+        :param client :type suds.client.Client
+        :param kwargs - опции suds (plugins, transport, location...)"""
+        options = Options()
+        options.transport = HttpAuthenticated()
+        options.cache = NoCache()
+        client.options = options
+        client.set_options(**kwargs)
+        client.wsdl = self.wsdl
+        client.factory = self.factory
+        client.service = ServiceSelector(client, self.wsdl.services)
+        client.sd = self.sd
+        client.messages = dict(tx=None, rx=None)
+        PluginContainer(options.plugins).init.initialized(wsdl=self.wsdl)
+        return client
+
+
+class ServiceModelRegistry:
+    """Реестр моделей сервиса в пределах процесса с кэшем разобранных описаний на диске.
+
+    Модель строится один раз на URL. На диске разобранное описание хранится по ключу
+    из URL и хэша содержимого: для локальных описаний хэш считается по файлам каталога,
+    поэтому их изменение сразу дает новый ключ; удаленные описания хранятся days дней.
+    URL можно подменить локальным каталогом (register_local) для работы без сети."""
+
+    def __init__(self, cache_dir=None, days=1, cache=None):
+        """:param cache_dir :type str - каталог дискового кэша, по умолчанию каталог кэша suds
+        :param days :type int - срок хранения удаленных описаний
+        :param cache :type suds.cache.Cache - готовый кэш вместо ObjectCache(cache_dir, days)"""
+        self.cache = cache if cache is not None else ObjectCache(location=cache_dir, days=days)
+        self.local = dict()
+        self.models = dict()
+        self._lock = threading.Lock()
+
+    def register_local(self, url, path):
+        """Загрузка описания сервиса url из локального файла или каталога с wsdl/xsd"""
+        self.local[url] = path
+
+    def resolve(self, url):
+        """URL, по которому фактически загружается описание, и хэш содержимого (для локальных)"""
+        path = local_path(self.local.get(url, url))
+        if path is None:
+            return url, ''
+        if os.path.isdir(path):
+            path = find_wsdl(path)
+        path = os.path.abspath(path)
+        return 'file://' + pathname2url(path), content_hash(path)
+
+    def cache_key(self, url, digest):
+        return 'smev3-wsdl-%s' % hashlib.sha256(('%s\0%s' % (url, digest)).encode()).hexdigest()
+
+    def load(self, url):
+        """Построение модели: из дискового кэша, иначе разбор описания"""
+        source, digest = self.resolve(url)
+        key = self.cache_key(source, digest)
+        options = Options()
+        options.transport = HttpAuthenticated()
+        options.cache = NoCache()
+
+        wsdl = self.cache.get(key)
+        if wsdl is None:
+            wsdl = Definitions(source, options)
+            self.cache.put(key, wsdl)
+        else:
+            wsdl.options = options
+            for imp in wsdl.imports:
+                imp.imported.options = options
+        return ServiceModel(url, wsdl)
+
+    def get(self, url):
+        """Модель сервиса для url
+        :return ServiceModel"""
+        model = self.models.get(url)
+        if model is None:
+            with self._lock:
+                model = self.models.get(url)
+                if model is None:
+                    model = self.models[url] = self.load(url)
+        return model
+
+    def prewarm(self, *urls):
+        """Загрузка моделей заранее, например в родительском процессе до fork рабочих"""
+        for url in urls:
+            self.get(url)
+
+    def clear(self):
+        with self._lock:
+            self.models.clear()
+
+
+service_registry = ServiceModelRegistry()
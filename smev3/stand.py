@@ -0,0 +1,323 @@
+"""Локальная заглушка сервиса СМЭВ 3 для интеграционных и нагрузочных испытаний.
+
+Запуск: python -m smev3.stand [--host 127.0.0.1] [--port 7500] [--wsdl КАТАЛОГ]
+    [--latency 0.05] [--jitter 0.02] [--fault-rate 0.01] [--error-rate 0.01] [--check-digest]
+
+Заглушка отдает описание сервиса (WSDL и схемы из каталога, адрес сервиса подменяется
+своим) и обрабатывает SendRequest, GetResponse и Ack: на каждый принятый запрос в очередь
+ставится ответ, который выдается GetResponse до подтверждения Ack. Задержка ответа
+и доля ошибок (SOAP Fault и HTTP 503) настраиваются, хэши подписанных элементов
+(DigestValue) могут проверяться."""
+import argparse
+import base64
+import collections
+import datetime
+import os
+import random
+import re
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+from smev3.digest import new_digest
+from smev3.service import WSDL_DIR
+from smev3.transform import Smev3Transform
+
+SERVICE_PATH = '/smev/v1.2/ws'
+
+TYPES_NS = 'urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2'
+NS_MAP = {'S': 'http://schemas.xmlsoap.org/soap/envelope/',
+          'ns0': TYPES_NS,
+          'ns1': 'urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.2',
+          'ds': 'http://www.w3.org/2000/09/xmldsig#'}
+
+ENVELOPE = """<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body>{body}</S:Body>
+</S:Envelope>"""
+
+SEND_REQUEST_RESPONSE = """<ns2:SendRequestResponse xmlns:ns2="{ns}">
+<ns2:MessageMetadata>
+<ns2:MessageId>{message_id}</ns2:MessageId>
+<ns2:MessageType>REQUEST</ns2:MessageType>
+<ns2:SendingTimestamp>{timestamp}</ns2:SendingTimestamp>
+<ns2:Status>requestIsQueued</ns2:Status>
+</ns2:MessageMetadata>
+</ns2:SendRequestResponse>"""
+
+RESPONSE_MESSAGE = """<ns2:GetResponseResponse xmlns:ns2="{ns}"
+    xmlns:ns3="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.2">
+<ns2:ResponseMessage>
+<ns2:Response Id="SIGNED_BY_SMEV">
+<ns2:OriginalMessageId>{original_id}</ns2:OriginalMessageId>
+<ns2:SenderProvidedResponseData Id="SIGNED_BY_PROVIDER">
+<ns2:MessageID>{message_id}</ns2:MessageID>
+<ns2:To>stand</ns2:To>
+<ns3:MessagePrimaryContent><Response xmlns="urn://smev3/stand">accepted</Response></ns3:MessagePrimaryContent>
+</ns2:SenderProvidedResponseData>
+<ns2:MessageMetadata>
+<ns2:MessageId>{message_id}</ns2:MessageId>
+<ns2:MessageType>RESPONSE</ns2:MessageType>
+<ns2:SendingTimestamp>{timestamp}</ns2:SendingTimestamp>
+</ns2:MessageMetadata>
+</ns2:Response>
+</ns2:ResponseMessage>
+</ns2:GetResponseResponse>"""
+
+EMPTY_RESPONSE = '<ns2:GetResponseResponse xmlns:ns2="{ns}"/>'
+ACK_RESPONSE = '<ns2:AckResponse xmlns:ns2="{ns}"/>'
+
+FAULT = """<S:Fault>
+<faultcode>S:{code}</faultcode>
+<faultstring>{message}</faultstring>
+</S:Fault>"""
+
+
+def timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+
+def digest_errors(document):
+    """Ссылки подписей, хэш канонической формы элемента которых не совпадает с DigestValue
+    :param document :type lxml.etree._Element
+    :return list str"""
+    errors = []
+    for reference in document.iterfind('.//ds:Reference', NS_MAP):
+        uri = reference.get('URI', '')
+        found = document.xpath('//*[@Id=$id]', id=uri[1:])
+        if len(found) != 1:
+            errors.append(uri)
+            continue
+        digest = new_digest()
+        Smev3Transform(found[0]).write_to(digest.update)
+        if base64.b64encode(digest.digest()).decode() != (reference.findtext('ds:DigestValue', '', NS_MAP)).strip():
+            errors.append(uri)
+    return errors
+
+
+class StandHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        document = self.server.document(self.path)
+        if document is None:
+            self.reply(404, b'', 'text/plain')
+        else:
+            self.reply(200, document, 'text/xml; charset=utf-8')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status, reply = self.server.handle_soap(body)
+        self.reply(status, reply, 'text/xml; charset=utf-8')
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SmevStand(ThreadingHTTPServer):
+    """Заглушка сервиса СМЭВ 3 (HTTP сервер в отдельном потоке).
+
+    Очередь ответов общая для всех клиентов и ограничена queue_size сообщениями,
+    при переполнении старые ответы вытесняются. Ответ выдается GetResponse
+    повторно, пока на него не получен Ack. Счетчики запросов и ошибок - в stats."""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, wsdl_dir=WSDL_DIR, latency=0.0, jitter=0.0, fault_rate=0.0,
+                 error_rate=0.0, check_digest=False, queue_size=10000, seed=None):
+        """:param host, port - адрес сервера, порт 0 - любой свободный
+        :param wsdl_dir :type str - каталог с описанием сервиса (один *.wsdl и схемы)
+        :param latency :type float - задержка каждого ответа на SOAP запрос, секунды
+        :param jitter :type float - случайная добавка к задержке от 0 до jitter, секунды
+        :param fault_rate :type float - доля запросов, на которые возвращается SOAP Fault
+        :param error_rate :type float - доля запросов, на которые возвращается HTTP 503
+        :param check_digest :type bool - проверять DigestValue подписей запросов, при ошибке - SOAP Fault
+        :param queue_size :type int - максимальная длина очереди ответов
+        :param seed - начальное значение генератора случайных ошибок и задержек"""
+        super().__init__((host, port), StandHandler)
+        self.wsdl_dir = wsdl_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.fault_rate = fault_rate
+        self.error_rate = error_rate
+        self.check_digest = check_digest
+        self.stats = dict(send=0, get=0, ack=0, faults=0, errors=0, digest_errors=0)
+        self.responses = collections.OrderedDict()
+        self.queue_size = queue_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._documents = dict()
+        self._thread = None
+
+    @property
+    def url(self):
+        """Адрес сервиса"""
+        host, port = self.server_address[:2]
+        return 'http://%s:%s%s' % (host, port, SERVICE_PATH)
+
+    @property
+    def wsdl_url(self):
+        return self.url + '?wsdl'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='smev3-stand', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def document(self, path):
+        """WSDL (по ?wsdl) или схема из каталога описания сервиса; адрес сервиса в WSDL заменяется своим
+        :return bytes или None"""
+        path, _, query = path.partition('?')
+        if query.lower() == 'wsdl':
+            name = [name for name in os.listdir(self.wsdl_dir) if name.endswith('.wsdl')][0]
+        else:
+            name = os.path.basename(path)
+            if not name.endswith(('.xsd', '.wsdl')):
+                return None
+        document = self._documents.get(name)
+        if document is None:
+            try:
+                with open(os.path.join(self.wsdl_dir, name), 'rb') as f:
+                    document = f.read()
+            except OSError:
+                return None
+            document = re.sub(rb'(<soap:address\s+location=")[^"]*', rb'\g<1>' + self.url.encode(), document)
+            self._documents[name] = document
+        return document
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def delay(self):
+        """Задержка ответа с учетом случайной добавки, секунды"""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def handle_soap(self, body):
+        """Обработка SOAP запроса
+        :param body :type bytes
+        :return tuple (HTTP статус, тело ответа bytes)"""
+        delay = self.delay()
+        if delay:
+            threading.Event().wait(delay)
+        if self.chance(self.error_rate):
+            self.count('errors')
+            return 503, b''
+        if self.chance(self.fault_rate):
+            return self.fault('Server', 'Injected fault')
+
+        try:
+            document = etree.fromstring(body, etree.XMLParser(huge_tree=True))
+        except etree.XMLSyntaxError as e:
+            return self.fault('Client', 'Malformed request: %s' % e)
+        request = document.find('S:Body/*', NS_MAP)
+        if request is None:
+            return self.fault('Client', 'Empty SOAP Body')
+        if self.check_digest:
+            errors = digest_errors(document)
+            if errors:
+                self.count('digest_errors')
+                return self.fault('Client', 'Invalid DigestValue of %s' % ', '.join(errors))
+
+        operation = etree.QName(request).localname
+        if operation == 'SendRequestRequest':
+            reply = self.send_request(request)
+        elif operation == 'GetResponseRequest':
+            reply = self.get_response()
+        elif operation == 'AckRequest':
+            reply = self.ack(request)
+        else:
+            return self.fault('Client', 'Unknown operation %s' % operation)
+        return 200, ENVELOPE.format(body=reply).encode()
+
+    def fault(self, code, message):
+        self.count('faults')
+        return 500, ENVELOPE.format(body=FAULT.format(code=code, message=escape(message))).encode()
+
+    def send_request(self, request):
+        self.count('send')
+        message_id = request.findtext('ns0:SenderProvidedRequestData/ns0:MessageID', '', NS_MAP)
+        with self._lock:
+            self.responses[str(uuid.uuid1())] = message_id
+            while len(self.responses) > self.queue_size:
+                self.responses.popitem(last=False)
+        return SEND_REQUEST_RESPONSE.format(ns=TYPES_NS, message_id=escape(message_id), timestamp=timestamp())
+
+    def get_response(self):
+        self.count('get')
+        with self._lock:
+            if not self.responses:
+                return EMPTY_RESPONSE.format(ns=TYPES_NS)
+            # до Ack ответ остается в очереди и выдается снова после остальных
+            message_id, original_id = self.responses.popitem(last=False)
+            self.responses[message_id] = original_id
+        return RESPONSE_MESSAGE.format(ns=TYPES_NS, message_id=message_id, original_id=escape(original_id),
+                                       timestamp=timestamp())
+
+    def ack(self, request):
+        self.count('ack')
+        with self._lock:
+            self.responses.pop(request.findtext('ns0:AckTargetMessage', '', NS_MAP).strip(), None)
+        return ACK_RESPONSE.format(ns=TYPES_NS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smev3.stand', description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7500)
+    parser.add_argument('--wsdl', default=WSDL_DIR, help='каталог с описанием сервиса')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, секунды')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, секунды')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='доля ответов SOAP Fault')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов HTTP 503')
+    parser.add_argument('--check-digest', action='store_true', help='проверять DigestValue подписей')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    stand = SmevStand(args.host, args.port, args.wsdl, latency=args.latency, jitter=args.jitter,
+                      fault_rate=args.fault_rate, error_rate=args.error_rate, check_digest=args.check_digest,
+                      seed=args.seed)
+    print('SMEV3 stand at %s' % stand.wsdl_url)
+    try:
+        stand.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stand.server_close()
+        print(' '.join('%s=%s' % item for item in stand.stats.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
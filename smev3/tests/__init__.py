@@ -0,0 +1,6 @@
+import os
+
+TESTS_DIR = os.path.dirname(__file__)
+# тестовые ключ и сертификат ГОСТ Р 34.10-2001
+KEY_FILE = os.path.join(TESTS_DIR, 'smev18_test.key')
+CERT_FILE = os.path.join(TESTS_DIR, 'smev18_test.pem')
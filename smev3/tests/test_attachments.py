@@ -0,0 +1,219 @@
+import asyncio
+import base64
+import os
+import re
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import TestCase
+
+from lxml import etree
+from suds.sax.parser import Parser
+
+from smev3 import asn1
+from smev3.attachments import Attachment, RefAttachment, StreamingEnvelope, build_pkcs7, file_digest
+from smev3.client import AsyncSmev3Client, BaseSmev3Client
+from smev3.context import call_scope
+from smev3.digest import new_digest
+from smev3.exceptions import PluginError
+from smev3.plugins import AttachmentPlugin, SignPlugin, UPRIDPlugin
+from smev3.signer import GostR34102001Signer, load_public_key
+from smev3.tests import CERT_FILE, KEY_FILE
+from smev3.tests.test_transport import RESPONSE, LocalSmevTestCase, SmevHandler, person
+from smev3.transport import AsyncHttpTransport, PooledHttpTransport
+
+NS_MAP = {'ns0': 'urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2',
+          'ns1': 'urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.2'}
+
+
+def temp_file(data):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class AttachmentTestCase(TestCase):
+
+    def make_file(self, data):
+        path = temp_file(data)
+        self.addCleanup(os.remove, path)
+        return path
+
+
+class TestAttachment(AttachmentTestCase):
+
+    def test_file_digest(self):
+        data = os.urandom(100003)
+        path = self.make_file(data)
+        expected = new_digest(data).digest()
+        self.assertEqual(expected, file_digest(path, chunk_size=4096))
+        self.assertEqual(expected, file_digest(path, chunk_size=4096, use_mmap=False))
+        self.assertEqual(new_digest(b'').digest(), file_digest(self.make_file(b'')))
+
+    def test_base64_chunks(self):
+        for size in (0, 1, 2, 3, 4, 3 * 1024 + 1):
+            data = os.urandom(size)
+            attachment = Attachment(self.make_file(data))
+            encoded = b''.join(attachment.base64_chunks(chunk_size=3 * 64))
+            self.assertEqual(base64.b64encode(data), encoded)
+            self.assertEqual(len(encoded), attachment.base64_length())
+
+    def test_streaming_envelope(self):
+        first, second = Attachment(self.make_file(b'first')), Attachment(self.make_file(b'second file'))
+        envelope = StreamingEnvelope(b'<a>{ATTACHMENT:0}</a><b>{ATTACHMENT:1}</b>', [first, second])
+        body = b''.join(envelope)
+        self.assertEqual(b'<a>%s</a><b>%s</b>' % (base64.b64encode(b'first'), base64.b64encode(b'second file')), body)
+        self.assertEqual(len(body), len(envelope))
+        # повторная итерация для повтора запроса
+        self.assertEqual(body, b''.join(envelope))
+
+    def test_pkcs7(self):
+        data = os.urandom(5000)
+        attachment = Attachment(self.make_file(data))
+        with open(CERT_FILE, 'rb') as f:
+            certificate = asn1.pem_to_der(f.read(), 'CERTIFICATE')[1]
+        signer = GostR34102001Signer.from_file(KEY_FILE)
+        der = build_pkcs7(signer.sign_digest(attachment.digest()), certificate)
+
+        content_info = asn1.children(asn1.expect(asn1.children(der)[0], asn1.SEQUENCE))
+        self.assertEqual('1.2.840.113549.1.7.2', asn1.decode_oid(content_info[0][1]))
+        signed_data = asn1.children(asn1.expect(asn1.children(content_info[1][1])[0], asn1.SEQUENCE))
+        self.assertEqual(certificate, asn1.children(signed_data[3][1])[0][2])
+        signer_info = asn1.children(asn1.children(signed_data[4][1])[0][1])
+        signature = asn1.expect(signer_info[4], asn1.OCTET_STRING)
+        self.assertTrue(load_public_key(certificate).verify_digest(file_digest(attachment.path), signature))
+
+
+class TestAttachmentEnvelope(LocalSmevTestCase, AttachmentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(10000)
+        self.inline = Attachment(self.make_file(self.data), 'application/pdf')
+        self.ref = RefAttachment(self.make_file(b'large file'), uuid='6f3c2b1e-3c08-11e5-95e2-d4c9eff07b77')
+
+    def prepare(self):
+        return self.client_class(BaseSmev3Client)(UPRIDPlugin(person('Test')), nosend=True, location=self.location)
+
+    def test_envelope(self):
+        client = self.prepare()
+        envelope = client.send_request(attachments=[self.inline, self.ref]).envelope
+        self.assertIsInstance(envelope, StreamingEnvelope)
+        body = b''.join(envelope)
+        self.assertEqual(len(body), len(envelope))
+        # содержимое вложения в подписанный конверт не попадает
+        self.assertNotIn(base64.b64encode(self.data), envelope.envelope)
+
+        doc = etree.fromstring(body)
+        provided = doc.find('.//ns0:SenderProvidedRequestData', NS_MAP)
+        names = [etree.QName(child).localname for child in provided]
+        self.assertEqual(['MessageID', 'MessagePrimaryContent', 'AttachmentHeaderList', 'RefAttachmentHeaderList'],
+                         names)
+        header = provided.find('ns1:AttachmentHeaderList/ns1:AttachmentHeader', NS_MAP)
+        self.assertEqual(self.inline.content_id, header.findtext('ns1:contentId', None, NS_MAP))
+        self.assertEqual('application/pdf', header.findtext('ns1:MimeType', None, NS_MAP))
+        self.assertTrue(header.findtext('ns1:SignaturePKCS7', None, NS_MAP))
+
+        ref_header = provided.find('ns1:RefAttachmentHeaderList/ns1:RefAttachmentHeader', NS_MAP)
+        self.assertEqual(self.ref.uuid, ref_header.findtext('ns1:uuid', None, NS_MAP))
+        self.assertEqual(base64.b64encode(new_digest(b'large file').digest()).decode(),
+                         ref_header.findtext('ns1:Hash', None, NS_MAP))
+
+        request = doc.find('.//ns0:SendRequestRequest', NS_MAP)
+        self.assertEqual(['SenderProvidedRequestData', 'AttachmentContentList', 'CallerInformationSystemSignature'],
+                         [etree.QName(child).localname for child in request])
+        content = request.find('ns1:AttachmentContentList/ns1:AttachmentContent', NS_MAP)
+        self.assertEqual(self.inline.content_id, content.findtext('ns1:Id', None, NS_MAP))
+        self.assertEqual(self.data, base64.b64decode(content.findtext('ns1:Content', None, NS_MAP)))
+
+    def test_missing_primary_content(self):
+        envelope = Parser().parse(string=b'<Envelope><Body><SendRequestRequest><SenderProvidedRequestData>'
+                                         b'<MessageID>1</MessageID></SenderProvidedRequestData>'
+                                         b'</SendRequestRequest></Body></Envelope>').root()
+        plugin = AttachmentPlugin(SignPlugin(KEY_FILE, CERT_FILE))
+        with call_scope(attachments=[self.inline]):
+            with self.assertRaises(PluginError):
+                plugin.marshalled(SimpleNamespace(envelope=envelope))
+
+    def test_without_attachments(self):
+        envelope = self.prepare().send_request().envelope
+        self.assertIsInstance(envelope, bytes)
+        self.assertNotIn(b'Attachment', envelope)
+
+
+class AttachmentHandler(SmevHandler):
+    """Заглушка СМЭВ, сохраняющая содержимое полученных вложений"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.contents.extend(base64.b64decode(content) for content in re.findall(rb'Content>([^<]+)<', body))
+        self.server.connections.add(self.client_address)
+        message_id = re.search(rb'MessageID>([^<]+)<', body).group(1).decode()
+        reply = RESPONSE.format(message_id=message_id, last_name='Test').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+class TestAttachmentTransport(LocalSmevTestCase, AttachmentTestCase):
+    HANDLER = AttachmentHandler
+
+    def test_send(self):
+        self.server.contents = []
+        transport = PooledHttpTransport()
+        self.addCleanup(transport.close)
+        client = self.client_class(BaseSmev3Client)(UPRIDPlugin(person('Test')), transport=transport,
+                                                    location=self.location)
+        data = os.urandom(300000)
+        reply = client.send_request(attachments=[Attachment(self.make_file(data))])
+        self.assertEqual('Test', reply.MessageMetadata.MessageType)
+        self.assertEqual([data], self.server.contents)
+
+    def test_async_send(self):
+        self.server.contents = []
+        data = os.urandom(300000)
+        path = self.make_file(data)
+
+        async def run():
+            client = self.client_class(AsyncSmev3Client)(UPRIDPlugin(person('Test')),
+                                                         http_transport=AsyncHttpTransport(timeout=30),
+                                                         location=self.location)
+            async with client:
+                return await client.send_request(attachments=[Attachment(path)])
+
+        reply = asyncio.run(run())
+        self.assertEqual('Test', reply.MessageMetadata.MessageType)
+        self.assertEqual([data], self.server.contents)
+
+    def test_async_body_read_off_loop(self):
+        """Куски потокового тела читаются не в потоке цикла событий"""
+        self.server.contents = []
+        data = os.urandom(300000)
+        envelope = StreamingEnvelope(b'<a><MessageID>1</MessageID><Content>{ATTACHMENT:0}</Content></a>',
+                                     [Attachment(self.make_file(data))])
+        threads = []
+
+        class Body:
+            def __len__(self):
+                return len(envelope)
+
+            def __iter__(self):
+                for chunk in envelope:
+                    threads.append(threading.get_ident())
+                    yield chunk
+
+        async def run():
+            transport = AsyncHttpTransport(timeout=30)
+            try:
+                return await transport.post(self.location, Body()), threading.get_ident()
+            finally:
+                transport.close()
+
+        (status, _, _, _), loop_thread = asyncio.run(run())
+        self.assertEqual(200, status)
+        self.assertEqual([data], self.server.contents)
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
@@ -0,0 +1,75 @@
+import base64
+from unittest import TestCase
+
+from lxml import etree
+
+from smev3.batch import BatchSigner, sign_batch
+from smev3.envelope import EnvelopeTemplate
+from smev3.exceptions import PluginError
+from smev3.plugins import SignatureReference, SignPlugin
+from smev3.signer import GostR34102001Signer
+from smev3.tests import CERT_FILE, KEY_FILE
+from smev3.tests.test_signer import ENVELOPE
+from smev3.transform import Smev3Transform
+from smev3.utils import get_gost_r_3410_digest
+
+
+def envelope(number):
+    return ENVELOPE.replace(b'db0486d0-3c08-11e5-95e2-d4c9eff07b77', b'db0486d0-3c08-11e5-95e2-%012d' % number)
+
+
+class TestBatchSigner(TestCase):
+
+    def setUp(self):
+        self.public_key = GostR34102001Signer.from_file(KEY_FILE).public_key
+        self.plugin = SignPlugin(pkey_path=KEY_FILE, cert_path=CERT_FILE)
+
+    def assertSigned(self, signed, number):
+        ns = SignPlugin.NS_MAP
+        xml_doc = etree.fromstring(signed)
+        self.assertEqual('db0486d0-3c08-11e5-95e2-%012d' % number, xml_doc.find('.//ns0:MessageID', ns).text)
+        data = etree.tostring(xml_doc.find('.//ns0:SenderProvidedRequestData', ns))
+        digest = base64.b64encode(get_gost_r_3410_digest(Smev3Transform(data).run_bytes())).decode()
+        self.assertEqual(digest, xml_doc.find('.//ds:DigestValue', ns).text)
+
+        signed_info = Smev3Transform(etree.tostring(xml_doc.find('.//ds:SignedInfo', ns))).run_bytes()
+        signature = base64.b64decode(xml_doc.find('.//ds:SignatureValue', ns).text)
+        self.assertTrue(self.public_key.verify(base64.b64encode(get_gost_r_3410_digest(signed_info)), signature))
+
+    def test_order_and_failures(self):
+        envelopes = [envelope(number) for number in range(6)]
+        envelopes[3] = b'<broken'
+        with BatchSigner(self.plugin, processes=2, chunksize=2) as signer:
+            results = signer.sign_batch(envelopes)
+
+        self.assertEqual(6, len(results))
+        self.assertFalse(results[3].ok)
+        self.assertIsInstance(results[3].error, PluginError)
+        for number, result in enumerate(results):
+            if number != 3:
+                self.assertTrue(result.ok, result)
+                self.assertSigned(result.envelope, number)
+
+    def test_explicit_signer(self):
+        plugin = SignPlugin(pkey_path='', cert_path=CERT_FILE, signer=GostR34102001Signer.from_file(KEY_FILE))
+        result, = sign_batch(plugin, [envelope(7)], processes=1)
+        self.assertSigned(result.envelope, 7)
+
+    def test_personal_signature(self):
+        """PersonalSignature в рабочем процессе подписывается ключом SignatureReference, а не ключом запроса"""
+        personal_signer = GostR34102001Signer(self.public_key.curve, 0x1234567890abcdef)
+        plugin = SignPlugin(pkey_path=KEY_FILE, cert_path=CERT_FILE,
+                            signatures=(SignatureReference(signer=personal_signer),))
+        content = etree.Element('{urn://person}Person', Id='PERSONAL_SIGNATURE')
+        unsigned = etree.tostring(EnvelopeTemplate(plugin).render('db0486d0-3c08-11e5-95e2-000000000008', content))
+        result, = sign_batch(plugin, [unsigned], processes=1)
+        self.assertTrue(result.ok, result)
+
+        ns = SignPlugin.NS_MAP
+        xml_doc = etree.fromstring(result.envelope)
+        for path, public_key in (('.//ns0:PersonalSignature/ds:Signature', personal_signer.public_key),
+                                 ('.//ns0:CallerInformationSystemSignature/ds:Signature', self.public_key)):
+            signature = xml_doc.find(path, ns)
+            signed_info = Smev3Transform(etree.tostring(signature.find('ds:SignedInfo', ns))).run_bytes()
+            value = base64.b64decode(signature.findtext('ds:SignatureValue', None, ns))
+            self.assertTrue(public_key.verify(base64.b64encode(get_gost_r_3410_digest(signed_info)), value))
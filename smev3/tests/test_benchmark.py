@@ -0,0 +1,60 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from lxml import etree
+
+from smev3.benchmark import (BASELINE_FILE, DEFAULT_SHAPES, DEFAULT_SIZES, cases, compare, generate_payload, main,
+                             parse_size, run)
+from smev3.tests import CERT_FILE, KEY_FILE
+
+
+class TestBenchmark(TestCase):
+
+    def test_payload(self):
+        self.assertEqual(65536, parse_size('64K'))
+        for shape in ('wide', 'deep'):
+            payload = generate_payload(4096, shape)
+            self.assertGreaterEqual(len(payload), 4096)
+            self.assertEqual('{urn://benchmark/ns/0}payload', etree.fromstring(payload).tag)
+
+    def test_run(self):
+        out = io.StringIO()
+        results = run(['1K'], ['wide'], KEY_FILE, CERT_FILE, repeat=1, only=['transform', 'sending', 'multisign_pool'],
+                      out=out)
+        self.assertEqual({'transform/wide/1K', 'sending/wide/1K', 'multisign_pool/wide/1K'}, set(results))
+        self.assertIn('sending/wide/1K', out.getvalue())
+
+        slower = {key: dict(value, seconds=value['seconds'] * 2) for key, value in results.items()}
+        self.assertEqual([], compare(results, slower))
+        self.assertEqual(3, len(compare(slower, results)))
+
+    def test_baseline(self):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+        names = [name for name, _ in cases(generate_payload(1024), KEY_FILE, CERT_FILE)]
+        expected = {'%s/%s/%s' % (name, shape, size) for name in names for shape in DEFAULT_SHAPES.split(',')
+                    for size in DEFAULT_SIZES.split(',')}
+        self.assertLessEqual(set(baseline), expected)
+        # без openssl с поддержкой ГОСТ эти случаи пропускаются
+        missing = expected - set(baseline)
+        self.assertTrue(all('openssl' in key for key in missing), missing)
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        baseline = os.path.join(directory, 'baseline.json')
+        argv = ['--key', KEY_FILE, '--cert', CERT_FILE, '--sizes', '1K', '--shapes', 'wide', '--only', 'transform',
+                '--repeat', '1']
+        self.assertEqual(0, main(argv + ['--baseline', '', '--save-baseline', baseline]))
+        with open(baseline) as f:
+            saved = json.load(f)
+        self.assertEqual(['transform/wide/1K'], list(saved))
+
+        saved['transform/wide/1K']['seconds'] /= 100
+        with open(baseline, 'w') as f:
+            json.dump(saved, f)
+        self.assertEqual(1, main(argv + ['--baseline', baseline]))
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from lxml import etree
+
+from smev3.cache import ENTRY_OVERHEAD, DigestCache
+from smev3.plugins import SignPlugin
+from smev3.tests import CERT_FILE, KEY_FILE
+from smev3.tests.test_batch import envelope
+from smev3.transform import Smev3Transform
+from smev3.utils import get_gost_r_3410_digest
+
+DOCUMENT = b'<a:root xmlns:a="urn://a"><a:item z="1" a="2">text</a:item></a:root>'
+
+
+class TestDigestCache(TestCase):
+
+    def test_values(self):
+        cache = DigestCache()
+        canonical = Smev3Transform(DOCUMENT).run_bytes()
+        for _ in range(2):
+            self.assertEqual(get_gost_r_3410_digest(canonical), cache.digest(canonical))
+        self.assertEqual(dict(hits=1, misses=1, evictions=0), cache.stats)
+
+    def test_eviction(self):
+        cache = DigestCache(max_entries=2)
+        for key in (b'1', b'2', b'1', b'3'):
+            cache.put(key, b'value')
+            cache.get(key)
+        # вытеснена давно не использованная запись 2
+        self.assertIsNone(cache.get(b'2'))
+        self.assertEqual(b'value', cache.get(b'1'))
+        self.assertEqual(1, cache.stats['evictions'])
+
+        cache = DigestCache(max_bytes=2 * (100 + ENTRY_OVERHEAD))
+        for key in (b'1', b'2', b'3'):
+            cache.put(key, b'x' * 100)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(2 * (100 + ENTRY_OVERHEAD), cache.size)
+        cache.put(b'large', b'x' * cache.max_bytes)
+        self.assertIsNone(cache.get(b'large'))
+        cache.clear()
+        self.assertEqual((0, 0), (len(cache), cache.size))
+
+
+class TestCachedSignPlugin(TestCase):
+
+    def test_sign(self):
+        cache = DigestCache()
+        plugin = SignPlugin(pkey_path=KEY_FILE, cert_path=CERT_FILE, digest_cache=cache)
+        uncached = SignPlugin(pkey_path=KEY_FILE, cert_path=CERT_FILE)
+        ns = SignPlugin.NS_MAP
+
+        expected = etree.fromstring(uncached.sign_envelope(envelope(1))).findtext('.//ds:DigestValue', None, ns)
+        for _ in range(3):
+            signed = etree.fromstring(plugin.sign_envelope(envelope(1)))
+            self.assertEqual(expected, signed.findtext('.//ds:DigestValue', None, ns))
+        # хэш SignedInfo вычислен один раз, SenderProvidedRequestData не кэшируется
+        self.assertEqual(dict(hits=2, misses=1, evictions=0), cache.stats)
+
+        plugin.sign_envelope(envelope(2))
+        self.assertEqual(2, cache.stats['misses'])
@@ -0,0 +1,182 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from lxml import etree
+
+from smev3.cli import PASSWORD_ENV, main, read_password
+from smev3.envelope import EnvelopeTemplate
+from smev3.plugins import SignPlugin
+from smev3.signer import GostR34102001Signer
+from smev3.tests import CERT_FILE, KEY_FILE
+from smev3.tests.test_batch import envelope
+from smev3.tests.test_verify import response
+from smev3.transform import Smev3Transform
+from smev3.utils import get_gost_r_3410_digest
+
+DOCUMENT = b'<a:root xmlns:a="urn://a"><a:item Id="ITEM" z="1" a="2">text</a:item>\n<!-- c --></a:root>'
+
+
+class TestCli(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def run_main(self, *argv, stdin=b''):
+        stdout, stderr = io.BytesIO(), io.StringIO()
+        code = main(list(argv), stdin=io.BytesIO(stdin), stdout=stdout, stderr=stderr)
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def test_transform_stdin(self):
+        code, out, err = self.run_main('transform', '--quiet', stdin=DOCUMENT)
+        self.assertEqual(0, code)
+        self.assertEqual(Smev3Transform(DOCUMENT).run_bytes(), out)
+        self.assertEqual('', err)
+
+        code, out, err = self.run_main('transform', '--id', 'ITEM', stdin=DOCUMENT)
+        self.assertEqual(b'<ns1:item xmlns:ns1="urn://a" Id="ITEM" a="2" z="1">text</ns1:item>', out)
+        self.assertIn('1 files', err)
+
+    def test_digest_directory(self):
+        inputs = os.path.join(self.dir, 'in')
+        for number in range(5):
+            self.write('in/%s/doc%s.xml' % (number % 2, number), DOCUMENT.replace(b'text', b'%d' % number))
+        self.write('in/skipped.txt', b'not xml')
+
+        code, out, err = self.run_main('digest', inputs, '--processes', '2', '--chunksize', '1')
+        self.assertEqual(0, code)
+        lines = out.decode().splitlines()
+        self.assertEqual(5, len(lines))
+        path, digest = lines[0].split('\t')
+        self.assertEqual(os.path.join(inputs, '0', 'doc0.xml'), path)
+        expected = get_gost_r_3410_digest(Smev3Transform(DOCUMENT.replace(b'text', b'0')).run_bytes())
+        self.assertEqual(base64.b64encode(expected).decode(), digest)
+        self.assertIn('5 files', err)
+        self.assertIn('0 errors', err)
+
+        code, out, _ = self.run_main('digest', '--quiet', stdin=DOCUMENT)
+        self.assertEqual(base64.b64encode(get_gost_r_3410_digest(Smev3Transform(DOCUMENT).run_bytes())) + b'\n',
+                         out)
+
+    def test_errors(self):
+        good = self.write('good.xml', DOCUMENT)
+        bad = self.write('bad.xml', b'<unclosed>')
+        code, out, err = self.run_main('digest', good, bad, os.path.join(self.dir, 'missing.xml'),
+                                       '--processes', '1')
+        self.assertEqual(1, code)
+        self.assertEqual(1, len(out.splitlines()))
+        self.assertIn('XMLSyntaxError', err)
+        self.assertIn('2 errors', err)
+
+        with self.assertRaises(SystemExit):
+            self.run_main('transform', good, good)
+
+    def test_unexpected_errors(self):
+        # документ без ds:Signature: ошибка вне перечня ожидаемых исключений отражается в отчете
+        unsigned = self.write('unsigned.xml', DOCUMENT)
+        signed = self.write('signed.xml', envelope(0))
+        code, out, err = self.run_main('sign', unsigned, signed, '--output', os.path.join(self.dir, 'out'),
+                                       '--key', KEY_FILE, '--processes', '1')
+        self.assertEqual(1, code)
+        self.assertIn('%s: AttributeError' % unsigned, err)
+        self.assertIn('2 files', err)
+        self.assertIn('1 errors', err)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'out', 'signed.xml')))
+
+        code, out, err = self.run_main('sign', '--key', KEY_FILE, stdin=DOCUMENT)
+        self.assertEqual(1, code)
+        self.assertEqual(b'', out)
+        self.assertIn('-: AttributeError', err)
+        self.assertIn('1 errors', err)
+
+        code, _, err = self.run_main('transform', '--quiet', stdin=b'<unclosed>')
+        self.assertEqual(1, code)
+        self.assertIn('-: XMLSyntaxError', err)
+
+    def test_sign(self):
+        for number in range(3):
+            self.write('in/%s.xml' % number, envelope(number))
+        output = os.path.join(self.dir, 'out')
+        code, _, err = self.run_main('sign', os.path.join(self.dir, 'in'), '--output', output,
+                                     '--key', KEY_FILE, '--cert', CERT_FILE, '--processes', '2')
+        self.assertEqual(0, code, err)
+
+        public_key = GostR34102001Signer.from_file(KEY_FILE).public_key
+        ns = SignPlugin.NS_MAP
+        for number in range(3):
+            with open(os.path.join(output, '%s.xml' % number), 'rb') as f:
+                xml_doc = etree.fromstring(f.read())
+            self.assertEqual('db0486d0-3c08-11e5-95e2-%012d' % number, xml_doc.findtext('.//ns0:MessageID', None, ns))
+            signed_info = Smev3Transform(xml_doc.find('.//ds:SignedInfo', ns)).run_bytes()
+            signature = base64.b64decode(xml_doc.findtext('.//ds:SignatureValue', None, ns))
+            self.assertTrue(public_key.verify(base64.b64encode(get_gost_r_3410_digest(signed_info)), signature))
+
+    def test_password(self):
+        path = self.write('password', b'secret\nignored\n')
+        self.assertEqual('secret', read_password(path))
+        with patch.dict(os.environ, {PASSWORD_ENV: 'from env'}):
+            self.assertEqual('from env', read_password())
+
+        with patch('smev3.cli.SignPlugin', wraps=SignPlugin) as plugin:
+            code, _, err = self.run_main('sign', '--key', KEY_FILE, '--password-file', path, '--quiet',
+                                         stdin=envelope(1))
+        self.assertEqual(0, code, err)
+        self.assertEqual('secret', plugin.call_args[1]['pkey_password'])
+        with self.assertRaises(SystemExit):
+            self.run_main('sign', '--key', KEY_FILE, '--password', 'secret', stdin=envelope(1))
+
+    def test_output_collisions(self):
+        first = self.write('a/in/0.xml', envelope(0))
+        self.write('b/in/0.xml', envelope(1))
+        output = os.path.join(self.dir, 'out')
+        with patch('sys.stderr', io.StringIO()) as stderr:
+            with self.assertRaises(SystemExit):
+                self.run_main('sign', os.path.join(self.dir, 'a', 'in'), os.path.join(self.dir, 'b', 'in'),
+                              '--output', output, '--key', KEY_FILE)
+            # одноименные файлы из разных каталогов
+            with self.assertRaises(SystemExit):
+                self.run_main('transform', first, os.path.join(self.dir, 'b', 'in', '0.xml'), '--output', output)
+        self.assertIn('same --output files: 0.xml', stderr.getvalue())
+        self.assertFalse(os.path.exists(output))
+
+    def test_verify(self):
+        valid = self.write('valid.xml', response())
+        tampered = self.write('tampered.xml', response().replace(b'done', b'undone'))
+
+        code, out, _ = self.run_main('verify', valid, '--trusted', CERT_FILE, '--quiet')
+        self.assertEqual(0, code)
+        self.assertEqual(valid + '\tPersonalSignature:ok SenderInformationSystemSignature:ok SMEVSignature:ok\n',
+                         out.decode())
+
+        code, out, _ = self.run_main('verify', valid, tampered, '--trusted', CERT_FILE, '--quiet', '--processes', '1')
+        self.assertEqual(1, code)
+        self.assertIn('SenderInformationSystemSignature:invalid', out.decode().splitlines()[1])
+
+        code, _, _ = self.run_main('verify', valid, '--trusted', '00' * 32, '--quiet')
+        self.assertEqual(1, code)
+
+    def test_verify_signed(self):
+        template = EnvelopeTemplate(SignPlugin(pkey_path=KEY_FILE, cert_path=CERT_FILE))
+        path = self.write('in.xml', etree.tostring(template.render('db0486d0-3c08-11e5-95e2-d4c9eff07b77')))
+        output = os.path.join(self.dir, 'out')
+        code, _, err = self.run_main('sign', path, '--output', output, '--key', KEY_FILE, '--quiet')
+        self.assertEqual(0, code, err)
+
+        signed = os.path.join(output, 'in.xml')
+        code, out, _ = self.run_main('verify', signed, '--trusted', CERT_FILE, '--sign-plugin', '--quiet')
+        self.assertEqual(0, code, out)
+        code, out, _ = self.run_main('verify', signed, '--trusted', CERT_FILE, '--quiet')
+        self.assertEqual(1, code)
+        self.assertIn('CallerInformationSystemSignature:invalid', out.decode())
@@ -0,0 +1,146 @@
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from unittest.mock import patch
+
+from smev3.client import BaseSmev3Client
+from smev3.consumer import ResponseConsumer
+from smev3.tests.test_transport import LocalSmevTestCase
+
+ENVELOPE = """<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body>{body}</S:Body>
+</S:Envelope>"""
+
+RESPONSE_MESSAGE = """<ns2:GetResponseResponse xmlns:ns2="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2"
+    xmlns:ns3="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.2">
+<ns2:ResponseMessage>
+<ns2:Response Id="SIGNED_BY_SMEV">
+<ns2:OriginalMessageId>db0486d0-3c08-11e5-95e2-d4c9eff07b77</ns2:OriginalMessageId>
+<ns2:SenderProvidedResponseData Id="SIGNED_BY_PROVIDER">
+<ns2:MessageID>{message_id}</ns2:MessageID>
+<ns2:To>eyJzaWQiOjMyODAxLCJtaWQiOiI</ns2:To>
+<ns3:MessagePrimaryContent><answer xmlns="urn://test">{number}</answer></ns3:MessagePrimaryContent>
+</ns2:SenderProvidedResponseData>
+<ns2:MessageMetadata>
+<ns2:MessageId>{message_id}</ns2:MessageId>
+<ns2:SendingTimestamp>2015-08-04T12:00:00.000+03:00</ns2:SendingTimestamp>
+</ns2:MessageMetadata>
+</ns2:Response>
+</ns2:ResponseMessage>
+</ns2:GetResponseResponse>"""
+
+EMPTY_RESPONSE = '<ns2:GetResponseResponse xmlns:ns2="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2"/>'
+ACK_RESPONSE = '<ns2:AckResponse xmlns:ns2="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2"/>'
+
+
+class QueueHandler(BaseHTTPRequestHandler):
+    """Заглушка очереди СМЭВ: отдает server.messages по GetResponse, записывает Ack"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        # запросы подписаны плагином клиента
+        assert 'CallerInformationSystemSignature' in body and '{DIGESTVALUE}' not in body, body
+        with self.server.lock:
+            if 'GetResponseRequest' in body:
+                self.server.polls += 1
+                if self.server.messages:
+                    number = self.server.messages.pop(0)
+                    reply = RESPONSE_MESSAGE.format(message_id='00000000-0000-0000-0000-%012d' % number,
+                                                    number=number)
+                else:
+                    reply = EMPTY_RESPONSE
+            else:
+                match = re.search(r'AckTargetMessage accepted="(\w+)"[^>]*>([^<]+)<', body)
+                self.server.acks.append((match.group(2), match.group(1)))
+                reply = ACK_RESPONSE
+        reply = ENVELOPE.format(body=reply).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResponseConsumer(LocalSmevTestCase):
+    HANDLER = QueueHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server.lock = threading.Lock()
+        self.server.messages = list(range(20))
+        self.server.acks = []
+        self.server.polls = 0
+        self.client = self.client_class(BaseSmev3Client)(None, location=self.location)
+
+    def wait(self, condition, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_consume(self):
+        handled = []
+
+        def handler(message):
+            number = int(message.Response.SenderProvidedResponseData.MessagePrimaryContent.answer)
+            handled.append(number)
+            # нечетные сообщения отклоняются
+            return number % 2 == 0
+
+        with ResponseConsumer(self.client, handler, workers=4, pollers=2, min_interval=0.01, max_interval=0.05):
+            self.wait(lambda: len(self.server.acks) == 20)
+
+        self.assertEqual(list(range(20)), sorted(handled))
+        expected = sorted(('00000000-0000-0000-0000-%012d' % n, 'true' if n % 2 == 0 else 'false') for n in range(20))
+        self.assertEqual(expected, sorted(self.server.acks))
+
+    def test_backoff(self):
+        self.server.messages = []
+        consumer = ResponseConsumer(self.client, lambda message: True, min_interval=0.01, max_interval=0.2)
+        with consumer:
+            time.sleep(0.5)
+        # при пустой очереди интервал растет: 0.01, 0.02, 0.04... вместо опроса каждые 0.01 с
+        self.assertLess(self.server.polls, 12)
+        self.assertEqual(self.server.polls, consumer.stats['empty'])
+
+    def test_handler_failure(self):
+        self.server.messages = [1]
+
+        def handler(message):
+            raise ValueError()
+
+        consumer = ResponseConsumer(self.client, handler, min_interval=0.01)
+        with consumer:
+            self.wait(lambda: consumer.stats['failed'] == 1)
+        self.assertEqual([], self.server.acks)
+
+    def test_stop_during_receive(self):
+        self.server.messages = [1]
+        receiving, release = threading.Event(), threading.Event()
+        get_response = self.client.get_response
+
+        def blocking_get_response(**kwargs):
+            receiving.set()
+            release.wait(30)
+            return get_response(**kwargs)
+
+        consumer = ResponseConsumer(self.client, lambda message: True, pollers=1, max_pending=1, min_interval=0.01)
+        with patch.object(self.client, 'get_response', blocking_get_response):
+            consumer.start()
+            self.assertTrue(receiving.wait(30))
+            stopping = threading.Thread(target=consumer.stop, args=(0.01,))
+            stopping.start()
+            # ответ приходит позже, чем истекает timeout остановки
+            time.sleep(0.2)
+            release.set()
+            stopping.join(30)
+        self.assertFalse(stopping.is_alive())
+        # сообщение, полученное во время остановки, обработано и подтверждено
+        self.assertEqual(1, consumer.stats['handled'])
+        self.assertEqual([('00000000-0000-0000-0000-000000000001', 'true')], self.server.acks)
+        self.assertTrue(consumer._pending.acquire(blocking=False))
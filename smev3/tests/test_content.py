@@ -0,0 +1,158 @@
+from unittest import TestCase
+
+from lxml import etree
+from suds.sax.element import Element
+from suds.sax.parser import Parser
+
+from smev3 import metrics
+from smev3.client import BaseSmev3Client
+from smev3.content import ContentRegistry, ContentType, Field, to_sax
+from smev3.context import call_scope
+from smev3.exceptions import SmevClientError
+from smev3.plugins import DeclarativeContentPlugin, UPRIDPlugin
+from smev3.tests.test_transport import LocalSmevTestCase, person
+
+XSD = b"""<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:tns="urn://test/person/1.0"
+           targetNamespace="urn://test/person/1.0" elementFormDefault="qualified">
+    <xs:element name="PersonRequest" type="tns:PersonRequestType"/>
+    <xs:complexType name="PersonRequestType">
+        <xs:sequence>
+            <xs:element name="LastName" type="xs:string"/>
+            <xs:element name="FirstName" type="xs:string"/>
+            <xs:element name="Snils" type="xs:string" minOccurs="0"/>
+        </xs:sequence>
+    </xs:complexType>
+</xs:schema>"""
+
+
+class TestContentType(TestCase):
+
+    def setUp(self):
+        self.content_type = ContentType.from_xsd(XSD, 'PersonRequest', prefix='p')
+
+    def test_from_xsd(self):
+        self.assertEqual('{urn://test/person/1.0}PersonRequest', self.content_type.tag)
+        self.assertEqual([('LastName', True), ('FirstName', True), ('Snils', False)],
+                         [(field.name, field.required) for field in self.content_type.fields])
+
+    def test_build(self):
+        content = self.content_type.build(LastName='Ivanov', FirstName='Ivan')
+        self.assertEqual(b'<p:PersonRequest xmlns:p="urn://test/person/1.0"><p:LastName>Ivanov</p:LastName>'
+                         b'<p:FirstName>Ivan</p:FirstName></p:PersonRequest>', etree.tostring(content))
+        content = self.content_type.build(LastName='Petrov', Snils='123')
+        self.assertEqual(['Petrov', None, '123'], [child.text for child in content])
+        # шаблон не изменяется
+        self.assertEqual(3, len(self.content_type.template))
+        self.assertIsNone(self.content_type.template[0].text)
+        with self.assertRaises(SmevClientError):
+            self.content_type.build(Unknown='1')
+
+    def test_build_sax(self):
+        for values in (dict(LastName='Ivanov', FirstName='Ivan'), dict(LastName='Petrov', Snils='123')):
+            self.assertEqual(to_sax(self.content_type.build(**values)).plain(),
+                             self.content_type.build_sax(**values).plain())
+        content_type = ContentType('urn://test', 'Request', ['Code'], qualified=False)
+        self.assertEqual('<ns0:Request xmlns:ns0="urn://test"><Code>1</Code></ns0:Request>',
+                         content_type.build_sax(Code='1').plain())
+        with self.assertRaises(SmevClientError):
+            self.content_type.build_sax(Unknown='1')
+
+    def test_parse(self):
+        content = self.content_type.build(LastName='Ivanov', FirstName='Ivan', Snils='123')
+        parsed = etree.fromstring(etree.tostring(content))
+        self.assertEqual(dict(LastName='Ivanov', FirstName='Ivan', Snils='123'), self.content_type.parse(parsed))
+
+    def test_unqualified(self):
+        content_type = ContentType('urn://test', 'Request', ['Code', Field('Name', key='name')], qualified=False)
+        content = content_type.build(Code='1', name='Test')
+        self.assertEqual(b'<ns0:Request xmlns:ns0="urn://test"><Code>1</Code><Name>Test</Name></ns0:Request>',
+                         etree.tostring(content))
+        self.assertEqual(dict(Code='1', name='Test'), content_type.parse(content))
+
+
+class TestToSax(TestCase):
+
+    def test_parser_equivalent(self):
+        for document in (b'<r xmlns="urn://r" a="1&amp;2"><c>text &lt; <d/>tail</c>'
+                         b'<x:e xmlns:x="urn://x" x:a="2"><x:f/></x:e><!-- comment --></r>',
+                         b'<a:root xmlns:a="urn://a" xmlns:b="urn://b"><b:item b:x="1" Id="ID"> text </b:item></a:root>'):
+            element = etree.fromstring(document)
+            self.assertEqual(Parser().parse(string=document).root().str(), to_sax(element).str())
+
+    def test_attribute_namespaces(self):
+        element = etree.fromstring(b'<r xmlns="urn://r" xmlns:a="urn://r" xml:lang="ru"><c a:x="1"/></r>')
+        self.assertEqual('<r xmlns="urn://r" xmlns:a="urn://r" xml:lang="ru"><c a:x="1"/></r>',
+                         to_sax(element).plain())
+        # атрибут в namespace, не объявленном для элемента: объявляется новый префикс
+        element = etree.Element('r')
+        element.attrib['{urn://a}x'] = '1'
+        node = to_sax(element)
+        self.assertEqual('urn://a', node.resolvePrefix(node.attributes[0].prefix)[1])
+
+
+class TestContentRegistry(TestCase):
+
+    def test_lookup(self):
+        registry = ContentRegistry()
+        content_type = registry.register(ContentType.from_xsd(XSD, 'PersonRequest'))
+        self.assertIs(content_type, registry.get('PersonRequest'))
+        self.assertIs(content_type, registry.get('PersonRequest', 'urn://test/person/1.0'))
+        self.assertIs(content_type, registry.get('{urn://test/person/1.0}PersonRequest'))
+        with self.assertRaises(SmevClientError):
+            registry.get('PersonRequest', 'urn://other')
+
+        element = etree.fromstring(b'<PersonRequest xmlns="urn://test/person/1.0"><LastName>Ivanov</LastName>'
+                                   b'<Unknown/></PersonRequest>')
+        self.assertEqual((content_type, dict(LastName='Ivanov')), registry.parse(element))
+        self.assertIsNone(registry.lookup(etree.Element('{urn://other}PersonRequest')))
+
+
+class TestDeclarativeContentPlugin(LocalSmevTestCase):
+
+    def test_uprid_content(self):
+        values = dict(routing_code='DEV', passport_series='1111', passport_number='111111',
+                      first_name='Test', middle_name='Test2', last_name='Test3')
+        expected = (b'<tns:ESIADataVerifyRequest xmlns:ns2="urn://mincomsvyaz/esia/commons/rg_sevices_types/1.2.0" '
+                    b'xmlns:tns="urn://mincomsvyaz/esia/uprid/1.2.0">'
+                    b'<tns:RoutingCode>DEV</tns:RoutingCode><tns:passportSeries>1111</tns:passportSeries>'
+                    b'<tns:passportNumber>111111</tns:passportNumber><tns:lastName>Test3</tns:lastName>'
+                    b'<tns:firstName>Test</tns:firstName><tns:middleName>Test2</tns:middleName>'
+                    b'</tns:ESIADataVerifyRequest>')
+        self.assertEqual(expected, etree.tostring(UPRIDPlugin().make_element(**values)))
+        # make_content возвращает элемент suds, как до перехода на объявленный тип
+        content = UPRIDPlugin().make_content(**values)
+        self.assertIsInstance(content, Element)
+        self.assertEqual(expected, content.plain().encode())
+
+    def test_envelope(self):
+        content_type = ContentType.from_xsd(XSD, 'PersonRequest')
+        for template in (False, True):
+            class Client(self.client_class(BaseSmev3Client)):
+                ENVELOPE_TEMPLATE = template
+
+            client = Client(DeclarativeContentPlugin(content_type), nosend=True, location=self.location)
+            envelope = client.send_request(content=dict(LastName='Ivanov', FirstName='Ivan')).envelope
+            found = etree.fromstring(envelope).find('.//{urn://test/person/1.0}PersonRequest')
+            self.assertEqual(dict(LastName='Ivanov', FirstName='Ivan'), content_type.parse(found))
+            self.assertEqual('MessagePrimaryContent', etree.QName(found.getparent()).localname)
+
+    def test_marshalled(self):
+        # контент вставляется в конверт suds при построении, в том числе в вызове клиента без SignPlugin
+        plugin = UPRIDPlugin(person('Test'))
+        container = plugin.create_element('MessagePrimaryContent')
+        context = type('Context', (), dict(envelope=None))()
+        plugin.get_content_container = lambda context: container
+        with call_scope():
+            plugin.marshalled(context)
+        self.assertEqual('ESIADataVerifyRequest', container.getChildren()[0].name)
+
+    def test_marshal_metric(self):
+        # этап marshal записывается и для запросов без контента (GetResponse, Ack)
+        observed = []
+        observer = metrics.CallbackObserver(lambda stage, seconds, tags: observed.append(stage))
+        metrics.add_observer(observer)
+        self.addCleanup(metrics.remove_observer, observer)
+        plugin = UPRIDPlugin(person('Test'))
+        plugin.get_content_container = lambda context: None
+        plugin.marshalled(None)
+        self.assertEqual(['marshal'], observed)
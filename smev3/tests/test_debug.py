@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+from smev3 import debug
+from smev3.context import call_scope
+from smev3.debug import DumpSink
+from smev3.plugins import SignPlugin
+from smev3.signer import GostR34102001Signer
+from smev3.tests.test_signer import CERT_FILE, ENVELOPE, KEY_FILE
+
+
+class TestDumpSink(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.signer = GostR34102001Signer.from_file(KEY_FILE)
+
+    def sign(self, sink):
+        plugin = SignPlugin(pkey_path=KEY_FILE, cert_path=CERT_FILE, signer=self.signer, dump_sink=sink)
+        context = SimpleNamespace(envelope=ENVELOPE)
+        plugin.sending(context)
+        return context.envelope
+
+    def test_sampled_message(self):
+        sink = DumpSink(self.directory, sample_rate=1.0)
+        self.addCleanup(sink.close)
+        envelope = self.sign(sink)
+        sink.flush()
+        self.assertEqual(['db0486d0-3c08-11e5-95e2-d4c9eff07b77.digest_content.xml',
+                          'db0486d0-3c08-11e5-95e2-d4c9eff07b77.out.xml',
+                          'db0486d0-3c08-11e5-95e2-d4c9eff07b77.signed_content.xml'],
+                         sorted(os.listdir(self.directory)))
+        with open(os.path.join(self.directory, 'db0486d0-3c08-11e5-95e2-d4c9eff07b77.out.xml'), 'rb') as f:
+            self.assertEqual(envelope, f.read())
+
+    def test_message_id_from_call(self):
+        sink = DumpSink(self.directory)
+        self.addCleanup(sink.close)
+        with call_scope(message_id='call/id'):
+            self.sign(sink)
+        sink.flush()
+        self.assertIn('call_id.out.xml', os.listdir(self.directory))
+
+    def test_disabled(self):
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, cwd)
+
+        self.sign(DumpSink(os.path.join(self.directory, 'dump'), sample_rate=0))
+        self.assertIsNone(debug.get_sink())
+        self.sign(None)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_configure(self):
+        sink = debug.configure(self.directory)
+        self.addCleanup(debug.configure, None)
+        self.assertIs(sink, debug.get_sink())
+        self.sign(None)
+        sink.flush()
+        self.assertEqual(3, len(os.listdir(self.directory)))
@@ -0,0 +1,87 @@
+import subprocess
+from unittest import TestCase, skipUnless
+
+from smev3.digest import AutoDigestBackend, AutoGostR3411Digest, GostR3411_94, TEST_SBOX, get_backend, new_digest
+from smev3.exceptions import SmevClientError
+from smev3.utils import get_gost_r_3410_digest
+
+
+def openssl_has_gost():
+    try:
+        get_backend('openssl').digest(b'')
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+
+# контрольные значения ГОСТ Р 34.11-94 для параметров КриптоПро и тестовых параметров
+CRYPTOPRO_VECTORS = {
+    b'': '981e5f3ca30c841487830f84fb433e13ac1101569b9c13584ac483234cd656c0',
+    b'a': 'e74c52dd282183bf37af0079c9f78055715a103f17e3133ceff1aacf2f403011',
+    b'abc': 'b285056dbf18d7392d7677369524dd14747459ed8143997e163b2986f92fd42c',
+    b'message digest': 'bc6041dd2aa401ebfa6e9886734174febdb4729aa972d60f549ac39b29721ba0',
+    b'The quick brown fox jumps over the lazy dog':
+        '9004294a361a508c586fe53d1f1b02746765e71b765472786e4770d565830a76',
+}
+
+TEST_VECTORS = {
+    b'': 'ce85b99cc46752fffee35cab9a7b0278abb4c2d2055cff685af4912c49490f8d',
+    b'abc': 'f3134348c44fb1b2a277729e2285ebb5cb5e0f29c975bc753b70497c06a4d51d',
+    b'The quick brown fox jumps over the lazy dog':
+        '77b7fa410c9ac58a25f49bca7d0468c9296529315eaca76bd1a10f376d1f4294',
+}
+
+
+class TestGostR3411_94(TestCase):
+
+    def test_vectors(self):
+        for data, expected in CRYPTOPRO_VECTORS.items():
+            self.assertEqual(expected, GostR3411_94(data).hexdigest())
+            self.assertEqual(bytes.fromhex(expected), get_gost_r_3410_digest(data, backend='python'))
+        for data, expected in TEST_VECTORS.items():
+            self.assertEqual(expected, GostR3411_94(data, sbox=TEST_SBOX).hexdigest())
+
+    def test_incremental(self):
+        data = bytes(range(256)) * 3
+        expected = GostR3411_94(data).digest()
+        for step in (1, 7, 31, 32, 33, 100):
+            digest = new_digest(backend='python')
+            for offset in range(0, len(data), step):
+                digest.update(data[offset:offset + step])
+            self.assertEqual(expected, digest.digest())
+            # digest() не меняет состояние
+            self.assertEqual(expected, digest.digest())
+
+    def test_unknown_backend(self):
+        with self.assertRaises(SmevClientError):
+            get_backend('unknown')
+
+    @skipUnless(openssl_has_gost(), 'openssl is built without GOST engine')
+    def test_openssl_backend(self):
+        data = bytes(range(256)) * 5
+        for sample in list(CRYPTOPRO_VECTORS) + [data]:
+            self.assertEqual(get_backend('python').digest(sample), get_backend('openssl').digest(sample))
+
+    def test_auto_backend(self):
+        backend = AutoDigestBackend()
+        self.assertEqual(openssl_has_gost(), backend.openssl)
+        self.assertEqual(not backend.openssl, backend.resumable)
+        data = bytes(range(256)) * 5
+        for sample in list(CRYPTOPRO_VECTORS) + [data]:
+            self.assertEqual(get_backend('python').digest(sample), backend.digest(sample))
+
+        # короткие данные хэшируются в процессе без запуска openssl
+        digest = AutoGostR3411Digest(threshold=len(data))
+        for offset in range(0, len(data), 100):
+            digest.update(data[offset:offset + 100])
+        self.assertIsNone(digest.target)
+        self.assertEqual(get_backend('python').digest(data), digest.digest())
+
+    @skipUnless(openssl_has_gost(), 'openssl is built without GOST engine')
+    def test_auto_backend_openssl(self):
+        data = bytes(range(256)) * 5
+        digest = AutoGostR3411Digest(threshold=1000)
+        for offset in range(0, len(data), 100):
+            digest.update(data[offset:offset + 100])
+        self.assertIsNotNone(digest.target)
+        self.assertEqual(get_backend('python').digest(data), digest.digest())
@@ -0,0 +1,72 @@
+import asyncio
+import base64
+import os
+import shutil
+import tempfile
+
+from lxml import etree
+
+from smev3.client import AsyncSmev3Client, BaseSmev3Client
+from smev3.envelope import EnvelopeTemplate
+from smev3.keystore import KeyStore
+from smev3.plugins import SignPlugin, UPRIDPlugin
+from smev3.signer import GostR34102001Signer
+from smev3.tests.test_signer import CERT_FILE, KEY_FILE
+from smev3.tests.test_transport import LocalSmevTestCase, person
+from smev3.transform import Smev3Transform
+from smev3.utils import get_gost_r_3410_digest
+
+MESSAGE_ID = 'db0486d0-3c08-11e5-95e2-d4c9eff07b77'
+
+
+class TestEnvelopeTemplate(LocalSmevTestCase):
+
+    def client(self, base=BaseSmev3Client, template=True, **options):
+        class Client(self.client_class(base)):
+            ENVELOPE_TEMPLATE = template
+        return Client(UPRIDPlugin(person('Default')), location=self.location, **options)
+
+    def canonical(self, envelope, path):
+        element = etree.fromstring(envelope).find(path, SignPlugin.NS_MAP)
+        return Smev3Transform(etree.tostring(element)).run_bytes()
+
+    def test_matches_suds_envelope(self):
+        template = self.client(nosend=True).send_request(content=person('Test'), message_id=MESSAGE_ID).envelope
+        marshalled = self.client(template=False, nosend=True).send_request(content=person('Test'),
+                                                                           message_id=MESSAGE_ID).envelope
+        for path in ('.//ns0:SenderProvidedRequestData', './/ds:SignedInfo', './/ds:KeyInfo'):
+            self.assertEqual(self.canonical(marshalled, path), self.canonical(template, path))
+
+        signed_info = self.canonical(template, './/ds:SignedInfo')
+        signature = base64.b64decode(etree.fromstring(template).findtext('.//ds:SignatureValue', None,
+                                                                         SignPlugin.NS_MAP))
+        public_key = GostR34102001Signer.from_file(KEY_FILE).public_key
+        self.assertTrue(public_key.verify(base64.b64encode(get_gost_r_3410_digest(signed_info)), signature))
+
+    def test_send_request(self):
+        reply = self.client().send_request(content=person('Person1'), message_id=MESSAGE_ID)
+        self.assertEqual(MESSAGE_ID, reply.MessageMetadata.MessageId)
+        self.assertEqual('Person1', reply.MessageMetadata.MessageType)
+
+    def test_async_send_request(self):
+        async def run():
+            async with self.client(AsyncSmev3Client) as client:
+                return await client.send_request(content=person('Person2'), message_id=MESSAGE_ID)
+
+        reply = asyncio.run(run())
+        self.assertEqual('Person2', reply.MessageMetadata.MessageType)
+
+    def test_certificate_rotation(self):
+        """Сертификат подставляется при каждом построении конверта, а не запоминается в шаблоне"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cert_path = os.path.join(directory, 'cert.pem')
+        shutil.copy(CERT_FILE, cert_path)
+        template = EnvelopeTemplate(SignPlugin(KEY_FILE, cert_path, key_store=KeyStore(check_interval=0)))
+        path = './/ds:X509Certificate'
+        original = template.render(MESSAGE_ID).findtext(path, None, SignPlugin.NS_MAP)
+
+        with open(cert_path, 'w') as f:
+            f.write('-----BEGIN CERTIFICATE-----\nUk9UQVRFRA==\n-----END CERTIFICATE-----\n')
+        self.assertNotEqual('Uk9UQVRFRA==', original)
+        self.assertEqual('Uk9UQVRFRA==', template.render(MESSAGE_ID).findtext(path, None, SignPlugin.NS_MAP))
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from smev3.keystore import KeyStore
+from smev3.signer import GostR34102001Signer
+from smev3.tests import CERT_FILE, KEY_FILE
+from smev3.utils import load_certificate
+
+
+class TestKeyStore(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cert_path = os.path.join(self.tmp, 'cert.pem')
+        self.key_path = os.path.join(self.tmp, 'key.pem')
+        shutil.copy(CERT_FILE, self.cert_path)
+        shutil.copy(KEY_FILE, self.key_path)
+
+    def test_cached(self):
+        store = KeyStore()
+        certificate = store.certificate(self.cert_path)
+        self.assertEqual(load_certificate(self.cert_path), certificate)
+        self.assertIs(certificate, store.certificate(self.cert_path))
+
+        signer = store.signer(self.key_path)
+        self.assertIsInstance(signer, GostR34102001Signer)
+        self.assertIs(signer, store.signer(self.key_path))
+
+    def test_reload_on_change(self):
+        store = KeyStore(check_interval=0)
+        certificate = store.certificate(self.cert_path)
+        signer = store.signer(self.key_path)
+        self.assertIs(signer, store.signer(self.key_path))
+
+        # ротация: новый файл на месте старого
+        with open(self.cert_path, 'rb') as f:
+            data = f.read()
+        os.remove(self.cert_path)
+        with open(self.cert_path, 'wb') as f:
+            f.write(data.replace(b'MIII', b'MIIJ', 1))
+        os.utime(self.key_path, ns=(0, 0))
+
+        self.assertNotEqual(certificate, store.certificate(self.cert_path))
+        self.assertTrue(store.certificate(self.cert_path).startswith('MIIJ'))
+        self.assertIsNot(signer, store.signer(self.key_path))
+
+    def test_password_not_stored(self):
+        store = KeyStore()
+        signer = store.signer(self.key_path, 'secret')
+        self.assertIs(signer, store.signer(self.key_path, 'secret'))
+        self.assertIsNot(signer, store.signer(self.key_path))
+        self.assertNotIn('secret', repr(list(store._entries)))
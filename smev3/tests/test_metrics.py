@@ -0,0 +1,71 @@
+import asyncio
+
+from smev3 import metrics
+from smev3.client import AsyncSmev3Client, BaseSmev3Client
+from smev3.plugins import UPRIDPlugin
+from smev3.tests.test_transport import LocalSmevTestCase, person
+
+MESSAGE_ID = 'db0486d0-3c08-11e5-95e2-d4c9eff07b77'
+
+
+class TestMetrics(LocalSmevTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.client_class(BaseSmev3Client)(UPRIDPlugin(person('Default')), location=self.location)
+
+    def observe(self, observer):
+        metrics.add_observer(observer)
+        self.addCleanup(metrics.remove_observer, observer)
+        return observer
+
+    def test_stages(self):
+        observed = []
+        self.observe(metrics.CallbackObserver(lambda stage, seconds, tags: observed.append((stage, tags))))
+        self.client.send_request(message_id=MESSAGE_ID)
+
+        stages = [stage for stage, tags in observed]
+        self.assertEqual(['marshal', 'digest', 'signature', 'sending', 'http', 'send_request'], stages)
+        for stage, tags in observed:
+            self.assertEqual(MESSAGE_ID, tags['message_id'])
+            self.assertEqual('UPRIDPlugin', tags['plugin'])
+        self.assertEqual(200, dict(observed)['http']['status'])
+
+    def test_stats(self):
+        stats = self.observe(metrics.StatsObserver())
+        self.client.send_request()
+        self.client.send_request()
+        text = stats.render()
+        self.assertIn('smev3_stage_seconds_count{stage="send_request",plugin="UPRIDPlugin"} 2\n', text)
+        self.assertIn('smev3_stage_seconds_bucket{stage="http",plugin="UPRIDPlugin",le="+Inf"} 2\n', text)
+
+    def test_error(self):
+        observed = []
+        self.observe(metrics.CallbackObserver(lambda stage, seconds, tags: observed.append((stage, tags))))
+        self.client.set_options(location='http://127.0.0.1:1/smev/v1.2/ws')
+        with self.assertRaises(OSError):
+            self.client.send_request()
+        self.assertEqual('ConnectionRefusedError', dict(observed)['send_request']['error'])
+
+    def test_async_error(self):
+        observed = []
+        self.observe(metrics.CallbackObserver(lambda stage, seconds, tags: observed.append((stage, tags))))
+
+        async def run():
+            async with self.client_class(AsyncSmev3Client)(UPRIDPlugin(person('Default')),
+                                                            location='http://127.0.0.1:1/smev/v1.2/ws') as client:
+                await client.send_request(message_id=MESSAGE_ID)
+
+        with self.assertRaises(OSError):
+            asyncio.run(run())
+        self.assertEqual('ConnectionRefusedError', dict(observed)['send_request']['error'])
+
+    def test_without_content_plugin(self):
+        observed = []
+        self.observe(metrics.CallbackObserver(lambda stage, seconds, tags: observed.append((stage, tags))))
+        client = self.client_class(BaseSmev3Client)(None, location=self.location)
+        client.prepare_envelope(message_id=MESSAGE_ID)
+        self.assertIsNone(dict(observed)['prepare']['plugin'])
+
+    def test_disabled(self):
+        self.assertIsNone(metrics.start())
@@ -0,0 +1,129 @@
+import base64
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+
+from lxml import etree
+
+from smev3.cache import DigestCache
+from smev3.client import BaseSmev3Client
+from smev3.digest import get_backend
+from smev3.plugins import ContentPlugin, SignatureReference, SignPlugin
+from smev3.signer import GostR34102001Signer
+from smev3.tests.test_signer import KEY_FILE
+from smev3.tests.test_transport import LocalSmevTestCase
+from smev3.transform import CanonicalFragment, Smev3Transform
+from smev3.utils import get_gost_r_3410_digest
+
+MESSAGE_ID = 'db0486d0-3c08-11e5-95e2-d4c9eff07b77'
+NS = dict(SignPlugin.NS_MAP, p='urn://person')
+
+DOCUMENT = b'''<a:root xmlns:a="urn://a" xmlns:b="urn://b">
+<a:head b:x="1">head</a:head>
+<b:item xmlns:c="urn://c" Id="ITEM" z="1" a="2"><c:value>text</c:value><a:ref/><d:other xmlns:d="urn://d"/></b:item>
+<a:tail/>
+</a:root>'''
+
+
+class PersonContentPlugin(ContentPlugin):
+    """lxml контент с атрибутом Id для PersonalSignature"""
+
+    def make_content(self, name):
+        element = etree.Element('{urn://person}Person', Id='PERSONAL_SIGNATURE')
+        etree.SubElement(element, '{urn://person}Name').text = name
+        return element
+
+
+class TestCanonicalFragment(TestCase):
+
+    def test_splice(self):
+        root = etree.fromstring(DOCUMENT)
+        item = root.find('{urn://b}item')
+        fragment = CanonicalFragment(item)
+        self.assertEqual(Smev3Transform(item).run_bytes(), fragment.run_bytes())
+        self.assertEqual(Smev3Transform(root).run_bytes(), Smev3Transform(root).run_bytes({item: fragment}))
+
+    def test_overlap(self):
+        # пространство имен фрагмента уже объявлено снаружи: фрагмент не вставляется, элемент обходится заново
+        root = etree.fromstring(DOCUMENT.replace(b'<a:head b:x="1">head</a:head>',
+                                                 b'<c:head xmlns:c="urn://c">head</c:head>'))
+        item = root.find('{urn://b}item')
+        fragment = CanonicalFragment(etree.fromstring(etree.tostring(item)))
+        self.assertEqual(Smev3Transform(root).run_bytes(), Smev3Transform(root).run_bytes({item: fragment}))
+
+
+class TestMultipleSignatures(LocalSmevTestCase):
+
+    def client(self, template=False, **attrs):
+        class Client(self.client_class(BaseSmev3Client)):
+            ENVELOPE_TEMPLATE = template
+            SIGNATURES = (SignatureReference(),)
+        for name, value in attrs.items():
+            setattr(Client, name, value)
+        return Client(PersonContentPlugin(), location=self.location)
+
+    def prepare(self, client, name='Test'):
+        return etree.fromstring(client.prepare_envelope(content=dict(name=name), message_id=MESSAGE_ID))
+
+    def assertSignature(self, signature, element):
+        public_key = GostR34102001Signer.from_file(KEY_FILE).public_key
+        digest = get_gost_r_3410_digest(Smev3Transform(etree.tostring(element)).run_bytes())
+        self.assertEqual(base64.b64encode(digest).decode(), signature.findtext('.//ds:DigestValue', None, NS))
+        signed_info = Smev3Transform(etree.tostring(signature.find('ds:SignedInfo', NS))).run_bytes()
+        value = base64.b64decode(signature.findtext('ds:SignatureValue', None, NS))
+        self.assertTrue(public_key.verify(base64.b64encode(get_gost_r_3410_digest(signed_info)), value))
+
+    def assertSigned(self, xml_doc):
+        provided_data = xml_doc.find('.//ns0:SenderProvidedRequestData', NS)
+        self.assertEqual(['MessageID', 'MessagePrimaryContent', 'PersonalSignature'],
+                         [etree.QName(child).localname for child in provided_data])
+        personal = provided_data.find('ns0:PersonalSignature/ds:Signature', NS)
+        self.assertEqual('#PERSONAL_SIGNATURE', personal.find('.//ds:Reference', NS).get('URI'))
+        self.assertSignature(personal, provided_data.find('.//p:Person', NS))
+        # подпись запроса покрывает итоговую PersonalSignature
+        self.assertSignature(xml_doc.find('.//ns0:CallerInformationSystemSignature/ds:Signature', NS), provided_data)
+
+    def test_sign(self):
+        xml_doc = self.prepare(self.client())
+        self.assertSigned(xml_doc)
+        self.assertSigned(self.prepare(self.client(template=True)))
+
+        with ProcessPoolExecutor(2) as executor:
+            parallel = self.prepare(self.client(SIGN_EXECUTOR=executor))
+        self.assertSigned(parallel)
+        # хэш подписи запроса зависит от случайного значения PersonalSignature
+        path = './/ns0:PersonalSignature//ds:DigestValue'
+        self.assertEqual(xml_doc.findtext(path, None, NS), parallel.findtext(path, None, NS))
+
+    def test_digest_cache(self):
+        cache = DigestCache()
+        client = self.client(DIGEST_CACHE=cache)
+        for _ in range(2):
+            self.assertSigned(self.prepare(client))
+        self.assertSigned(self.prepare(client, 'Other'))
+        # повторный контент: хэши Person и SignedInfo PersonalSignature из кэша,
+        # SignedInfo запроса меняется вместе со случайным значением PersonalSignature
+        self.assertEqual(dict(hits=2, misses=7, evictions=0), cache.stats)
+
+    def test_executor(self):
+        # по умолчанию пул не создается
+        self.assertIsNone(self.client().sign_plugin.sign_executor)
+        plugin = SignPlugin(KEY_FILE, None, signatures=(SignatureReference(),))
+        plugin.SIGN_PROCESSES = 2
+        with patch('smev3.plugins.os.cpu_count', return_value=1):
+            # на одном CPU пул не дает выигрыша
+            self.assertIsNone(plugin.sign_executor)
+        with patch('smev3.plugins.os.cpu_count', return_value=8):
+            executor = plugin.sign_executor
+            # хэш python - в пуле процессов, openssl - в пуле потоков
+            self.assertIsInstance(executor, ProcessPoolExecutor if get_backend().resumable else ThreadPoolExecutor)
+            self.assertIs(executor, plugin.sign_executor)
+            plugin.close()
+            self.assertIsNone(plugin._own_executor)
+
+        # executor вызывающего плагином не закрывается
+        with ThreadPoolExecutor(2) as executor:
+            plugin = SignPlugin(KEY_FILE, None, executor=executor)
+            self.assertIs(executor, plugin.sign_executor)
+            plugin.close()
+            self.assertEqual(1, executor.submit(int, '1').result())
@@ -0,0 +1,166 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from smev3.client import BaseSmev3Client
+from smev3.outbox import FAILED, PENDING, SENT, Outbox
+from smev3.plugins import UPRIDPlugin
+from smev3.tests.test_transport import RESPONSE, LocalSmevTestCase, SmevHandler, person
+
+FAULT = """<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body><S:Fault><faultcode>S:Client</faultcode><faultstring>Invalid message</faultstring></S:Fault></S:Body>
+</S:Envelope>"""
+
+
+class FlakyHandler(SmevHandler):
+    """Заглушка СМЭВ, отвечающая 503 на первые server.failures запросов"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.bodies.append(body)
+        if len(self.server.bodies) <= self.server.failures:
+            status, reply = 503, b'Service Unavailable'
+        elif self.server.fault:
+            status, reply = 500, FAULT.encode()
+        else:
+            message_id = re.search(rb'MessageID>([^<]+)<', body).group(1).decode()
+            status, reply = 200, RESPONSE.format(message_id=message_id, last_name='Test').encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+class TestOutbox(LocalSmevTestCase):
+    HANDLER = FlakyHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server.bodies = []
+        self.server.failures = 0
+        self.server.fault = False
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'outbox.db')
+        self.prepared = []
+
+        prepared = self.prepared
+
+        class Client(self.client_class(BaseSmev3Client)):
+            def prepare_envelope(self, content=None, message_id=None):
+                prepared.append(message_id)
+                return super().prepare_envelope(content, message_id)
+
+        self.client = Client(UPRIDPlugin(person('Test')), location=self.location)
+
+    def outbox(self, **kwargs):
+        kwargs.setdefault('min_delay', 0.01)
+        kwargs.setdefault('poll_interval', 0.01)
+        outbox = Outbox(self.client, self.path, **kwargs)
+        self.addCleanup(outbox.close)
+        return outbox
+
+    def wait(self, outbox, message_id, status, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            entry = outbox.get(message_id)
+            if entry.status == status:
+                return entry
+            time.sleep(0.01)
+        self.fail('%s is %s, expected %s' % (message_id, outbox.get(message_id).status, status))
+
+    def test_retry_with_signed_envelope(self):
+        self.server.failures = 2
+        sent = []
+        done = threading.Event()
+
+        def on_sent(message_id, reply):
+            sent.append(reply.MessageMetadata.MessageId)
+            done.set()
+
+        outbox = self.outbox(on_sent=on_sent).start()
+        message_id = 'db0486d0-3c08-11e5-95e2-d4c9eff07b77'
+        outbox.submit(person('Test'), message_id)
+
+        entry = self.wait(outbox, message_id, SENT)
+        self.assertEqual(3, entry.attempts)
+        self.assertTrue(done.wait(10))
+        self.assertEqual([message_id], sent)
+        # повторы отправляют тот же подписанный конверт без повторной подписи
+        self.assertEqual(1, len(set(self.server.bodies)))
+        self.assertEqual([message_id], self.prepared)
+
+    def test_deduplication(self):
+        outbox = self.outbox()
+        message_id = 'db0486d0-3c08-11e5-95e2-d4c9eff07b77'
+        with ThreadPoolExecutor(8) as executor:
+            entries = list(executor.map(lambda _: outbox.submit(person('Test'), message_id), range(16)))
+        self.assertEqual([message_id], self.prepared)
+        self.assertEqual({message_id}, {entry.message_id for entry in entries})
+        self.assertEqual(15, outbox.stats['duplicates'])
+
+        outbox.start()
+        self.wait(outbox, message_id, SENT)
+        outbox.submit(person('Test'), message_id)
+        outbox.stop()
+        self.assertEqual(1, len(self.server.bodies))
+
+    def test_persistence(self):
+        outbox = self.outbox()
+        message_ids = [outbox.submit(person('Test')).message_id for _ in range(3)]
+        outbox.close()
+
+        outbox = self.outbox().start()
+        for message_id in message_ids:
+            self.wait(outbox, message_id, SENT)
+        self.assertEqual({SENT: 3}, outbox.counts())
+        self.assertEqual(3, len(self.prepared))
+
+    def test_fault_is_final(self):
+        self.server.fault = True
+        failed = threading.Event()
+        outbox = self.outbox(on_failed=lambda message_id, error: failed.set()).start()
+        entry = outbox.submit(person('Test'))
+        self.assertTrue(failed.wait(10))
+        entry = self.wait(outbox, entry.message_id, FAILED)
+        self.assertEqual(1, entry.attempts)
+        self.assertIn('Invalid message', entry.error)
+
+    def test_failing_callback(self):
+        self.server.fault = True
+        called = threading.Event()
+
+        def on_failed(message_id, error):
+            called.set()
+            raise RuntimeError('callback')
+
+        outbox = self.outbox(on_failed=on_failed)
+        with self.assertLogs('smev3.outbox', 'ERROR') as logs:
+            outbox.start()
+            entry = outbox.submit(person('Test'))
+            self.assertTrue(called.wait(10))
+            self.wait(outbox, entry.message_id, FAILED)
+            outbox.stop()
+        self.assertTrue(any('on_failed callback failed' in line for line in logs.output))
+
+    def test_max_attempts(self):
+        self.server.failures = 100
+        outbox = self.outbox(max_attempts=3).start()
+        entry = outbox.submit(person('Test'))
+        entry = self.wait(outbox, entry.message_id, FAILED)
+        self.assertEqual(3, entry.attempts)
+
+        self.server.failures = 0
+        self.server.bodies.clear()
+        self.assertTrue(outbox.retry(entry.message_id))
+        self.wait(outbox, entry.message_id, SENT)
+
+    def test_delay(self):
+        outbox = self.outbox(min_delay=1.0, max_delay=10.0, backoff=2.0)
+        self.assertEqual([1.0, 2.0, 4.0, 8.0, 10.0], [outbox.delay(attempts) for attempts in range(1, 6)])
+        self.assertEqual(PENDING, outbox.submit(person('Test')).status)
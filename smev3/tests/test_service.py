@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from smev3.client import BaseSmev3Client
+from smev3.plugins import UPRIDPlugin
+from smev3.service import WSDL_DIR, ServiceModelRegistry
+from smev3.tests import CERT_FILE, KEY_FILE
+
+SMEV_URL = 'http://smev3.example/smev/v1.2/ws?wsdl'
+
+
+class TestServiceModelRegistry(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.registry = ServiceModelRegistry(cache_dir=self.cache_dir)
+        self.registry.register_local(SMEV_URL, WSDL_DIR)
+
+    def test_shared_model(self):
+        registry = self.registry
+
+        class Client(BaseSmev3Client):
+            SMEV_EXEC_URL = SMEV_URL
+            SERVICE_REGISTRY = registry
+            PRIVATE_KEY_FILE = KEY_FILE
+            CERTIFICATE_FILE = CERT_FILE
+
+        plugin = UPRIDPlugin(dict(routing_code='DEV', passport_series='1111', passport_number='111111',
+                                  first_name='Test', middle_name='Test2', last_name='Test3'))
+        first = Client(plugin, nosend=True)
+        second = Client(plugin, nosend=True)
+        self.assertIs(first.wsdl, second.wsdl)
+        self.assertIs(first.factory, second.factory)
+        self.assertIsNot(first.options, second.options)
+
+        envelope = first.send_request().envelope
+        self.assertIn(b'ESIADataVerifyRequest', envelope)
+        self.assertIn(b'<ds:DigestValue>', envelope)
+
+    def test_disk_cache(self):
+        self.registry.prewarm(SMEV_URL)
+
+        # новый процесс: модель поднимается из дискового кэша без разбора wsdl
+        registry = ServiceModelRegistry(cache_dir=self.cache_dir)
+        registry.register_local(SMEV_URL, WSDL_DIR)
+        with patch('smev3.service.Definitions', side_effect=AssertionError('WSDL parsed again')):
+            model = registry.get(SMEV_URL)
+        self.assertIsNotNone(model.factory.create('ns0:SenderProvidedRequestData'))
+        self.assertIs(model, registry.get(SMEV_URL))
+
+    def test_content_hash(self):
+        wsdl_dir = os.path.join(self.cache_dir, 'wsdl')
+        shutil.copytree(WSDL_DIR, wsdl_dir)
+        self.registry.register_local(SMEV_URL, wsdl_dir)
+        source, digest = self.registry.resolve(SMEV_URL)
+        self.assertTrue(source.startswith('file://'))
+
+        with open(os.path.join(wsdl_dir, 'smev-message-exchange-basic-1.2.xsd'), 'a') as f:
+            f.write('\n')
+        self.assertNotEqual(digest, self.registry.resolve(SMEV_URL)[1])
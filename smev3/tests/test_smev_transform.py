@@ -1,7 +1,12 @@
+import functools
+import io
+import tracemalloc
+from unittest.mock import patch
+
 from lxml import etree
 from unittest.case import TestCase
 
-from smev3.transform import Smev3Transform
+from smev3.transform import Smev3Transform, Smev3StreamTransform
 
 
 class TestTransform(TestCase):
@@ -84,4 +89,132 @@ class TestTransform(TestCase):
 </ns2:SenderProvidedRequestData>"""
         expected = """<ns1:SenderProvidedRequestData xmlns:ns1="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.0" Id="SIGNED_BY_CONSUMER"><ns2:MessagePrimaryContent xmlns:ns2="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.0"><ns3:SomeRequest xmlns:ns3="urn://x-artifacts-it-ru/vs/smev/test/test-business-data/1.0"><ns3:x>qweqwe</ns3:x></ns3:SomeRequest></ns2:MessagePrimaryContent></ns1:SenderProvidedRequestData>"""
         result = Smev3Transform(in_data).run()
-        self.assertEqual(expected, result)
\ No newline at end of file
+        self.assertEqual(expected, result)
+
+    def test_escaping(self):
+        """Экранирование текста и значений атрибутов, комментарии внутри смешанного содержимого"""
+        in_data = """<a:root xmlns:a="http://test/1" b="x&amp;&quot;&lt;y">1 &lt; 2 &amp; 3 &gt; 2<!-- comment --><a:e/>
+   tail </a:root>"""
+        expected = """<ns1:root xmlns:ns1="http://test/1" b="x&amp;&quot;&lt;y">1 &lt; 2 &amp; 3 &gt; 2<ns1:e></ns1:e>
+   tail </ns1:root>"""
+        result = Smev3Transform(in_data).run()
+        self.assertEqual(expected, result)
+        self.assertEqual(expected.encode(), Smev3Transform(in_data).run_bytes())
+
+
+class StreamCheckedTransform(Smev3Transform):
+    """Smev3Transform, результат run() которого сверяется с потоковой трансформацией и записью кусками"""
+
+    def __init__(self, xml, test):
+        super().__init__(xml)
+        self.source = xml.encode() if isinstance(xml, str) else xml
+        self.test = test
+
+    def run(self, fragments=None):
+        result = super().run(fragments)
+        expected = result.encode()
+        self.test.assertEqual(expected, b''.join(Smev3StreamTransform(io.BytesIO(self.source), chunk_size=16)))
+
+        chunks = []
+        self.write_to(chunks.append, chunk_size=16)
+        self.test.assertEqual(expected, b''.join(chunks))
+        self.test.assertTrue(all(len(chunk) >= 16 for chunk in chunks[:-1]))
+        return result
+
+
+class GeneratedDocument:
+    """Документ из count одинаковых элементов, генерируемый при чтении, без хранения целиком"""
+
+    def __init__(self, count):
+        self.parts = iter([b'<a:list xmlns:a="urn://a" xmlns:b="urn://b">'] +
+                          [b'<b:item n="%d">value &amp; text</b:item>\n' % i for i in range(count)] + [b'</a:list>'])
+        self.size = 0
+
+    def read(self, size):
+        data = b''.join(part for _, part in zip(range(max(size // 40, 1)), self.parts))
+        self.size += len(data)
+        return data
+
+
+class TestStreamTransform(TestTransform):
+    """Сценарии TestTransform: потоковая трансформация и запись кусками дают тот же результат, что и run()"""
+
+    def setUp(self):
+        patcher = patch(__name__ + '.Smev3Transform', functools.partial(StreamCheckedTransform, test=self))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_flat_memory(self):
+        """Пиковая память потоковой трансформации не зависит от размера документа"""
+        source = GeneratedDocument(100000)
+        size = 0
+        tracemalloc.start()
+        try:
+            for chunk in Smev3StreamTransform(source):
+                size += len(chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(source.size, 4 << 20)
+        self.assertGreater(size, 4 << 20)
+        self.assertLess(peak, 1 << 20)
+
+
+class TestElementTransform(TestCase):
+
+    def test_subtree_with_inherited_namespaces(self):
+        """Элемент дерева преобразуется без сериализации так же, как его сериализованная копия"""
+        document = etree.fromstring(
+            '<root xmlns="urn://default" xmlns:a="urn://a" xmlns:b="urn://b">'
+            '<a:outer b:attr="1"> <inner a:id="2" plain="3">text &amp; more<b:leaf/> tail </inner>'
+            '<!-- comment --> </a:outer>after</root>')
+        for element in document.iter():
+            if not isinstance(element.tag, str):
+                continue
+            expected = Smev3Transform(etree.tostring(element, with_tail=False)).run()
+            self.assertEqual(expected, Smev3Transform(element).run())
+
+        outer = document[0]
+        self.assertEqual('<ns1:outer xmlns:ns1="urn://a" xmlns:ns2="urn://b" ns2:attr="1">'
+                         '<ns3:inner xmlns:ns3="urn://default" ns1:id="2" plain="3">'
+                         'text &amp; more<ns2:leaf></ns2:leaf> tail </ns3:inner></ns1:outer>',
+                         Smev3Transform(outer).run())
+        # дерево не изменяется
+        self.assertEqual('after', outer.tail)
+
+
+class TestLargeTransform(TestCase):
+
+    def test_deep(self):
+        depth = 10000
+        root = etree.Element('{urn://a}level')
+        element = root
+        for i in range(depth):
+            element = etree.SubElement(element, '{urn://%s}level' % 'ab'[i % 2], {'{urn://c}n': str(i)})
+        element.text = 'text'
+
+        result = Smev3Transform(root).run()
+        self.assertTrue(result.startswith('<ns1:level xmlns:ns1="urn://a">'
+                                          '<ns1:level xmlns:ns2="urn://c" ns2:n="0">'
+                                          '<ns3:level xmlns:ns3="urn://b" ns2:n="1">'))
+        self.assertTrue(result.endswith('text' + '</ns3:level></ns1:level>' * (depth // 2) + '</ns1:level>'))
+        self.assertEqual(3, result.count('xmlns:'))
+
+        # документ глубже 256 уровней разбирается из bytes
+        data = '<a xmlns="urn://a">%stext%s</a>' % ('<b>' * 1000, '</b>' * 1000)
+        self.assertEqual('<ns1:a xmlns:ns1="urn://a">%stext%s</ns1:a>' % ('<ns1:b>' * 1000, '</ns1:b>' * 1000),
+                         Smev3Transform(data).run())
+        self.assertEqual(Smev3Transform(data).run_bytes(), b''.join(Smev3StreamTransform(io.BytesIO(data.encode()))))
+
+    def test_wide(self):
+        count = 200000
+        root = etree.Element('{urn://a}list')
+        for i in range(count):
+            etree.SubElement(root, '{urn://b}item' if i % 2 else 'item').text = str(i)
+
+        result = Smev3Transform(root).run()
+        # привязка соседнего элемента не видна следующему, каждый объявляет namespace заново
+        self.assertEqual(count // 2, result.count('="urn://b"'))
+        self.assertTrue(result.startswith('<ns1:list xmlns:ns1="urn://a"><item>0</item>'
+                                          '<ns2:item xmlns:ns2="urn://b">1</ns2:item><item>2</item>'
+                                          '<ns3:item xmlns:ns3="urn://b">3</ns3:item>'))
@@ -0,0 +1,98 @@
+import io
+import urllib.request
+from unittest import TestCase
+
+from suds import WebFault
+
+from smev3.client import BaseSmev3Client
+from smev3.loadtest import Budget, LoadStats, client_class, main, percentile, run
+from smev3.plugins import UPRIDPlugin
+from smev3.stand import SmevStand
+from smev3.tests import CERT_FILE, KEY_FILE
+from smev3.tests.test_transport import person
+
+
+class TestSmevStand(TestCase):
+
+    def start(self, **options):
+        stand = SmevStand(**options).start()
+        self.addCleanup(stand.stop)
+        return stand, client_class(BaseSmev3Client, stand.wsdl_url, KEY_FILE, CERT_FILE)(UPRIDPlugin(person('Test')))
+
+    def test_wsdl(self):
+        stand, _ = self.start()
+        with urllib.request.urlopen(stand.wsdl_url) as response:
+            wsdl = response.read()
+        self.assertIn(('location="%s"' % stand.url).encode(), wsdl)
+
+    def test_exchange(self):
+        stand, client = self.start(check_digest=True)
+        message_id = 'db0486d0-3c08-11e5-95e2-d4c9eff07b77'
+        reply = client.send_request(message_id=message_id)
+        self.assertEqual(message_id, reply.MessageMetadata.MessageId)
+
+        message = client.get_response()
+        self.assertEqual(message_id, message.Response.OriginalMessageId)
+        # без Ack ответ выдается повторно
+        response_id = message.Response.SenderProvidedResponseData.MessageID
+        self.assertEqual(response_id, client.get_response().Response.SenderProvidedResponseData.MessageID)
+        client.ack(response_id)
+        self.assertIsNone(client.get_response())
+        self.assertEqual(dict(send=1, get=3, ack=1, faults=0, errors=0, digest_errors=0), stand.stats)
+
+    def test_digest_check(self):
+        stand, client = self.start(check_digest=True)
+        envelope = client.prepare_envelope(message_id='db0486d0-3c08-11e5-95e2-d4c9eff07b77')
+        with self.assertRaises(WebFault):
+            client.send_envelope(envelope.replace(b'>Test<', b'>Forged<'))
+        self.assertEqual(1, stand.stats['digest_errors'])
+        client.send_envelope(envelope)
+        self.assertEqual(1, stand.stats['send'])
+
+    def test_injected_errors(self):
+        stand, client = self.start(fault_rate=1.0)
+        with self.assertRaises(WebFault):
+            client.send_request()
+        stand.fault_rate, stand.error_rate = 0.0, 1.0
+        with self.assertRaises(Exception):
+            client.send_request()
+        self.assertEqual(1, stand.stats['faults'])
+        self.assertEqual(1, stand.stats['errors'])
+        self.assertEqual(0, stand.stats['send'])
+
+
+class TestLoadTest(TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(99, percentile(values, 99))
+        self.assertEqual(1, percentile([1], 90))
+        self.assertEqual(0.0, percentile([], 50))
+
+    def test_budget(self):
+        budget = Budget(messages=3)
+        self.assertEqual([1, 2, 3, None], [budget.next() for _ in range(4)])
+        self.assertIsNone(Budget(duration=-1).next())
+
+    def test_run(self):
+        with SmevStand(fault_rate=0.2, seed=1) as stand:
+            stats = run(stand.wsdl_url, concurrency=4, messages=40, size='512', scenario='roundtrip',
+                        key_file=KEY_FILE, cert_file=CERT_FILE)
+        summary = stats.summary()
+        self.assertEqual(40, summary['messages'] + summary['errors'])
+        self.assertEqual(summary['errors'], stats.errors.get('WebFault'))
+        self.assertLessEqual(summary['p50'], summary['p99'])
+        self.assertIsInstance(stats, LoadStats)
+
+        with SmevStand() as stand:
+            stats = run(stand.wsdl_url, concurrency=4, messages=20, use_async=True, key_file=KEY_FILE,
+                        cert_file=CERT_FILE)
+        self.assertEqual(20, stats.summary()['messages'])
+
+    def test_main(self):
+        out = io.StringIO()
+        self.assertEqual(0, main(['--messages', '10', '--concurrency', '2', '--check-digest', '--key', KEY_FILE,
+                                    '--cert', CERT_FILE], out=out))
+        self.assertIn('10 messages, 0 errors', out.getvalue())
+        self.assertIn('digest_errors=0', out.getvalue())
@@ -0,0 +1,195 @@
+import base64
+from unittest import TestCase
+
+from lxml import etree
+
+from smev3.envelope import EnvelopeTemplate
+from smev3.exceptions import SignatureVerificationError
+from smev3.plugins import SignPlugin
+from smev3.signer import GostR34102001Signer, load_public_key
+from smev3.tests import CERT_FILE, KEY_FILE
+from smev3.transform import Smev3Transform
+from smev3.utils import get_gost_r_3410_digest, load_certificate
+from smev3.verify import CertificateCache, SignatureVerifier, fingerprint, verify_many
+
+SIGNATURE = """<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#">
+<ds:SignedInfo>
+<ds:CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/>
+<ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#gostr34102001-gostr3411"/>
+<ds:Reference URI="#{uri}">
+<ds:Transforms>{transforms}</ds:Transforms>
+<ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#gostr3411"/>
+<ds:DigestValue></ds:DigestValue>
+</ds:Reference>
+</ds:SignedInfo>
+<ds:SignatureValue></ds:SignatureValue>
+<ds:KeyInfo><ds:X509Data><ds:X509Certificate>{certificate}</ds:X509Certificate></ds:X509Data></ds:KeyInfo>
+</ds:Signature>"""
+
+SMEV_TRANSFORMS = ('<ds:Transform Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/>'
+                   '<ds:Transform Algorithm="urn://smev-gov-ru/xmldsig/transform"/>')
+ENVELOPED_TRANSFORMS = ('<ds:Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>'
+                        '<ds:Transform Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/>')
+
+RESPONSE = """<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body>
+<ns2:GetResponseResponse xmlns:ns2="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/1.2"
+    xmlns:ns3="urn://x-artefacts-smev-gov-ru/services/message-exchange/types/basic/1.2">
+<ns2:ResponseMessage>
+<ns2:Response Id="SIGNED_BY_SMEV">
+<ns2:OriginalMessageId>db0486d0-3c08-11e5-95e2-d4c9eff07b77</ns2:OriginalMessageId>
+<ns2:SenderProvidedResponseData Id="SIGNED_BY_PROVIDER">
+<ns2:MessageID>{message_id}</ns2:MessageID>
+<ns2:To>eyJzaWQiOjMyODAxLCJtaWQiOiI</ns2:To>
+<ns3:MessagePrimaryContent><answer xmlns="urn://test" Id="CONTENT">ok <b>&amp;</b> done
+<ns2:PersonalSignature>{personal}</ns2:PersonalSignature>
+tail</answer></ns3:MessagePrimaryContent>
+</ns2:SenderProvidedResponseData>
+<ns2:SenderInformationSystemSignature>{provider}</ns2:SenderInformationSystemSignature>
+</ns2:Response>
+<ns2:SMEVSignature>{smev}</ns2:SMEVSignature>
+</ns2:ResponseMessage>
+</ns2:GetResponseResponse>
+</S:Body>
+</S:Envelope>"""
+
+NS_MAP = {'ds': 'http://www.w3.org/2000/09/xmldsig#'}
+
+
+def sign(document, signer):
+    """Подпись всех ds:Signature документа по XMLDSig"""
+    for signature in document.iterfind('.//ds:Signature', NS_MAP):
+        reference = signature.find('.//ds:Reference', NS_MAP)
+        element = document.getroottree().xpath('//*[@Id=$id]', id=reference.get('URI')[1:])[0]
+        algorithms = [t.get('Algorithm') for t in reference.iterfind('.//ds:Transform', NS_MAP)]
+        if 'urn://smev-gov-ru/xmldsig/transform' in algorithms:
+            data = Smev3Transform(etree.tostring(element)).run_bytes()
+        else:
+            parent, index, tail = signature.getparent(), signature.getparent().index(signature), signature.tail
+            parent.remove(signature)
+            data = etree.tostring(element, method='c14n', exclusive=True)
+            signature.tail = tail
+            parent.insert(index, signature)
+        reference.find('ds:DigestValue', NS_MAP).text = base64.b64encode(get_gost_r_3410_digest(data))
+        signed_info = etree.tostring(signature.find('ds:SignedInfo', NS_MAP), method='c14n', exclusive=True)
+        signature.find('ds:SignatureValue', NS_MAP).text = base64.b64encode(signer.sign(signed_info))
+    return etree.tostring(document)
+
+
+def response(message_id='00000000-0000-0000-0000-000000000001', certificate=None, signer=None):
+    certificate = certificate or load_certificate(CERT_FILE)
+    text = RESPONSE.format(
+        message_id=message_id,
+        personal=SIGNATURE.format(uri='CONTENT', transforms=ENVELOPED_TRANSFORMS, certificate=certificate),
+        provider=SIGNATURE.format(uri='SIGNED_BY_PROVIDER', transforms=SMEV_TRANSFORMS, certificate=certificate),
+        smev=SIGNATURE.format(uri='SIGNED_BY_SMEV', transforms=SMEV_TRANSFORMS, certificate=certificate))
+    return sign(etree.fromstring(text), signer or GostR34102001Signer.from_file(KEY_FILE))
+
+
+def forged_certificate(der, public_key=None, curve_oid=None):
+    """Копия тестового сертификата с подмененным открытым ключом или параметрами кривой, в base64"""
+    if public_key is not None:
+        point = load_public_key(der).point
+        size = len(point[0].to_bytes(32, 'little'))
+        original = b''.join(value.to_bytes(size, 'little') for value in point)
+        der = der.replace(original, b''.join(value.to_bytes(size, 'little') for value in public_key.point))
+    if curve_oid is not None:
+        der = der.replace(*curve_oid)
+    return base64.b64encode(der).decode()
+
+
+class TestSignatureVerifier(TestCase):
+
+    def setUp(self):
+        self.document = response()
+        self.der = base64.b64decode(load_certificate(CERT_FILE))
+
+    def test_valid(self):
+        results = SignatureVerifier(CertificateCache(trusted=[fingerprint(self.der)])).check(self.document, 'SMEVSignature', 'PersonalSignature')
+        self.assertEqual(['PersonalSignature', 'SenderInformationSystemSignature', 'SMEVSignature'],
+                         [result.name for result in results])
+
+    def test_tampered(self):
+        verifier = SignatureVerifier(CertificateCache(trusted=[fingerprint(self.der)]))
+        tampered = self.document.replace(b'done', b'undone')
+        results = {result.name: result for result in verifier.verify(tampered)}
+        self.assertFalse(results['PersonalSignature'].digest_valid)
+        self.assertFalse(results['SenderInformationSystemSignature'].valid)
+        # SMEVSignature подписывает Response целиком, включая измененный контент
+        self.assertFalse(results['SMEVSignature'].valid)
+        with self.assertRaises(SignatureVerificationError):
+            verifier.check(tampered)
+
+        value = etree.fromstring(self.document).find('.//ds:SignatureValue', NS_MAP).text
+        forged = self.document.replace(value.encode(), base64.b64encode(b'\1' * 64))
+        result = verifier.verify(forged)[0]
+        self.assertTrue(result.digest_valid)
+        self.assertFalse(result.signature_valid)
+
+    def test_sign_plugin(self):
+        plugin = SignPlugin(pkey_path=KEY_FILE, cert_path=CERT_FILE)
+        signed = plugin.sign_document(EnvelopeTemplate(plugin).render('db0486d0-3c08-11e5-95e2-d4c9eff07b77'))
+        cache = CertificateCache(trusted=[fingerprint(self.der)])
+        result, = SignatureVerifier(cache, sign_plugin_signed_info=True).verify(signed)
+        self.assertTrue(result.valid, result.error)
+        result, = SignatureVerifier(cache).verify(signed)
+        self.assertTrue(result.digest_valid)
+        self.assertFalse(result.signature_valid)
+
+    def test_missing_node(self):
+        document = etree.fromstring(self.document)
+        method = document.find('.//ds:SignatureMethod', NS_MAP)
+        method.getparent().remove(method)
+        result = SignatureVerifier(CertificateCache(trusted=[fingerprint(self.der)])).verify(document)[0]
+        self.assertFalse(result.valid)
+        self.assertEqual('Missing ds:SignatureMethod', result.error)
+
+    def test_certificate_cache(self):
+        with open(CERT_FILE, 'rb') as f:
+            pem = f.read()
+        calls = []
+
+        def validator(der):
+            calls.append(der)
+            return True
+
+        verifier = SignatureVerifier(CertificateCache(validator=validator))
+        for _ in range(3):
+            self.assertTrue(all(result.valid for result in verifier.verify(self.document)))
+        self.assertEqual(1, len(calls))
+
+        untrusted = SignatureVerifier(CertificateCache(trusted=['00' * 32]))
+        self.assertFalse(any(result.valid for result in untrusted.verify(self.document)))
+        trusted = SignatureVerifier(CertificateCache(trusted=[pem]))
+        results = trusted.verify(self.document)
+        self.assertTrue(all(result.valid for result in results))
+        self.assertEqual(fingerprint(base64.b64decode(load_certificate(CERT_FILE))), results[0].certificate)
+
+    def test_verify_many(self):
+        documents = [response('00000000-0000-0000-0000-%012d' % n) for n in range(4)]
+        documents.append(documents[0].replace(b'done', b'undone'))
+        self.assertFalse(any(result.valid for result in verify_many(documents[:1], processes=1)[0]))
+        results = verify_many(documents, processes=2, trusted=[fingerprint(self.der)])
+        self.assertEqual(5, len(results))
+        self.assertEqual([True] * 4 + [False], [all(result.valid for result in item) for item in results])
+
+    def test_foreign_key(self):
+        """Подпись своим ключом с сертификатом в KeyInfo не принимается без доверия к сертификату"""
+        signer = GostR34102001Signer(load_public_key(self.der).curve, 0x1234567890abcdef)
+        forged = response(certificate=forged_certificate(self.der, signer.public_key), signer=signer)
+        for verifier in (SignatureVerifier(), SignatureVerifier(CertificateCache(trusted=[fingerprint(self.der)]))):
+            results = verifier.verify(forged)
+            # подпись математически верна, но сертификат не доверенный
+            self.assertTrue(all(result.digest_valid and result.signature_valid for result in results))
+            self.assertFalse(any(result.valid for result in results))
+            with self.assertRaises(SignatureVerificationError):
+                verifier.check(forged)
+        self.assertEqual('untrusted certificate', SignatureVerifier().verify(forged)[0].error)
+
+    def test_unsupported_curve(self):
+        # параметры 1.2.643.2.2.36.0 тестового сертификата заменяются на неизвестные 1.2.643.2.2.36.9
+        certificate = forged_certificate(self.der, curve_oid=(b'\x06\x07\x2a\x85\x03\x02\x02\x24\x00',
+                                                              b'\x06\x07\x2a\x85\x03\x02\x02\x24\x09'))
+        results = SignatureVerifier().verify(response(certificate=certificate))
+        self.assertEqual(3, len(results))
+        self.assertIn('Unsupported GOST R 34.10-2001 parameter set', results[0].error)
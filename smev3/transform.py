@@ -1,122 +1,368 @@
-import re
-from lxml.etree import fromstring, tostring, Element, _Comment, SubElement
+from lxml.etree import _Element, fromstring, iterwalk, XMLParser
 
-TEXT = re.compile(r'[\w\d]')
-NAMESPACE = re.compile(r'^\{(.*)\}')
+DEFAULT_CHUNK_SIZE = 64 * 1024
 
+# метка номера префикса в CanonicalFragment: символ NUL недопустим в XML и не встречается в данных
+MARK = '\0'
 
-class Smev3Transform:
-    """Класс транформации xml элементов соггласно методочесикм рекомендациям"""
 
-    def __init__(self, xml):
-        """:param xml :type _Element / bytes / string"""
-        if isinstance(xml, str):
-            xml = xml.encode()
-        xml = fromstring(xml)
+def split_tag(tag):
+    """Разделение имени элемента/атрибута в нотации Кларка на namespace и локальное имя.
+    :param tag :type str
+    :return tuple (uri или None, локальное имя)"""
+    if tag[0] == '{':
+        uri, name = tag[1:].split('}', 1)
+        return uri, name
+    return None, tag
 
-        self.xml = xml
+
+def escape_text(text):
+    """Экранирование текстового узла по правилам c14n"""
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    if '\r' in text:
+        text = text.replace('\r', '&#xD;')
+    return text
+
+
+def escape_attrib(value):
+    """Экранирование значения атрибута по правилам c14n"""
+    if '&' in value:
+        value = value.replace('&', '&amp;')
+    if '<' in value:
+        value = value.replace('<', '&lt;')
+    if '"' in value:
+        value = value.replace('"', '&quot;')
+    if '\t' in value:
+        value = value.replace('\t', '&#x9;')
+    if '\n' in value:
+        value = value.replace('\n', '&#xA;')
+    if '\r' in value:
+        value = value.replace('\r', '&#xD;')
+    return value
+
+
+class ChunkBuffer:
+    """Буфер фрагментов канонической формы, отдающий их потребителю кусками bytes не меньше chunk_size"""
+
+    def __init__(self, callback, chunk_size=DEFAULT_CHUNK_SIZE):
+        """:param callback :type callable - потребитель кусков bytes
+        :param chunk_size :type int"""
+        self.callback = callback
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, part):
+        self.parts.append(part)
+        self.size += len(part)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            chunk = ''.join(self.parts).encode()
+            self.parts = []
+            self.size = 0
+            self.callback(chunk)
+
+
+class CanonicalWriter:
+    """Запись канонической формы по событиям разбора.
+
+    Реализует интерфейс parser target lxml (start/end/data/comment/pi/close), поэтому
+    используется как при обходе готового дерева, так и при потоковом разборе документа.
+
+    Область видимости namespaces одна на весь документ: новый uri добавляется в общую
+    таблицу и записывается в стек привязок, при закрытии элемента удаляются только
+    добавленные им привязки. Элемент без новых uri ничего не выделяет, поэтому затраты
+    линейны по размеру документа независимо от глубины вложенности."""
+
+    def __init__(self, write):
+        """:param write :type callable - приемник фрагментов канонической формы (str)"""
+        self.write = write
         self.ns_num = 1
-        self.element_id = 1
-        self.attrib_map = dict()
+        # uri -> префикс для открытых элементов
+        self.prefix_map = dict()
+        # uri в порядке объявления и число привязок на момент открытия каждого элемента
+        self.bound = []
+        self.marks = []
+        self.names = []
+        self.text = []
 
-    def get_ns(self, uri, prefix_map):
-        """Формирование нового namespace.
+    def get_ns(self, uri):
+        """Формирование нового namespace в области видимости текущего элемента.
         :param uri :type str
-        :param prefix_map :type dict
         :return str"""
         ns = 'ns%s' % self.ns_num
         self.ns_num += 1
-        prefix_map[uri] = ns
+        self.prefix_map[uri] = ns
+        self.bound.append(uri)
         return ns
 
-    def fake_attrib(self, attrib, prefix_map):
-        """ Создание "ложного" атрибута, для дальнейшей его подмена на настоящие атрибуты и namespaces.
-        :param attrib :type dict
-        :param prefix_map :type dict"""
-        attrib = self.sort_attrib(attrib, prefix_map)
+    def flush_text(self):
+        """Запись накопленного текстового узла, если он содержит что-то кроме пробельных символов"""
+        if self.text:
+            text = ''.join(self.text)
+            self.text = []
+            if not text.isspace():
+                self.write(escape_text(text))
+
+    def start(self, tag, attrib, nsmap=None):
+        self.flush_text()
+        self.marks.append(len(self.bound))
+
+        uri, name = split_tag(tag)
+        declaration = ''
+        if uri:
+            ns = self.prefix_map.get(uri)
+            if ns is None:
+                ns = self.get_ns(uri)
+                declaration = ' xmlns:%s="%s"' % (ns, escape_attrib(uri))
+            name = '%s:%s' % (ns, name)
 
+        self.write('<' + name + declaration)
         if attrib:
-            fake_attrib = dict(fake='id_%s' % self.element_id)
-            str_fake = '%s="%s"' % tuple(*fake_attrib.items())
-            self.element_id += 1
-            self.attrib_map[str_fake] = attrib
-        else:
-            fake_attrib = dict()
-        return fake_attrib
-
-    def transform(self, element, prefix_map=None, parent=None):
-        """Рекурсивная трансформация элементов.
-        :param element :type lxml.Element
-        :param prefix_map :type dict - мап namespaces
-        :return новый сконструированный lxml.Element"""
-        if prefix_map is None:
-            prefix_map = dict()
-
-        uri = element.nsmap[element.prefix]
-        ns = prefix_map.get(uri)
-
-        if ns is None:
-            ns = self.get_ns(uri, prefix_map)
-        ns_map = {ns: uri}
-
-        fake_attrib = self.fake_attrib(element.attrib, prefix_map)
-        if parent is not None:
-            new_element = SubElement(parent, element.tag, attrib=fake_attrib, nsmap=ns_map)
-        else:
-            new_element = Element(element.tag, attrib=fake_attrib, nsmap=ns_map)
-
-        children = element.getchildren()
-        if children:
-            for child in element.getchildren():
-                if not isinstance(child, _Comment):
-                    self.transform(child, dict(prefix_map), parent=new_element)
-        else:
-            if element.text and TEXT.findall(element.text):
-                new_element.text = element.text
-
-        return new_element
-
-    def sort_attrib(self, attrib, prefix_map):
+            self.write(self.sort_attrib(attrib))
+        self.write('>')
+        self.names.append(name)
+
+    def end(self, tag):
+        self.flush_text()
+        mark = self.marks.pop()
+        bound = self.bound
+        while len(bound) > mark:
+            del self.prefix_map[bound.pop()]
+        self.write('</%s>' % self.names.pop())
+
+    def data(self, data):
+        if self.names:
+            self.text.append(data)
+
+    def comment(self, text):
+        # комментарий отбрасывается, но разделяет текстовые узлы
+        self.flush_text()
+
+    def splice(self, fragment):
+        """Запись готовой канонической формы вложенного элемента вместо его обхода.
+        :param fragment :type CanonicalFragment
+        :return bool - форма записана; False, если namespaces элемента уже объявлены предками
+            и элемент нужно обойти"""
+        if not fragment.uris.isdisjoint(self.prefix_map):
+            return False
+        self.flush_text()
+        self.write(fragment.render(self.ns_num - 1))
+        # привязки элемента закрываются вместе с ним, остается только сдвиг счетчика
+        self.ns_num += fragment.count
+        return True
+
+    def pi(self, target, data=None):
+        self.flush_text()
+
+    def close(self):
+        self.flush_text()
+
+    def sort_attrib(self, attrib):
         """Сортировака атрибутов и namespaces.
         :param attrib :type dict
-        :param prefix_map :type dict
         :return str"""
 
-        l1 = []
-        l2 = []
+        qualified = []
+        unqualified = []
+        declarations = []
         result = []
 
         # разделям атрибуты с namespace и без
         for k, v in attrib.items():
-            uri = NAMESPACE.search(k)
+            uri, attr = split_tag(k)
             if uri:
-                uri = uri.group(1)
-                attr = NAMESPACE.sub('', k)
-                l1.append((uri, attr, v))
+                qualified.append((uri, attr, v))
             else:
-                l2.append((k, v))
+                unqualified.append((k, v))
 
-        # сортируем атрибуты с namespace по локальному названию
-        l1.sort(key=lambda x: (x[0], x[1]))
+        # сортируем атрибуты с namespace по uri и локальному названию
+        qualified.sort(key=lambda x: (x[0], x[1]))
 
-        l3 = []
-        for uri, attr, v in l1:
-            ns = prefix_map.get(uri)
+        for uri, attr, v in qualified:
+            ns = self.prefix_map.get(uri)
             if ns is None:
-                ns = self.get_ns(uri, prefix_map)
-                result.append('xmlns:%s="%s"' % (ns, uri))
+                ns = self.get_ns(uri)
+                declarations.append(' xmlns:%s="%s"' % (ns, escape_attrib(uri)))
             # "собираем" атрибут
-            l3.append(('%s:%s' % (ns, attr), v))
+            result.append(' %s:%s="%s"' % (ns, attr, escape_attrib(v)))
+
+        unqualified.sort(key=lambda x: x[0])
+        for k, v in unqualified:
+            result.append(' %s="%s"' % (k, escape_attrib(v)))
+        return ''.join(declarations) + ''.join(result)
+
+
+class RelocatableWriter(CanonicalWriter):
+    """Запись канонической формы с номерами префиксов в виде меток MARK<номер>MARK"""
+
+    def __init__(self, write):
+        super().__init__(write)
+        self.uris = set()
+
+    def get_ns(self, uri):
+        ns = '%s%s%s' % (MARK, self.ns_num, MARK)
+        self.ns_num += 1
+        self.prefix_map[uri] = ns
+        self.bound.append(uri)
+        self.uris.add(uri)
+        return ns
+
+    def splice(self, fragment):
+        # метки вложенной формы не перенумеровываются
+        return False
+
+
+class CanonicalFragment:
+    """Каноническая форма элемента для повторного использования в форме объемлющего элемента.
+
+    Префиксы нумеруются от начала преобразуемого документа, поэтому форма вложенного
+    элемента в составе объемлющего отличается от его собственной только сдвигом номеров,
+    если ни один из его namespaces не объявлен предками. Элемент обходится один раз,
+    номера префиксов хранятся метками и подставляются со сдвигом при выдаче формы.
+    Элемент не должен изменяться, пока форма используется."""
+
+    def __init__(self, element):
+        """:param element :type lxml.etree._Element"""
+        parts = []
+        writer = RelocatableWriter(parts.append)
+        Smev3Transform(element).transform(element, writer)
+        writer.close()
+        self.element = element
+        self.uris = frozenset(writer.uris)
+        self.count = writer.ns_num - 1
+        self.parts = ''.join(parts).split(MARK)
+        self.numbers = [int(number) for number in self.parts[1::2]]
+
+    def render(self, offset=0):
+        """Каноническая форма с номерами префиксов, сдвинутыми на offset
+        :return str"""
+        parts = list(self.parts)
+        parts[1::2] = ['ns%s' % (number + offset) for number in self.numbers]
+        return ''.join(parts)
+
+    def run_bytes(self):
+        """Собственная каноническая форма элемента"""
+        return self.render().encode()
+
+
+class Smev3Transform:
+    """Класс транформации xml элементов соггласно методочесикм рекомендациям.
+
+    Каноническая форма пишется напрямую за один обход дерева: префиксы namespaces
+    перенумеровываются, атрибуты сортируются, комментарии, processing instructions
+    и текстовые узлы из одних пробельных символов отбрасываются."""
+
+    def __init__(self, xml):
+        """:param xml :type bytes / string / lxml.etree._Element - документ или элемент разобранного дерева.
+        Элемент преобразуется на месте, без сериализации: имена в нотации Кларка уже содержат
+        uri, поэтому namespaces, объявленные у предков элемента, учитываются; tail элемента
+        в каноническую форму не входит."""
+        if not isinstance(xml, _Element):
+            if isinstance(xml, str):
+                xml = xml.encode()
+            # без huge_tree libxml2 ограничивает глубину документа 256 уровнями
+            xml = fromstring(xml, XMLParser(huge_tree=True))
+
+        self.xml = xml
+
+    def transform(self, element, writer, fragments=None):
+        """Обход элемента с передачей событий в writer.
+        Обход выполняет iterwalk lxml без рекурсии, глубина документа не ограничена стеком Python.
+        :param element :type lxml.Element
+        :param writer :type CanonicalWriter
+        :param fragments :type dict {вложенный элемент: CanonicalFragment} - готовые формы, вставляемые без обхода"""
+        walker = iterwalk(element, events=('start', 'end', 'comment', 'pi'))
+        spliced = None
+        for event, node in walker:
+            if event == 'start':
+                if fragments and node in fragments and writer.splice(fragments[node]):
+                    walker.skip_subtree()
+                    spliced = node
+                    continue
+                writer.start(node.tag, node.attrib)
+                if node.text:
+                    writer.data(node.text)
+                continue
+            if event == 'end':
+                if node is spliced:
+                    spliced = None
+                else:
+                    writer.end(node.tag)
+                if node is element:
+                    break
+            else:
+                # комментарии и processing instructions отбрасываются, их tail остается
+                writer.comment(None)
+            if node.tail:
+                writer.data(node.tail)
+
+    def write_to(self, callback, chunk_size=DEFAULT_CHUNK_SIZE, fragments=None):
+        """Передача канонической формы потребителю кусками bytes, без сборки документа целиком.
+        :param callback :type callable - например update() объекта хэша
+        :param chunk_size :type int
+        :param fragments :type dict {вложенный элемент: CanonicalFragment}"""
+        buffer = ChunkBuffer(callback, chunk_size)
+        writer = CanonicalWriter(buffer.write)
+        self.transform(self.xml, writer, fragments)
+        writer.close()
+        buffer.flush()
+
+    def run_bytes(self, fragments=None):
+        """Каноническая форма в виде bytes (utf-8)"""
+        return self.run(fragments).encode()
+
+    def run(self, fragments=None):
+        parts = []
+        writer = CanonicalWriter(parts.append)
+        self.transform(self.xml, writer, fragments)
+        writer.close()
+        return ''.join(parts)
+
+
+class Smev3StreamTransform:
+    """Потоковая трансформация документа из file-like объекта.
+
+    Документ разбирается инкрементально (parser target), поэтому ни входное дерево,
+    ни каноническая форма целиком в памяти не хранятся. Итерирование отдает куски bytes."""
+
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        """:param source :type file-like объект, открытый в бинарном режиме
+        :param chunk_size :type int - минимальный размер отдаваемого куска"""
+        self.source = source
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        chunks = []
+        buffer = ChunkBuffer(chunks.append, self.chunk_size)
+        writer = CanonicalWriter(buffer.write)
+        parser = XMLParser(target=writer, huge_tree=True)
 
-        l2.sort(key=lambda x: x[0])
-        l3.extend(l2)
+        while True:
+            data = self.source.read(self.READ_SIZE)
+            if not data:
+                break
+            parser.feed(data)
+            if chunks:
+                yield from chunks
+                chunks.clear()
 
-        for k, v in l3:
-            result.append('%s="%s"' % (k, v))
-        return ' '.join(result)
+        parser.close()
+        buffer.flush()
+        yield from chunks
 
-    def run(self):
-        xml = tostring(self.transform(self.xml), method='c14n', exclusive=True,  with_comments=False).decode()
-        for k, v in self.attrib_map.items():
-            xml = xml.replace(k, v)
-        return xml
+    def write_to(self, callback):
+        """Передача канонической формы потребителю кусками bytes.
+        :param callback :type callable"""
+        for chunk in self:
+            callback(chunk)
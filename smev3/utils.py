@@ -2,6 +2,7 @@ import re
 import subprocess
 
 from lxml import etree
+from smev3.digest import new_digest
 from smev3.exceptions import CertificateError
 
 
@@ -34,16 +35,26 @@ def get_gost_r_34102001_signature(data, pkey_filename, passwd=None):
     return run_openssl(args, data)
 
 
-def get_gost_r_3410_digest(data):
-    args = ['dgst', '-binary', '-md_gost94']
-    return run_openssl(args, data)
+def get_gost_r_3410_digest(data, backend=None):
+    """Хэш ГОСТ Р 34.11-94.
+    :param data :type bytes
+    :param backend :type str / DigestBackend - бэкенд хэширования, по умолчанию из smev3.digest"""
+    return new_digest(data, backend=backend).digest()
+
+
+def get_gost_r_3410_stream_digest(chunks):
+    """Хэш ГОСТ Р 34.11-94 по итерируемому набору кусков bytes"""
+    digest = new_digest()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.digest()
 
 
-def run_openssl(openssl_args, stdin, timeout=10):
+def run_openssl(openssl_args, stdin, timeout=10, env=None):
     args = ['openssl'] + openssl_args
     popen = subprocess.Popen(
         args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        start_new_session=True)
+        start_new_session=True, env=env)
     stdout, stderr = popen.communicate(input=stdin, timeout=timeout)
     if popen.returncode != 0:
         raise subprocess.CalledProcessError(popen.returncode, args, stderr.decode('utf-8'))
@@ -0,0 +1,262 @@
+import base64
+import binascii
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+from smev3.asn1 import pem_to_der
+from smev3.digest import new_digest
+from smev3.exceptions import CertificateError, SignatureVerificationError, SignerError
+from smev3.signer import load_public_key
+from smev3.transform import Smev3Transform
+
+DS = 'http://www.w3.org/2000/09/xmldsig#'
+NS_MAP = {'ds': DS}
+
+EXC_C14N = 'http://www.w3.org/2001/10/xml-exc-c14n#'
+ENVELOPED_SIGNATURE = 'http://www.w3.org/2000/09/xmldsig#enveloped-signature'
+SMEV_TRANSFORMS = ('urn://smev-gov-ru/xmldsig/transform', 'urn://smev-gov-ru/xmldsig/run')
+DIGEST_METHODS = ('http://www.w3.org/2001/04/xmldsig-more#gostr3411',
+                  'urn:ietf:params:xml:ns:cpxmlsec:algorithms:gostr3411')
+SIGNATURE_METHODS = ('http://www.w3.org/2001/04/xmldsig-more#gostr34102001-gostr3411',
+                     'urn:ietf:params:xml:ns:cpxmlsec:algorithms:gostr34102001-gostr3411')
+
+
+def fingerprint(der):
+    """SHA-256 отпечаток сертификата в hex"""
+    return hashlib.sha256(der).hexdigest()
+
+
+def trusted_fingerprint(item):
+    """Отпечаток из отпечатка hex или сертификата PEM/DER"""
+    if isinstance(item, str):
+        return item.lower()
+    if item.lstrip().startswith(b'-----'):
+        item = pem_to_der(item, 'CERTIFICATE')[1]
+    return fingerprint(item)
+
+
+def remove_signature(element, signature):
+    """Копия element без вложенной подписи (преобразование enveloped-signature)"""
+    index = list(element.iter()).index(signature)
+    element = copy.deepcopy(element)
+    signature = list(element.iter())[index]
+    parent = signature.getparent()
+    if signature.tail:
+        # текст после подписи остается в документе
+        previous = signature.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + signature.tail
+        else:
+            parent.text = (parent.text or '') + signature.tail
+    parent.remove(signature)
+    return element
+
+
+class CertificateCache:
+    """Кэш разобранных сертификатов и решений о доверии по отпечатку.
+
+    Сертификат разбирается, а доверие к нему проверяется один раз; повторная
+    подпись того же отправителя стоит только хэша и проверки подписи. Доверенными
+    считаются только сертификаты с отпечатками из trusted или одобренные validator(der):
+    без них ни одна подпись не признается действительной, так как сертификат из KeyInfo
+    может выпустить себе кто угодно."""
+
+    def __init__(self, trusted=None, validator=None, max_size=256):
+        """:param trusted - отпечатки SHA-256 (hex) или сертификаты PEM/DER bytes
+        :param validator - функция validator(der) -> bool, например проверка цепочки через openssl
+        :param max_size :type int - число хранимых сертификатов"""
+        self.trusted = {trusted_fingerprint(item) for item in trusted or ()}
+        self.validator = validator
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_trusted(self, der, key):
+        return key in self.trusted or (self.validator is not None and bool(self.validator(der)))
+
+    def get(self, der):
+        """Отпечаток, открытый ключ и признак доверия сертификата
+        :param der :type bytes
+        :return tuple (str, GostR34102001PublicKey, bool)"""
+        key = fingerprint(der)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = (key, load_public_key(der).precompute(), self.is_trusted(der, key))
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class VerificationResult:
+    """Результат проверки одной подписи ds:Signature"""
+
+    def __init__(self, name, digest_valid=False, signature_valid=False, trusted=False, certificate=None, error=None):
+        """:param name :type str - элемент, содержащий подпись (SMEVSignature, PersonalSignature...)
+        :param certificate :type str - отпечаток сертификата"""
+        self.name = name
+        self.digest_valid = digest_valid
+        self.signature_valid = signature_valid
+        self.trusted = trusted
+        self.certificate = certificate
+        self.error = error
+
+    @property
+    def valid(self):
+        return self.digest_valid and self.signature_valid and self.trusted
+
+    def __repr__(self):
+        return '<VerificationResult %s %s>' % (self.name, 'valid' if self.valid else self.error or 'invalid')
+
+
+def required(parent, path):
+    """Обязательный дочерний элемент подписи
+    :raise SignatureVerificationError - элемента нет"""
+    element = parent.find(path, NS_MAP)
+    if element is None:
+        raise SignatureVerificationError('Missing %s' % path)
+    return element
+
+
+class SignatureVerifier:
+    """Проверка подписей XMLDSig ГОСТ Р 34.10-2001 во входящих сообщениях СМЭВ.
+
+    По умолчанию SignedInfo проверяется по XMLDSig: подписана его форма exc-c14n, как в
+    подписях СМЭВ. Подписи smev3.plugins.SignPlugin устроены иначе - подписан base64 хэша
+    формы SignedInfo после преобразования СМЭВ 3 при том же CanonicalizationMethod,
+    поэтому собственные подписи библиотеки проверяются с sign_plugin_signed_info=True."""
+
+    def __init__(self, certificates=None, sign_plugin_signed_info=False):
+        """:param certificates :type CertificateCache - по умолчанию без доверенных сертификатов,
+            все подписи недействительны
+        :param sign_plugin_signed_info :type bool - SignedInfo подписан как в SignPlugin"""
+        self.certificates = certificates or CertificateCache()
+        self.sign_plugin_signed_info = sign_plugin_signed_info
+
+    def referenced_element(self, signature, uri):
+        if not uri.startswith('#'):
+            raise SignatureVerificationError('Unsupported reference URI %s' % uri)
+        found = signature.getroottree().xpath('//*[@Id=$id]', id=uri[1:])
+        if len(found) != 1:
+            raise SignatureVerificationError('Referenced element %s not found' % uri)
+        return found[0]
+
+    def reference_digest(self, signature, reference):
+        """Хэш элемента, на который ссылается ds:Reference, после указанных в ней преобразований
+        :return bytes"""
+        method = required(reference, 'ds:DigestMethod').get('Algorithm')
+        if method not in DIGEST_METHODS:
+            raise SignatureVerificationError('Unsupported digest method %s' % method)
+        element = self.referenced_element(signature, reference.get('URI', ''))
+        transforms = [t.get('Algorithm') for t in reference.iterfind('ds:Transforms/ds:Transform', NS_MAP)]
+
+        if ENVELOPED_SIGNATURE in transforms and element in signature.iterancestors():
+            element = remove_signature(element, signature)
+
+        digest = new_digest()
+        if any(t in SMEV_TRANSFORMS for t in transforms):
+            Smev3Transform(element).write_to(digest.update)
+        elif all(t in (EXC_C14N, ENVELOPED_SIGNATURE) for t in transforms):
+            digest.update(etree.tostring(element, method='c14n', exclusive=True, with_comments=False))
+        else:
+            raise SignatureVerificationError('Unsupported transforms %s' % ', '.join(transforms))
+        return digest.digest()
+
+    def verify_signature(self, signature):
+        """Проверка одной подписи
+        :param signature :type lxml.etree._Element - ds:Signature
+        :return VerificationResult"""
+        result = VerificationResult(etree.QName(signature.getparent()).localname)
+        try:
+            signed_info = required(signature, 'ds:SignedInfo')
+            method = required(signed_info, 'ds:SignatureMethod').get('Algorithm')
+            if method not in SIGNATURE_METHODS:
+                raise SignatureVerificationError('Unsupported signature method %s' % method)
+            c14n = required(signed_info, 'ds:CanonicalizationMethod').get('Algorithm')
+            if c14n != EXC_C14N:
+                raise SignatureVerificationError('Unsupported canonicalization method %s' % c14n)
+
+            result.digest_valid = all(
+                self.reference_digest(signature, reference) == base64.b64decode(
+                    reference.findtext('ds:DigestValue', '', NS_MAP))
+                for reference in signed_info.iterfind('ds:Reference', NS_MAP))
+
+            der = base64.b64decode(signature.findtext('ds:KeyInfo/ds:X509Data/ds:X509Certificate', '', NS_MAP))
+            result.certificate, public_key, result.trusted = self.certificates.get(der)
+            value = base64.b64decode(signature.findtext('ds:SignatureValue', '', NS_MAP))
+            result.signature_valid = public_key.verify(self.signed_data(signed_info), value)
+            if result.digest_valid and result.signature_valid and not result.trusted:
+                result.error = 'untrusted certificate'
+        except (SignatureVerificationError, CertificateError, SignerError, binascii.Error) as e:
+            result.error = str(e) or type(e).__name__
+        return result
+
+    def signed_data(self, signed_info):
+        """Данные, подпись которых содержит SignatureValue"""
+        if self.sign_plugin_signed_info:
+            digest = new_digest()
+            Smev3Transform(signed_info).write_to(digest.update)
+            return base64.b64encode(digest.digest())
+        return etree.tostring(signed_info, method='c14n', exclusive=True, with_comments=False)
+
+    def verify(self, document):
+        """Проверка всех подписей документа
+        :param document :type bytes / lxml.etree._Element
+        :return list VerificationResult"""
+        if not isinstance(document, etree._Element):
+            document = etree.fromstring(document)
+        return [self.verify_signature(signature) for signature in document.iterfind('.//ds:Signature', NS_MAP)]
+
+    def check(self, document, *names):
+        """Проверка подписей с исключением при ошибке
+        :param names - элементы с обязательными подписями, например 'SMEVSignature'
+        :return list VerificationResult"""
+        results = self.verify(document)
+        if not results:
+            raise SignatureVerificationError('Document is not signed')
+        for result in results:
+            if not result.valid:
+                raise SignatureVerificationError('Invalid signature %r' % result)
+        missing = set(names) - {result.name for result in results}
+        if missing:
+            raise SignatureVerificationError('Missing signatures %s' % ', '.join(sorted(missing)))
+        return results
+
+
+_worker_verifier = None
+
+
+def _init_worker(trusted, max_size):
+    global _worker_verifier
+    _worker_verifier = SignatureVerifier(CertificateCache(trusted=trusted, max_size=max_size))
+
+
+def _verify_one(document):
+    try:
+        return _worker_verifier.verify(document)
+    except etree.XMLSyntaxError as e:
+        return [VerificationResult(None, error=str(e))]
+
+
+def verify_many(documents, processes=None, chunksize=4, trusted=None, max_size=256):
+    """Параллельная проверка подписей множества ответов в пуле процессов.
+    Каждый процесс держит свой кэш сертификатов; validator в процессы не передается,
+    доверие задается отпечатками trusted, без них все подписи недействительны.
+    :param documents - итерируемый набор документов bytes
+    :return list списков VerificationResult в порядке документов"""
+    trusted = [trusted_fingerprint(item) for item in trusted or ()]
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(trusted, max_size)) as executor:
+        return list(executor.map(_verify_one, documents, chunksize=chunksize))